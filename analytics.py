@@ -0,0 +1,198 @@
+import time
+from collections import OrderedDict
+from datetime import date, timedelta
+from typing import NamedTuple
+
+import numpy as np
+
+WINDOWS = (30, 90, 365)
+ROLLING_DAYS = 7
+
+
+class FoodTotal(NamedTuple):
+    food_id: int
+    calories: float
+    grams: float
+    entries: int
+
+
+class WindowStats(NamedTuple):
+    days: int
+    logged_days: int
+    total_calories: float
+    avg_calories: float
+    trend_per_week: float
+    rolling_low: float
+    rolling_high: float
+    goal_days: int
+    top_foods: list
+
+
+class NutritionReport(NamedTuple):
+    day: date
+    calorie_goal: float
+    rolling_avg: float
+    logging_streak: int
+    goal_streak: int
+    longest_goal_streak: int
+    windows: dict
+
+
+def _array(values, dtype):
+    return np.asarray(values if values is not None else [], dtype=dtype)
+
+
+def _trailing_run(mask):
+    misses = np.flatnonzero(~mask)
+    return int(len(mask) - (misses[-1] + 1 if misses.size else 0))
+
+
+def _longest_run(mask):
+    edges = np.flatnonzero(np.diff(np.concatenate(([0], mask.astype(np.int8), [0]))))
+    return int((edges[1::2] - edges[::2]).max()) if edges.size else 0
+
+
+def _current_streak(mask):
+    # Today still counts as open: a streak that ran through yesterday is
+    # kept until the day is over.
+    return _trailing_run(mask) if mask[-1] else _trailing_run(mask[:-1])
+
+
+def build_report(day: date, calorie_goal, days, totals, food_ids, food_days, calories, grams, top: int = 5):
+    # Computes every window from the arrays of the longest one. `days` and
+    # `food_days` are offsets from the first day of that window.
+    span = WINDOWS[-1]
+    daily = np.zeros(span)
+    logged = np.zeros(span, dtype=bool)
+    days = _array(days, np.int64)
+    daily[days] = _array(totals, np.float64)
+    logged[days] = True
+
+    # Rolling averages are per logged day, so days without entries don't
+    # drag them down; windows with no logged day at all are NaN.
+    kernel = np.ones(ROLLING_DAYS)
+    rolling_sum = np.convolve(daily, kernel, "valid")
+    rolling_count = np.convolve(logged, kernel, "valid")
+    with np.errstate(invalid="ignore", divide="ignore"):
+        rolling = np.where(rolling_count > 0, rolling_sum / rolling_count, np.nan)
+
+    on_goal = logged & (daily <= calorie_goal) if calorie_goal else np.zeros(span, dtype=bool)
+
+    food_days = _array(food_days, np.int64)
+    food_ids, food_index = np.unique(_array(food_ids, np.int64), return_inverse=True)
+    calories = _array(calories, np.float64)
+    grams = _array(grams, np.float64)
+
+    windows = {}
+    for length in WINDOWS:
+        start = span - length
+        window_logged = logged[start:]
+        window_daily = daily[start:]
+        logged_days = int(window_logged.sum())
+        total = float(window_daily.sum())
+        trend = 0.0
+        if logged_days >= 2:
+            x = np.flatnonzero(window_logged)
+            trend = float(np.polyfit(x, window_daily[x], 1)[0] * 7)
+        window_rolling = rolling[max(start - ROLLING_DAYS + 1, 0):]
+        has_rolling = not np.isnan(window_rolling).all()
+
+        selected = food_days >= start
+        index = food_index[selected]
+        food_calories = np.bincount(index, weights=calories[selected], minlength=len(food_ids))
+        food_grams = np.bincount(index, weights=grams[selected], minlength=len(food_ids))
+        food_entries = np.bincount(index, minlength=len(food_ids))
+        order = np.argsort(-food_calories, kind="stable")[:top]
+        top_foods = [
+            FoodTotal(int(food_ids[i]), float(food_calories[i]), float(food_grams[i]), int(food_entries[i]))
+            for i in order if food_entries[i]
+        ]
+
+        windows[length] = WindowStats(
+            days=length,
+            logged_days=logged_days,
+            total_calories=total,
+            avg_calories=total / logged_days if logged_days else 0.0,
+            trend_per_week=trend,
+            rolling_low=float(np.nanmin(window_rolling)) if has_rolling else 0.0,
+            rolling_high=float(np.nanmax(window_rolling)) if has_rolling else 0.0,
+            goal_days=int(on_goal[start:].sum()),
+            top_foods=top_foods,
+        )
+
+    return NutritionReport(
+        day=day,
+        calorie_goal=calorie_goal,
+        rolling_avg=0.0 if np.isnan(rolling[-1]) else float(rolling[-1]),
+        logging_streak=_current_streak(logged),
+        goal_streak=_current_streak(on_goal),
+        longest_goal_streak=_longest_run(on_goal),
+        windows=windows,
+    )
+
+
+class CachedReport(NamedTuple):
+    report: NutritionReport
+    version: tuple
+    checked_at: float
+
+
+class AnalyticsCache:
+    # Keeps each user's NutritionReport until a new log entry or goal change
+    # arrives (the bot calls invalidate() for both) or the day rolls over.
+    # Writes made elsewhere (another instance, an import or a backfill) are
+    # caught by comparing storage.nutrition_version() with the cached one
+    # once the report is `ttl` seconds old; ttl=0 checks on every read.
+    # Least recently used reports beyond `max_users` are dropped.
+
+    def __init__(self, storage, max_users: int = 10000, ttl: float = 600):
+        self._storage = storage
+        self.max_users = max_users
+        self.ttl = ttl
+        self._reports = OrderedDict()
+        self._epoch = 0
+        self.hits = 0
+        self.misses = 0
+        self.build_seconds = 0.0
+
+    async def report(self, user_id: int, day: date):
+        cached = self._reports.get(user_id)
+        if cached is not None and cached.report.day == day:
+            if time.monotonic() - cached.checked_at >= self.ttl:
+                version = await self._storage.nutrition_version(user_id)
+                if version == cached.version:
+                    cached = self._reports[user_id] = cached._replace(checked_at=time.monotonic())
+                else:
+                    cached = None
+            if cached is not None:
+                self._reports.move_to_end(user_id)
+                self.hits += 1
+                return cached.report
+        self.misses += 1
+        epoch = self._epoch
+        version = await self._storage.nutrition_version(user_id)
+        first = day - timedelta(days=WINDOWS[-1] - 1)
+        history = await self._storage.nutrition_history(user_id, first, WINDOWS[-1])
+        started = time.perf_counter()
+        report = build_report(day, *history)
+        self.build_seconds += time.perf_counter() - started
+        # Same rule as the food catalog: a write that raced the query is
+        # served once but not cached.
+        if epoch == self._epoch:
+            self._reports[user_id] = CachedReport(report, version, time.monotonic())
+            self._reports.move_to_end(user_id)
+            while len(self._reports) > self.max_users:
+                self._reports.popitem(last=False)
+        return report
+
+    def invalidate(self, user_id: int):
+        self._epoch += 1
+        self._reports.pop(user_id, None)
+
+    def stats(self):
+        return {
+            "users": len(self._reports),
+            "hits": self.hits,
+            "misses": self.misses,
+            "build_seconds": self.build_seconds,
+        }
@@ -0,0 +1,93 @@
+"""Seed synthetic DailyLog history (negative user ids) and check with
+EXPLAIN ANALYZE that the daily summary is served by idx_dailylog_user_date
+and the weekly summary by the DailyCalories primary key rather than by
+sequential scans.
+
+    python -m benchmarks.explain_summaries --rows 10000000
+"""
+import argparse
+import asyncio
+import json
+import sys
+from datetime import datetime, timedelta
+
+import log_partitions
+from food_log_bot import backfill_daily_rollup, close_db_pool, create_db_pool, day_bounds, db_connection, init_db
+from storage import DAILY_SUMMARY_SQL, WEEKLY_SUMMARY_SQL
+
+INDEX_NODES = {"Index Scan", "Index Only Scan", "Bitmap Heap Scan"}
+
+async def seed(conn, rows: int, users: int, days: int):
+    existing = await conn.fetchval("SELECT COUNT(*) FROM DailyLog WHERE user_id < 0")
+    if existing >= rows:
+        print(f"Using {existing} existing synthetic rows")
+        return
+    food_id = await conn.fetchval("SELECT MIN(food_id) FROM Foods WHERE user_id IS NULL")
+    await conn.execute("""
+        INSERT INTO Users (user_id, first_name)
+        SELECT -g, 'bench' FROM generate_series(1, $1) g
+        ON CONFLICT (user_id) DO NOTHING
+    """, users)
+    today = datetime.now().date()
+    await log_partitions.ensure_partitions(conn, today - timedelta(days=days), today + timedelta(days=1))
+    print(f"Inserting {rows - existing} synthetic rows for {users} users over {days} days...")
+    await conn.execute("""
+        INSERT INTO DailyLog (user_id, food_id, weight_grams, calories, log_date)
+        SELECT -(1 + g % $2), $3, 100, 130,
+               date_trunc('day', now()) + interval '1 day' - (g % ($4 * 1440)) * interval '1 minute'
+        FROM generate_series(1, $1) g
+    """, rows - existing, users, food_id, days)
+    await conn.execute("ANALYZE DailyLog")
+    await backfill_daily_rollup()
+    await conn.execute("ANALYZE DailyCalories")
+
+def scans_on(plan: dict, relation: str):
+    # DailyLog is partitioned, so its scans name partitions (dailylog_p2026_01).
+    name = plan.get("Relation Name", "").lower()
+    if name == relation or name.startswith(f"{relation}_p") or name == f"{relation}_default":
+        yield plan
+    for child in plan.get("Plans", []):
+        yield from scans_on(child, relation)
+
+async def explain(conn, name: str, relation: str, sql: str, *args):
+    raw = await conn.fetchval(f"EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) {sql}", *args)
+    result = json.loads(raw)[0]
+    nodes = list(scans_on(result["Plan"], relation))
+    ok = bool(nodes) and all(node["Node Type"] in INDEX_NODES for node in nodes)
+    for node in nodes:
+        index = node.get("Index Name") or next((c["Index Name"] for c in node.get("Plans", []) if "Index Name" in c), "-")
+        print(f"  {name}: {node['Node Type']} on {node['Relation Name']} using {index}")
+    print(f"  {name}: {result['Execution Time']:.2f} ms -> {'OK' if ok else 'NOT USING INDEX'}")
+    return ok
+
+async def run(args):
+    await create_db_pool()
+    try:
+        await init_db()
+        async with db_connection() as conn:
+            await seed(conn, args.rows, args.users, args.days)
+            total = await conn.fetchval("SELECT reltuples::bigint FROM pg_class WHERE relname = 'dailylog'")
+            print(f"DailyLog holds ~{total} rows")
+            now = datetime.now()
+            start, end = day_bounds(now, days=7)
+            ok = await explain(conn, "daily", "dailylog", DAILY_SUMMARY_SQL, -1, *day_bounds(now))
+            ok &= await explain(conn, "weekly", "dailycalories", WEEKLY_SUMMARY_SQL, -1, start.date(), end.date())
+            if args.cleanup:
+                await conn.execute("DELETE FROM DailyLog WHERE user_id < 0")
+                await conn.execute("DELETE FROM DailyCalories WHERE user_id < 0")
+                await conn.execute("DELETE FROM Users WHERE user_id < 0")
+    finally:
+        await close_db_pool()
+    return ok
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, default=10_000_000)
+    parser.add_argument("--users", type=int, default=10_000)
+    parser.add_argument("--days", type=int, default=365)
+    parser.add_argument("--cleanup", action="store_true", help="delete the synthetic rows afterwards")
+    args = parser.parse_args()
+    sys.exit(0 if asyncio.run(run(args)) else 1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+"""Push the daily goal-progress report to synthetic users through the real
+scheduler and OutboundQueue, with a stub Bot session that answers after a
+simulated latency and can answer every Nth call with a 429. Flood waits are
+handled by the same RateLimitMiddleware the bot installs, its bot-wide rate
+set to --rate. Reports the achieved send rate against the token-bucket
+rate, time spent fetching keyset pages, and how many flood waits were
+retried.
+
+    python -m benchmarks.fanout --users 20000 --rate 500 --flood-every 1000
+"""
+import argparse
+import asyncio
+import itertools
+import time
+from contextlib import asynccontextmanager
+from datetime import datetime
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramRetryAfter
+
+import food_log_bot
+import scheduler
+from benchmarks.load import StubSession
+from food_log_bot import close_db_pool, create_db_pool, db_connection, init_db
+from outbound import OutboundQueue, RateLimiter, RateLimitMiddleware
+from storage import PostgresStorage
+
+USER_ID_OFFSET = 9_100_000_000
+
+class FloodStubSession(StubSession):
+    def __init__(self, latency: float = 0.0, flood_every: int = 0, retry_after: int = 1):
+        super().__init__(latency)
+        self.flood_every = flood_every
+        self.retry_after = retry_after
+        self.calls = itertools.count(1)
+
+    async def make_request(self, bot, method, timeout=None):
+        if self.flood_every and next(self.calls) % self.flood_every == 0:
+            raise TelegramRetryAfter(method=method, message="Too Many Requests", retry_after=self.retry_after)
+        return await super().make_request(bot, method, timeout)
+
+async def seed(user_ids: list, day):
+    async with db_connection() as conn:
+        await conn.execute("""
+            INSERT INTO Users (user_id, first_name, calorie_goal)
+            SELECT id, 'bench', 2000 FROM unnest($1::bigint[]) id
+            ON CONFLICT (user_id) DO UPDATE SET calorie_goal = EXCLUDED.calorie_goal
+        """, user_ids)
+        # Every other user has logged something today.
+        await conn.execute("""
+            INSERT INTO DailyCalories (user_id, log_day, total_calories, total_grams, entry_count)
+            SELECT id, $2, 1000 + id % 2000, 500, 3 FROM unnest($1::bigint[]) id
+            ON CONFLICT (user_id, log_day) DO NOTHING
+        """, user_ids[::2], day)
+
+async def cleanup(user_ids: list):
+    async with db_connection() as conn:
+        async with conn.transaction():
+            await conn.execute("DELETE FROM DailyCalories WHERE user_id = ANY($1::bigint[])", user_ids)
+            await conn.execute("DELETE FROM Users WHERE user_id = ANY($1::bigint[])", user_ids)
+
+async def run(args):
+    session = FloodStubSession(args.api_latency / 1000, args.flood_every, args.retry_after)
+    bot = Bot(token="123456:" + "A" * 35, session=session)
+    limiter = RateLimiter(args.rate, chat_rate=food_log_bot.SEND_LIMIT_CONFIG["chat_rate"],
+                          chat_burst=food_log_bot.SEND_LIMIT_CONFIG["chat_burst"])
+    bot.session.middleware(RateLimitMiddleware(limiter, food_log_bot.SEND_LIMIT_CONFIG["max_retries"]))
+    user_ids = [USER_ID_OFFSET + i for i in range(args.users)]
+    day = datetime.now().date()
+    page_times = []
+
+    @asynccontextmanager
+    async def timed_connection():
+        started = time.perf_counter()
+        async with db_connection() as conn:
+            yield conn
+        page_times.append(time.perf_counter() - started)
+
+    await create_db_pool()
+    try:
+        await init_db()
+        await seed(user_ids, day)
+        outbound = OutboundQueue(
+            bot, rate=args.rate, concurrency=args.concurrency, max_queue=food_log_bot.OUTBOUND_CONFIG["max_queue"]
+        )
+        outbound.start()
+        started = time.perf_counter()
+        users = await scheduler.send_daily_progress(
+            PostgresStorage(timed_connection), outbound, day, batch_size=args.batch_size
+        )
+        elapsed = time.perf_counter() - started
+        await outbound.close()
+    finally:
+        if not args.keep:
+            await cleanup(user_ids)
+        await close_db_pool()
+        await bot.session.close()
+
+    stats = outbound.stats()
+    print(f"{users} users in {elapsed:.2f}s: {stats['sent'] / elapsed:.1f} messages/s "
+          f"(bucket rate {args.rate:g}/s, {args.concurrency} senders, {args.api_latency:g} ms API latency)")
+    print(f"{len(page_times)} pages of {args.batch_size}: {sum(page_times) * 1000:.1f} ms total, "
+          f"{max(page_times) * 1000:.1f} ms max")
+    print(f"sent {stats['sent']}, flood waits retried {limiter.retried}, blocked {stats['blocked']}, "
+          f"failed {stats['failed']}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=5000)
+    parser.add_argument("--rate", type=float, default=500, help="token bucket rate, messages per second")
+    parser.add_argument("--concurrency", type=int, default=food_log_bot.OUTBOUND_CONFIG["concurrency"])
+    parser.add_argument("--batch-size", type=int, default=food_log_bot.DAILY_REPORT_CONFIG["batch_size"])
+    parser.add_argument("--api-latency", type=float, default=20.0, help="simulated Bot API latency in ms")
+    parser.add_argument("--flood-every", type=int, default=0, help="answer every Nth call with a 429")
+    parser.add_argument("--retry-after", type=int, default=1, help="retry_after of the simulated 429s")
+    parser.add_argument("--keep", action="store_true", help="keep the synthetic users afterwards")
+    asyncio.run(run(parser.parse_args()))
+
+if __name__ == "__main__":
+    main()
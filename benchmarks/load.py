@@ -0,0 +1,288 @@
+"""Drive scripted conversations for synthetic users through dp.feed_update
+against the configured Postgres, with a stub Bot session so nothing goes
+over the network. Reports throughput, per-handler p50/p95/p99 latency, and
+DB round trips and Telegram API calls per interaction. With --save-baseline
+the results are written to a baseline file; --compare checks a run against
+it and exits non-zero on a regression. Latency baselines only mean
+something on the machine and database they were recorded on.
+
+With STORAGE_BACKEND=memory (or sqlite) it runs against the embedded
+store instead; DB round trips are only counted for Postgres, so compare
+such runs against a baseline recorded the same way.
+
+    python -m benchmarks.load --users 200 --iterations 3 --compare
+"""
+import argparse
+import asyncio
+import contextvars
+import itertools
+import json
+import random
+import sys
+import time
+from collections import defaultdict
+from pathlib import Path
+
+from aiogram import BaseMiddleware, Bot
+from aiogram.client.session.base import BaseSession
+from aiogram.types import Message, Update
+
+import food_log_bot
+import metrics
+from food_log_bot import EMBEDDED, close_storage, db_connection, dp, open_storage, start_log_writer, stop_log_writer
+
+BASELINE_PATH = Path(__file__).with_name("baseline.json")
+USER_ID_OFFSET = 9_000_000_000
+FOOD_NAMES = ["Apple", "Rice", "Chicken Breast"]
+
+current_handler = contextvars.ContextVar("current_handler", default=None)
+current_calls = contextvars.ContextVar("current_calls", default=None)
+update_ids = itertools.count(1)
+
+class StubSession(BaseSession):
+    # Answers every Bot API call locally after `latency` seconds and appends
+    # it to the calling update's list, so scripts can read back the markup.
+    def __init__(self, latency: float = 0.0):
+        super().__init__()
+        self.latency = latency
+
+    async def make_request(self, bot, method, timeout=None):
+        calls = current_calls.get()
+        if calls is not None:
+            calls.append(method)
+        chat_id = getattr(method, "chat_id", None) or 0
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if type(method).__name__ in ("SendMessage", "EditMessageText", "EditMessageReplyMarkup"):
+            return Message.model_validate({
+                "message_id": next(update_ids), "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private"}, "text": getattr(method, "text", None) or "",
+            })
+        return True
+
+    async def stream_content(self, url, headers=None, timeout=30, chunk_size=65536, raise_for_status=True):
+        yield b""
+
+    async def close(self):
+        pass
+
+class HandlerNameMiddleware(BaseMiddleware):
+    async def __call__(self, handler, event, data):
+        handler_object = data.get("handler")
+        current_handler.set(handler_object.callback.__name__ if handler_object else "unhandled")
+        return await handler(event, data)
+
+class Recorder:
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.queries = defaultdict(int)
+        self.api_calls = defaultdict(int)
+        self.interactions = 0
+
+    def query_logger(self, wrapped):
+        # FSM writes are coalesced across users and counted on their own;
+        # the delayed flush runs outside any handler, so its BEGIN/COMMIT
+        # show up as background round trips.
+        def record(logged):
+            wrapped(logged)
+            operation, table = metrics.query_labels(logged.query)
+            if table == "fsmstorage" and operation != "SELECT":
+                self.queries["fsm_flush"] += 1
+            else:
+                self.queries[current_handler.get() or "background"] += 1
+        return record
+
+def user_payload(user_id: int):
+    return {"id": user_id, "is_bot": False, "first_name": "Bench", "username": f"bench{user_id}"}
+
+def message_update(user_id: int, text: str):
+    return Update.model_validate({"update_id": next(update_ids), "message": {
+        "message_id": next(update_ids), "date": int(time.time()), "text": text,
+        "chat": {"id": user_id, "type": "private"}, "from": user_payload(user_id),
+    }})
+
+def callback_update(user_id: int, data: str):
+    return Update.model_validate({"update_id": next(update_ids), "callback_query": {
+        "id": str(next(update_ids)), "chat_instance": str(user_id), "data": data, "from": user_payload(user_id),
+        "message": {"message_id": 1, "date": int(time.time()), "text": "", "chat": {"id": user_id, "type": "private"}},
+    }})
+
+def find_callback(calls: list, prefix: str, label: str):
+    for method in reversed(calls):
+        markup = getattr(method, "reply_markup", None)
+        for row in getattr(markup, "inline_keyboard", None) or []:
+            for button in row:
+                if button.callback_data and button.callback_data.startswith(prefix) and label in button.text:
+                    return button.callback_data
+    raise RuntimeError(f"No {prefix}* button for {label!r} in the last replies")
+
+async def feed(bot: Bot, recorder: Recorder, update: Update):
+    calls = []
+
+    async def run():
+        current_calls.set(calls)
+        started = time.perf_counter()
+        await dp.feed_update(bot, update)
+        elapsed = time.perf_counter() - started
+        name = current_handler.get() or "unhandled"
+        recorder.latencies[name].append(elapsed)
+        recorder.api_calls[name] += len(calls)
+        recorder.interactions += 1
+    # A fresh context per update, like the polling loop's one task per update.
+    await asyncio.create_task(run(), context=contextvars.Context())
+    return calls
+
+async def conversation(bot: Bot, recorder: Recorder, user_id: int, iteration: int):
+    send = lambda update: feed(bot, recorder, update)
+    custom_food = f"Bench food {user_id} {iteration}"
+    await send(message_update(user_id, "/start"))
+    await send(message_update(user_id, "🍽️ Log Food"))
+    await send(message_update(user_id, random.choice(FOOD_NAMES)))
+    await send(message_update(user_id, str(random.randint(50, 400))))
+    await send(message_update(user_id, "📅 Daily Summary"))
+    await send(message_update(user_id, "📊 Weekly Summary"))
+    await send(message_update(user_id, "➕ Add Food"))
+    await send(message_update(user_id, custom_food))
+    await send(message_update(user_id, "1.5"))
+    calls = await send(message_update(user_id, "📖 My Foods"))
+    update_data = find_callback(calls, "update_", custom_food)
+    delete_data = find_callback(calls, "delete_", custom_food)
+    await send(callback_update(user_id, update_data))
+    await send(callback_update(user_id, "field_calories_per_gram"))
+    await send(message_update(user_id, "2.0"))
+    await send(callback_update(user_id, delete_data))
+
+def percentile(values: list, fraction: float):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+def summarize(recorder: Recorder, elapsed: float):
+    handlers = {}
+    for name, values in sorted(recorder.latencies.items()):
+        handlers[name] = {
+            "count": len(values),
+            "p50_ms": percentile(values, 0.50) * 1000,
+            "p95_ms": percentile(values, 0.95) * 1000,
+            "p99_ms": percentile(values, 0.99) * 1000,
+            "db_round_trips": recorder.queries[name] / len(values),
+            "api_calls": recorder.api_calls[name] / len(values),
+        }
+    total_queries = sum(recorder.queries.values())
+    return {
+        "interactions": recorder.interactions,
+        "throughput_per_s": recorder.interactions / elapsed,
+        "db_round_trips_per_interaction": total_queries / max(recorder.interactions, 1),
+        "background_round_trips": recorder.queries["background"],
+        "fsm_flush_round_trips": recorder.queries["fsm_flush"],
+        "api_calls_per_interaction": sum(recorder.api_calls.values()) / max(recorder.interactions, 1),
+        "handlers": handlers,
+    }
+
+def report(summary: dict):
+    print(f"{summary['interactions']} interactions, {summary['throughput_per_s']:.1f}/s, "
+          f"{summary['db_round_trips_per_interaction']:.2f} DB round trips and "
+          f"{summary['api_calls_per_interaction']:.2f} API calls per interaction "
+          f"({summary['background_round_trips']} background and {summary['fsm_flush_round_trips']} FSM flush round trips)")
+    print(f"{'handler':<28}{'count':>7}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'db/op':>7}{'api/op':>7}")
+    for name, stats in summary["handlers"].items():
+        print(f"{name:<28}{stats['count']:>7}{stats['p50_ms']:>9.2f}{stats['p95_ms']:>9.2f}{stats['p99_ms']:>9.2f}"
+              f"{stats['db_round_trips']:>7.2f}{stats['api_calls']:>7.2f}")
+
+def compare(summary: dict, baseline: dict, tolerance: float, min_ms: float):
+    # Latency only counts as a regression above `min_ms`, so handlers that
+    # run in a fraction of a millisecond don't flap. Round trips vary a
+    # little with cache expiry and FSM write coalescing, so they get half a
+    # query of slack; API calls per handler are exact.
+    problems = []
+    for name, base in baseline["handlers"].items():
+        stats = summary["handlers"].get(name)
+        if stats is None:
+            continue
+        for key in ("p50_ms", "p95_ms"):
+            if stats[key] > max(base[key] * (1 + tolerance), min_ms):
+                problems.append(f"{name} {key}: {stats[key]:.2f} vs baseline {base[key]:.2f}")
+        for key, slack in (("db_round_trips", 0.5), ("api_calls", 1e-6)):
+            if stats[key] > base[key] + slack:
+                problems.append(f"{name} {key}: {stats[key]:.2f} vs baseline {base[key]:.2f}")
+    if summary["throughput_per_s"] < baseline["throughput_per_s"] * (1 - tolerance):
+        problems.append(f"throughput: {summary['throughput_per_s']:.1f}/s vs baseline {baseline['throughput_per_s']:.1f}/s")
+    return problems
+
+async def cleanup(user_ids: list):
+    async with db_connection() as conn:
+        async with conn.transaction():
+            await conn.execute("DELETE FROM DailyLog WHERE user_id = ANY($1::bigint[])", user_ids)
+            await conn.execute("DELETE FROM DailyCalories WHERE user_id = ANY($1::bigint[])", user_ids)
+            await conn.execute("DELETE FROM Foods WHERE user_id = ANY($1::bigint[])", user_ids)
+            await conn.execute("DELETE FROM Users WHERE user_id = ANY($1::bigint[])", user_ids)
+
+async def run(args):
+    random.seed(args.seed)
+    recorder = Recorder()
+    food_log_bot.sql_query_logger = recorder.query_logger(food_log_bot.sql_query_logger)
+    for name, observer in dp.observers.items():
+        if name != "update":
+            observer.middleware(HandlerNameMiddleware())
+    session = StubSession(args.api_latency / 1000)
+    # Synthetic users tap far faster than Telegram lets a bot answer one
+    # chat, so the send limiter is only applied on request.
+    bot = food_log_bot.prepare_bot(Bot(token="123456:" + "A" * 35, session=session), rate_limit=args.rate_limit)
+    user_ids = [USER_ID_OFFSET + i for i in range(args.users)]
+    await open_storage()
+    try:
+        await start_log_writer()
+        await dp.emit_startup(bot=bot)
+        for counters in (recorder.latencies, recorder.queries, recorder.api_calls):
+            counters.clear()
+        slots = asyncio.Semaphore(args.concurrency)
+
+        async def user_session(user_id: int):
+            async with slots:
+                for iteration in range(args.iterations):
+                    await conversation(bot, recorder, user_id, iteration)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(user_session(user_id) for user_id in user_ids))
+        elapsed = time.perf_counter() - started
+    finally:
+        await dp.emit_shutdown(bot=bot)
+        await stop_log_writer()
+        if not args.keep and not EMBEDDED:
+            await cleanup(user_ids)
+        await close_storage()
+
+    summary = summarize(recorder, elapsed)
+    summary["config"] = {key: getattr(args, key) for key in ("users", "iterations", "concurrency", "api_latency")}
+    report(summary)
+    if args.save_baseline:
+        args.baseline.write_text(json.dumps(summary, indent=2) + "\n")
+        print(f"Saved baseline to {args.baseline}")
+    if args.compare:
+        baseline = json.loads(args.baseline.read_text())
+        problems = compare(summary, baseline, args.tolerance, args.min_ms)
+        for problem in problems:
+            print(f"REGRESSION {problem}")
+        if not problems:
+            print(f"No regressions against {args.baseline}")
+        return not problems
+    return True
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--iterations", type=int, default=3, help="conversations per user")
+    parser.add_argument("--concurrency", type=int, default=20, help="users active at the same time")
+    parser.add_argument("--api-latency", type=float, default=0.0, help="simulated Bot API latency in ms")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--baseline", type=Path, default=BASELINE_PATH)
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--compare", action="store_true", help="exit 1 on a regression against the baseline")
+    parser.add_argument("--tolerance", type=float, default=0.5, help="allowed relative latency/throughput drift")
+    parser.add_argument("--min-ms", type=float, default=5.0, help="latencies below this never count as regressions")
+    parser.add_argument("--keep", action="store_true", help="keep the synthetic users' rows afterwards")
+    parser.add_argument("--rate-limit", action="store_true", help="apply the Telegram send limiter")
+    args = parser.parse_args()
+    sys.exit(0 if asyncio.run(run(args)) else 1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+"""Grow a synthetic DailyLog history backwards in steps and time the daily and
+weekly summaries after each one. With monthly partitions the daily summary
+only ever touches the current month's partition, so its latency should stay
+flat no matter how much history sits behind it.
+
+    python -m benchmarks.partition_latency --steps 4 --months-per-step 6
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+from datetime import datetime, timedelta
+
+import log_partitions
+from benchmarks.explain_summaries import scans_on
+from food_log_bot import (
+    close_db_pool, create_db_pool, day_bounds, db_connection, get_daily_summary, get_weekly_summary, init_db
+)
+from storage import DAILY_SUMMARY_SQL
+
+USER_BASE = -3_000_000
+
+async def add_history(conn, users: int, first: datetime, days: int, rows_per_day: int):
+    last = first + timedelta(days=days)
+    await log_partitions.ensure_partitions(conn, first.date(), last.date())
+    food_id = await conn.fetchval("SELECT MIN(food_id) FROM Foods WHERE user_id IS NULL")
+    await conn.execute("""
+        INSERT INTO Users (user_id, first_name)
+        SELECT $1::bigint - g, 'bench' FROM generate_series(1, $2::int) g
+        ON CONFLICT (user_id) DO NOTHING
+    """, USER_BASE, users)
+    await conn.execute("""
+        INSERT INTO DailyLog (user_id, food_id, weight_grams, calories, log_date)
+        SELECT $1::bigint - 1 - g % $2::int, $3, 100, 130, $4::timestamp + (g % ($5::int * 1440)) * interval '1 minute'
+        FROM generate_series(0, $5::int * $6::int - 1) g
+    """, USER_BASE, users, food_id, first, days, rows_per_day)
+    await conn.execute("""
+        INSERT INTO DailyCalories (user_id, log_day, total_calories, total_grams, entry_count)
+        SELECT user_id, DATE(log_date), SUM(calories), SUM(weight_grams), COUNT(*)
+        FROM DailyLog
+        WHERE user_id BETWEEN $1::bigint - $2 AND $1::bigint - 1 AND log_date >= $3 AND log_date < $4
+        GROUP BY user_id, DATE(log_date)
+        ON CONFLICT (user_id, log_day) DO UPDATE SET
+            total_calories = DailyCalories.total_calories + EXCLUDED.total_calories,
+            total_grams = DailyCalories.total_grams + EXCLUDED.total_grams,
+            entry_count = DailyCalories.entry_count + EXCLUDED.entry_count
+    """, USER_BASE, users, first, last)
+    await conn.execute("ANALYZE DailyLog")
+    await conn.execute("ANALYZE DailyCalories")
+
+def percentile(values: list, fraction: float):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+async def time_summaries(users: int, samples: int):
+    daily, weekly = [], []
+    now = datetime.now()
+    for _ in range(samples):
+        user_id = USER_BASE - random.randint(1, users)
+        started = time.perf_counter()
+        await get_daily_summary(user_id, now)
+        daily.append(time.perf_counter() - started)
+        started = time.perf_counter()
+        await get_weekly_summary(user_id, now)
+        weekly.append(time.perf_counter() - started)
+    return daily, weekly
+
+async def daily_partitions_scanned(conn, user_id: int):
+    raw = await conn.fetchval(f"EXPLAIN (FORMAT JSON) {DAILY_SUMMARY_SQL}", user_id, *day_bounds(datetime.now()))
+    return len(list(scans_on(json.loads(raw)[0]["Plan"], "dailylog")))
+
+async def run(args):
+    random.seed(1)
+    await create_db_pool()
+    try:
+        await init_db()
+        today = datetime.combine(datetime.now().date(), datetime.min.time())
+        oldest = today - timedelta(days=7)
+        async with db_connection() as conn:
+            print("Seeding the last 8 days...")
+            await add_history(conn, args.users, oldest, 8, args.rows_per_day)
+        print(f"{'history':>10}{'rows':>12}{'partitions':>12}{'scanned':>9}"
+              f"{'daily p50':>11}{'daily p95':>11}{'weekly p50':>12}{'weekly p95':>12}")
+        for step in range(args.steps + 1):
+            if step:
+                first = datetime.combine(log_partitions.add_months(oldest.date(), -args.months_per_step), datetime.min.time())
+                async with db_connection() as conn:
+                    await add_history(conn, args.users, first, (oldest - first).days, args.rows_per_day)
+                oldest = first
+            async with db_connection() as conn:
+                rows = await conn.fetchval(
+                    "SELECT COUNT(*) FROM DailyLog WHERE user_id BETWEEN $1::bigint - $2 AND $1::bigint - 1", USER_BASE, args.users
+                )
+                partitions = len(await log_partitions.list_partitions(conn))
+                scanned = await daily_partitions_scanned(conn, USER_BASE - 1)
+            daily, weekly = await time_summaries(args.users, args.samples)
+            print(f"{(today - oldest).days:>9}d{rows:>12}{partitions:>12}{scanned:>9}"
+                  f"{percentile(daily, 0.5) * 1000:>9.2f}ms{percentile(daily, 0.95) * 1000:>9.2f}ms"
+                  f"{percentile(weekly, 0.5) * 1000:>10.2f}ms{percentile(weekly, 0.95) * 1000:>10.2f}ms")
+        if not args.keep:
+            async with db_connection() as conn:
+                await conn.execute("DELETE FROM DailyLog WHERE user_id BETWEEN $1::bigint - $2 AND $1::bigint - 1", USER_BASE, args.users)
+                await conn.execute("DELETE FROM DailyCalories WHERE user_id BETWEEN $1::bigint - $2 AND $1::bigint - 1", USER_BASE, args.users)
+                await conn.execute("DELETE FROM Users WHERE user_id BETWEEN $1::bigint - $2 AND $1::bigint - 1", USER_BASE, args.users)
+    finally:
+        await close_db_pool()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--steps", type=int, default=4)
+    parser.add_argument("--months-per-step", type=int, default=6)
+    parser.add_argument("--rows-per-day", type=int, default=5000)
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--samples", type=int, default=300, help="summaries timed per step")
+    parser.add_argument("--keep", action="store_true", help="keep the synthetic rows afterwards")
+    asyncio.run(run(parser.parse_args()))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,245 @@
+import csv
+import json
+import sys
+from contextlib import contextmanager
+from datetime import date, datetime
+
+import log_partitions
+
+FOOD_COLUMNS = ["food_id", "food_name", "calories_per_gram", "user_id"]
+LOG_COLUMNS = ["log_id", "user_id", "food_id", "food_name", "weight_grams", "calories", "log_date"]
+
+
+def detect_format(path: str, fmt: str = None):
+    if fmt:
+        return fmt
+    if path.endswith((".jsonl", ".ndjson")):
+        return "jsonl"
+    return "csv"
+
+
+@contextmanager
+def open_text(path: str, mode: str):
+    if path == "-":
+        yield sys.stdin if "r" in mode else sys.stdout
+        return
+    with open(path, mode, newline="", encoding="utf-8") as f:
+        yield f
+
+
+def read_records(f, fmt: str):
+    if fmt == "jsonl":
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+    else:
+        yield from csv.DictReader(f)
+
+
+def _number(value):
+    if value is None or value == "":
+        return None
+    return float(value)
+
+
+def _integer(value):
+    if value is None or value == "":
+        return None
+    return int(value)
+
+
+def _timestamp(value):
+    if value is None or value == "":
+        return None
+    if isinstance(value, datetime):
+        return value
+    return datetime.fromisoformat(value)
+
+
+def food_rows(records, stats: dict):
+    # Accepts calories_per_gram or calories_per_100g; rows without a name or
+    # with a non-positive calorie value are counted and skipped.
+    for record in records:
+        name = (record.get("food_name") or "").strip()
+        try:
+            calories = _number(record.get("calories_per_gram"))
+            if calories is None and record.get("calories_per_100g") not in (None, ""):
+                calories = _number(record["calories_per_100g"]) / 100
+            user_id = _integer(record.get("user_id"))
+        except (TypeError, ValueError):
+            calories = None
+        if not name or calories is None or calories <= 0:
+            stats["invalid"] += 1
+            continue
+        stats["read"] += 1
+        yield name, calories, user_id
+
+
+def log_rows(records, stats: dict):
+    for record in records:
+        try:
+            row = (
+                _integer(record.get("user_id")),
+                _integer(record.get("food_id")),
+                (record.get("food_name") or "").strip() or None,
+                _number(record.get("weight_grams")),
+                _number(record.get("calories")),
+                _timestamp(record.get("log_date")) or datetime.now(),
+            )
+        except (TypeError, ValueError):
+            stats["invalid"] += 1
+            continue
+        user_id, food_id, food_name, weight, _, _ = row
+        if user_id is None or (food_id is None and food_name is None) or not weight or weight <= 0:
+            stats["invalid"] += 1
+            continue
+        stats["read"] += 1
+        yield row
+
+
+async def import_foods(conn, records):
+    stats = {"read": 0, "invalid": 0, "inserted": 0}
+    async with conn.transaction():
+        await conn.execute("""
+            CREATE TEMP TABLE food_import (
+                food_name TEXT,
+                calories_per_gram FLOAT,
+                user_id BIGINT
+            ) ON COMMIT DROP
+        """)
+        await conn.copy_records_to_table(
+            "food_import",
+            records=food_rows(records, stats),
+            columns=["food_name", "calories_per_gram", "user_id"],
+        )
+        # unique_food_user treats NULL user_ids as distinct, so global foods
+        # are deduplicated explicitly; the ON CONFLICT covers rows inserted
+        # concurrently.
+        status = await conn.execute("""
+            INSERT INTO Foods (food_name, calories_per_gram, user_id)
+            SELECT DISTINCT ON (s.food_name, s.user_id) s.food_name, s.calories_per_gram, s.user_id
+            FROM food_import s
+            WHERE (s.user_id IS NULL OR EXISTS (SELECT 1 FROM Users u WHERE u.user_id = s.user_id))
+            AND NOT EXISTS (
+                SELECT 1 FROM Foods f
+                WHERE f.food_name = s.food_name AND f.user_id IS NOT DISTINCT FROM s.user_id
+            )
+            ORDER BY s.food_name, s.user_id
+            ON CONFLICT DO NOTHING
+        """)
+    stats["inserted"] = int(status.split()[-1])
+    # Refresh planner statistics so joins against the new id range don't
+    # keep using plans costed for the old one.
+    await conn.execute("ANALYZE Foods")
+    return stats
+
+
+async def import_logs(conn, records):
+    stats = {"read": 0, "invalid": 0, "inserted": 0}
+    async with conn.transaction():
+        await conn.execute("""
+            CREATE TEMP TABLE log_import (
+                user_id BIGINT,
+                food_id INTEGER,
+                food_name TEXT,
+                weight_grams FLOAT,
+                calories FLOAT,
+                log_date TIMESTAMP
+            ) ON COMMIT DROP
+        """)
+        await conn.copy_records_to_table(
+            "log_import",
+            records=log_rows(records, stats),
+            columns=["user_id", "food_id", "food_name", "weight_grams", "calories", "log_date"],
+        )
+        await conn.execute("""
+            UPDATE log_import s SET food_id = (
+                SELECT f.food_id FROM Foods f
+                WHERE f.food_name = s.food_name AND (f.user_id = s.user_id OR f.user_id IS NULL)
+                ORDER BY f.user_id NULLS LAST, f.food_id
+                LIMIT 1
+            )
+            WHERE s.food_id IS NULL
+        """)
+        first, last = await conn.fetchrow("SELECT MIN(log_date)::date, MAX(log_date)::date FROM log_import")
+        if first is not None:
+            await log_partitions.ensure_partitions(conn, first, last)
+        await conn.execute("""
+            INSERT INTO Users (user_id)
+            SELECT DISTINCT user_id FROM log_import
+            ON CONFLICT (user_id) DO NOTHING
+        """)
+        stats["inserted"] = await conn.fetchval("""
+            WITH inserted AS (
+                INSERT INTO DailyLog (user_id, food_id, weight_grams, calories, log_date)
+                SELECT s.user_id, f.food_id, s.weight_grams,
+                       COALESCE(s.calories, f.calories_per_gram * s.weight_grams), s.log_date
+                FROM log_import s
+                JOIN Foods f ON f.food_id = s.food_id
+                RETURNING user_id, log_date, calories, weight_grams
+            ), rollup AS (
+                INSERT INTO DailyCalories (user_id, log_day, total_calories, total_grams, entry_count)
+                SELECT user_id, DATE(log_date), SUM(calories), SUM(weight_grams), COUNT(*)
+                FROM inserted
+                GROUP BY user_id, DATE(log_date)
+                ON CONFLICT (user_id, log_day) DO UPDATE SET
+                    total_calories = DailyCalories.total_calories + EXCLUDED.total_calories,
+                    total_grams = DailyCalories.total_grams + EXCLUDED.total_grams,
+                    entry_count = DailyCalories.entry_count + EXCLUDED.entry_count
+            )
+            SELECT COUNT(*) FROM inserted
+        """)
+    stats["unresolved"] = stats["read"] - stats["inserted"]
+    await conn.execute("ANALYZE DailyLog, DailyCalories")
+    return stats
+
+
+def _jsonable(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return value
+
+
+async def export_query(conn, f, fmt: str, columns: list, query: str, *args, prefetch: int = 5000):
+    # Rows are pulled through a server-side cursor `prefetch` at a time, so
+    # the export never holds the full result in memory.
+    if fmt == "csv":
+        writer = csv.writer(f)
+        writer.writerow(columns)
+    count = 0
+    async with conn.transaction():
+        async for record in conn.cursor(query, *args, prefetch=prefetch):
+            values = [_jsonable(record[column]) for column in columns]
+            if fmt == "csv":
+                writer.writerow(values)
+            else:
+                f.write(json.dumps(dict(zip(columns, values))) + "\n")
+            count += 1
+    return count
+
+
+async def export_logs(conn, f, fmt: str, user_id: int = None, since: datetime = None):
+    conditions, args = [], []
+    if user_id is not None:
+        args.append(user_id)
+        conditions.append(f"dl.user_id = ${len(args)}")
+    if since is not None:
+        args.append(since)
+        conditions.append(f"dl.log_date >= ${len(args)}")
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    return await export_query(conn, f, fmt, LOG_COLUMNS, f"""
+        SELECT dl.log_id, dl.user_id, dl.food_id, f.food_name, dl.weight_grams, dl.calories, dl.log_date
+        FROM DailyLog dl
+        JOIN Foods f ON f.food_id = dl.food_id
+        {where}
+        ORDER BY dl.user_id, dl.log_date
+    """, *args)
+
+
+async def export_foods(conn, f, fmt: str, user_id: int = None):
+    return await export_query(conn, f, fmt, FOOD_COLUMNS, """
+        SELECT food_id, food_name, calories_per_gram, user_id
+        FROM Foods
+        WHERE ($1::bigint IS NULL AND user_id IS NULL) OR user_id = $1
+        ORDER BY food_id
+    """, user_id)
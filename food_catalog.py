@@ -0,0 +1,284 @@
+import asyncio
+import time
+from collections import OrderedDict
+from typing import NamedTuple
+
+from aiogram.types import KeyboardButton, ReplyKeyboardMarkup
+
+from food_search import FoodIndex, normalize
+
+
+class CachedFood(NamedTuple):
+    food_id: int
+    food_name: str
+    calories_per_gram: float
+
+
+class UserCatalog:
+    # `by_key` maps normalize()d names to foods for resolve().
+    __slots__ = ("foods", "by_id", "by_key", "loaded_at", "keyboard", "_index")
+
+    def __init__(self, foods):
+        self.foods = {}
+        self.by_id = {}
+        self.by_key = {}
+        self.loaded_at = time.monotonic()
+        self.keyboard = None
+        self._index = None
+        for food in foods:
+            self.put(food)
+
+    @property
+    def index(self):
+        if self._index is None:
+            self._index = FoodIndex((food.food_id, food.food_name) for food in self.by_id.values())
+        return self._index
+
+    def put(self, food: CachedFood):
+        old = self.by_id.get(food.food_id)
+        self.by_id[food.food_id] = food
+        if old is not None:
+            del self.foods[old.food_name]
+            self._unkey(old)
+        self.foods[food.food_name] = food
+        self.by_key.setdefault(normalize(food.food_name), food)
+        if self._index is not None and (old is None or old.food_name != food.food_name):
+            self._index.add(food.food_id, food.food_name)
+        self.keyboard = None
+        return old
+
+    def discard(self, food_id: int):
+        old = self.by_id.pop(food_id, None)
+        if old is not None:
+            del self.foods[old.food_name]
+            self._unkey(old)
+            if self._index is not None:
+                self._index.remove(food_id)
+            self.keyboard = None
+        return old
+
+    def _unkey(self, old: CachedFood):
+        # Another food may differ from `old` only in case or spacing.
+        key = normalize(old.food_name)
+        if self.by_key.get(key) is old:
+            del self.by_key[key]
+            for food in self.by_id.values():
+                if normalize(food.food_name) == key:
+                    self.by_key[key] = food
+                    break
+
+
+def _keyed(foods):
+    by_key = {}
+    for food in foods:
+        by_key.setdefault(normalize(food.food_name), food)
+    return by_key
+
+
+class GlobalCatalog:
+    # Only the row lookup() resolves a name to is indexed, so duplicate
+    # global names show up once in search results.
+    __slots__ = ("foods", "by_id", "by_key", "index")
+
+    def __init__(self, rows):
+        self.by_id = {food.food_id: food for food in map(CachedFood._make, rows)}
+        self.foods = {food.food_name: food for food in self.by_id.values()}
+        self.by_key = _keyed(self.foods.values())
+        self.index = FoodIndex((food.food_id, food.food_name) for food in self.foods.values())
+
+    def apply(self, rows):
+        # Brings the catalog in line with `rows`, touching only the index
+        # entries of foods that were added, renamed or removed. Compaction
+        # is left to the caller (see FoodCatalogCache._load_globals).
+        by_id = {food.food_id: food for food in map(CachedFood._make, rows)}
+        foods = {food.food_name: food for food in by_id.values()}
+        indexed = {food.food_id: food for food in self.foods.values()}
+        current = {food.food_id: food for food in foods.values()}
+        for food_id in indexed.keys() - current.keys():
+            self.index.remove(food_id, compact=False)
+        for food_id, food in current.items():
+            old = indexed.get(food_id)
+            if old is None or old.food_name != food.food_name:
+                self.index.add(food_id, food.food_name, compact=False)
+        self.by_id = by_id
+        self.foods = foods
+        self.by_key = _keyed(foods.values())
+
+
+class FoodCatalogCache:
+    # Global foods (user_id IS NULL) are loaded once and shared, and only
+    # reloaded when a cheap count/max(food_id) check every `ttl` seconds shows
+    # that rows were added (e.g. by a bulk import). Each user's custom foods
+    # live in their own LRU entry that expires after `ttl` seconds.
+    # `max_items` caps the total number of cached custom foods.
+    # Both carry a FoodIndex for search. Handlers report their own writes via
+    # food_added/food_updated/food_deleted so cached entries and indexes are
+    # patched in place; a global reload with more than `rebuild_threshold`
+    # changes rebuilds the global index in a thread instead, as does the
+    # trigram compaction a smaller reload may call for. Building the global
+    # index for a large catalog takes seconds, so call warm() at startup
+    # rather than leaving it to the first search.
+    # A name that isn't found re-reads the user's foods (at most once per
+    # `recheck_after` seconds), so foods added through another instance
+    # resolve right away; other changes made elsewhere show after `ttl`.
+
+    rebuild_threshold = 1000
+    recheck_after = 1.0
+
+    def __init__(self, storage, max_users: int = 10000, max_items: int = 200000, ttl: float = 600):
+        self._storage = storage
+        self.max_users = max_users
+        self.max_items = max_items
+        self.ttl = ttl
+        self._globals = None
+        self._globals_version = None
+        self._globals_checked_at = 0.0
+        self._globals_lock = asyncio.Lock()
+        self._users = OrderedDict()
+        self._item_count = 0
+        self._epoch = 0
+        self.hits = 0
+        self.misses = 0
+
+    async def _load_globals(self):
+        if self._globals is not None and time.monotonic() - self._globals_checked_at < self.ttl:
+            return self._globals
+        async with self._globals_lock:
+            if self._globals is not None and time.monotonic() - self._globals_checked_at < self.ttl:
+                return self._globals
+            version = await self._storage.global_foods_version()
+            if self._globals is not None and version == self._globals_version:
+                self._globals_checked_at = time.monotonic()
+                return self._globals
+            rows = await self._storage.global_foods()
+            if self._globals is not None and abs(len(rows) - len(self._globals.by_id)) <= self.rebuild_threshold:
+                self._globals.apply(rows)
+                if self._globals.index.needs_compaction:
+                    await asyncio.to_thread(self._globals.index.compact)
+            else:
+                self._globals = await asyncio.to_thread(GlobalCatalog, rows)
+            self._globals_version = version
+            self._globals_checked_at = time.monotonic()
+            for entry in self._users.values():
+                entry.keyboard = None
+        return self._globals
+
+    async def warm(self):
+        await self._load_globals()
+
+    async def _load_user(self, user_id: int):
+        entry = self._users.get(user_id)
+        if entry is not None and time.monotonic() - entry.loaded_at < self.ttl:
+            self._users.move_to_end(user_id)
+            self.hits += 1
+            return entry
+        self.misses += 1
+        epoch = self._epoch
+        rows = await self._storage.user_foods(user_id)
+        entry = UserCatalog(map(CachedFood._make, rows))
+        # A write that landed while we were querying may not be in `rows`;
+        # serve this result once but don't keep it around.
+        if epoch == self._epoch:
+            self._store(user_id, entry)
+        return entry
+
+    def _store(self, user_id: int, entry: UserCatalog):
+        self._drop(user_id)
+        self._users[user_id] = entry
+        self._item_count += len(entry.foods)
+        while self._users and (len(self._users) > self.max_users or self._item_count > self.max_items):
+            _, evicted = self._users.popitem(last=False)
+            self._item_count -= len(evicted.foods)
+
+    def _drop(self, user_id: int):
+        entry = self._users.pop(user_id, None)
+        if entry is not None:
+            self._item_count -= len(entry.foods)
+
+    async def _find(self, user_id: int, find):
+        # Tries `find` on the user's foods, then on the globals. On a miss
+        # the user's foods are read again unless they were just loaded:
+        # another instance may have added the food.
+        entry = await self._load_user(user_id)
+        food = find(entry) or find(await self._load_globals())
+        if food is None and time.monotonic() - entry.loaded_at >= self.recheck_after:
+            self._drop(user_id)
+            food = find(await self._load_user(user_id))
+        return food
+
+    async def lookup(self, user_id: int, food_name: str):
+        return await self._find(user_id, lambda catalog: catalog.foods.get(food_name))
+
+    async def resolve(self, user_id: int, food_name: str):
+        # Like lookup(), but also takes a case- and whitespace-insensitive
+        # match for names typed by hand; custom foods win over globals.
+        key = normalize(food_name)
+        return await self._find(user_id, lambda catalog: catalog.foods.get(food_name) or catalog.by_key.get(key))
+
+    async def food_by_id(self, user_id: int, food_id: int):
+        entry = await self._load_user(user_id)
+        food = entry.by_id.get(food_id)
+        if food is None:
+            food = (await self._load_globals()).by_id.get(food_id)
+        return food
+
+    async def size(self, user_id: int):
+        entry = await self._load_user(user_id)
+        return len(entry.foods) + len((await self._load_globals()).foods)
+
+    async def search(self, user_id: int, query: str, offset: int = 0, limit: int = 10):
+        # Custom foods rank ahead of globals and hide globals with the same
+        # name.
+        # Returns one page of CachedFood plus whether more follow.
+        entry = await self._load_user(user_id)
+        globals_ = await self._load_globals()
+        wanted = offset + limit + 1
+        results = [entry.by_id[food_id] for food_id in entry.index.search(query, wanted)]
+        own_names = {food.food_name for food in results}
+        for food_id in globals_.index.search(query, wanted):
+            food = globals_.by_id[food_id]
+            if food.food_name not in own_names:
+                results.append(food)
+        return results[offset:offset + limit], len(results) > offset + limit
+
+    async def keyboard(self, user_id: int):
+        entry = await self._load_user(user_id)
+        if entry.keyboard is None:
+            names = sorted(set((await self._load_globals()).foods) | set(entry.foods))
+            entry.keyboard = ReplyKeyboardMarkup(
+                keyboard=[[KeyboardButton(text=name)] for name in names],
+                resize_keyboard=True
+            )
+        return entry.keyboard
+
+    def food_added(self, user_id: int, food: CachedFood):
+        self._epoch += 1
+        entry = self._users.get(user_id)
+        if entry is not None and entry.put(food) is None:
+            self._item_count += 1
+
+    def food_updated(self, user_id: int, food_id: int, **changes):
+        self._epoch += 1
+        entry = self._users.get(user_id)
+        if entry is None:
+            return
+        old = entry.by_id.get(food_id)
+        if old is None:
+            self._drop(user_id)
+            return
+        entry.put(old._replace(**changes))
+
+    def food_deleted(self, user_id: int, food_id: int):
+        self._epoch += 1
+        entry = self._users.get(user_id)
+        if entry is not None and entry.discard(food_id) is not None:
+            self._item_count -= 1
+
+    def stats(self):
+        return {
+            "users": len(self._users),
+            "items": self._item_count,
+            "global_items": len(self._globals.foods) if self._globals else 0,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
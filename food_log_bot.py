@@ -1,14 +1,37 @@
+import argparse
 import asyncio
+import json
 import logging
+import re
+import signal
+import time
 import asyncpg
+from contextlib import asynccontextmanager
 from datetime import datetime, timedelta
+from pathlib import Path
 from aiogram import Bot, Dispatcher, types
 from aiogram.filters import Command
 from aiogram.types import ReplyKeyboardMarkup, KeyboardButton, InlineKeyboardMarkup, InlineKeyboardButton
+from aiogram.types import InlineQueryResultArticle, InputTextMessageContent
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
+from aiogram.fsm.storage.memory import MemoryStorage
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler
+from aiohttp import web
 import os
 from dotenv import load_dotenv
+import bulk_io
+import log_partitions
+import metrics
+import scheduler
+import schema_migrations
+from analytics import AnalyticsCache
+from food_catalog import CachedFood, FoodCatalogCache
+from fsm_storage import PostgresFSMStorage
+from outbound import OutboundQueue, RateLimiter, RateLimitMiddleware, ReplyCoalescer
+from storage import RETRYABLE_ERRORS, DuplicateFoodError, FoodInUseError, PostgresStorage, SqliteStorage
+from workers import WorkerSupervisor, consume
+from write_behind import WriteBehindQueue
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -23,14 +46,118 @@ DB_CONFIG = {
     "password": os.getenv("DB_PASSWORD", "your_password"),
     "port": os.getenv("DB_PORT", "5432")
 }
+POOL_CONFIG = {
+    "min_size": int(os.getenv("DB_POOL_MIN_SIZE", "2")),
+    "max_size": int(os.getenv("DB_POOL_MAX_SIZE", "10")),
+    "statement_cache_size": int(os.getenv("DB_STATEMENT_CACHE_SIZE", "100")),
+    "acquire_timeout": float(os.getenv("DB_ACQUIRE_TIMEOUT", "10")),
+    "stats_interval": float(os.getenv("DB_POOL_STATS_INTERVAL", "0")),
+}
+STORAGE_CONFIG = {
+    "backend": os.getenv("STORAGE_BACKEND", "postgres"),
+    "sqlite_path": os.getenv("SQLITE_PATH", "food_log_bot.sqlite3"),
+}
+EMBEDDED = STORAGE_CONFIG["backend"] != "postgres"
+BOT_MODE = os.getenv("BOT_MODE", "polling")
+WEBHOOK_CONFIG = {
+    "host": os.getenv("WEBHOOK_HOST", "0.0.0.0"),
+    "port": int(os.getenv("WEBHOOK_PORT", "8080")),
+    "path": os.getenv("WEBHOOK_PATH", "/webhook"),
+    "url": os.getenv("WEBHOOK_URL", ""),
+    "secret": os.getenv("WEBHOOK_SECRET", ""),
+    "drain_timeout": float(os.getenv("WEBHOOK_DRAIN_TIMEOUT", "30")),
+}
+WORKER_CONFIG = {
+    "workers": int(os.getenv("WORKERS", "0")),
+    "queue_size": int(os.getenv("WORKER_QUEUE_SIZE", "1000")),
+    "concurrency": int(os.getenv("WORKER_CONCURRENCY", "100")),
+    "stats_interval": float(os.getenv("WORKER_STATS_INTERVAL", "60")),
+}
+# Cached, delayed FSM writes are only safe while one process sees all of a
+# user's updates: a single polling process, or workers sharded by user on
+# one host. Otherwise (webhook instances, or several supervisor hosts,
+# behind a load balancer) set FSM_SHARDED=0: FSM records are then read once
+# per update and written back when it is handled, and the food and report
+# caches check the database for other instances' writes much sooner.
+FSM_SHARDED = os.getenv("FSM_SHARDED", "1" if BOT_MODE == "polling" or WORKER_CONFIG["workers"] > 0 else "0") == "1"
+CATALOG_CACHE_CONFIG = {
+    "max_users": int(os.getenv("FOOD_CACHE_MAX_USERS", "10000")),
+    "max_items": int(os.getenv("FOOD_CACHE_MAX_ITEMS", "200000")),
+    "ttl": float(os.getenv("FOOD_CACHE_TTL", "600" if FSM_SHARDED else "60")),
+}
+ANALYTICS_CONFIG = {
+    "max_users": int(os.getenv("ANALYTICS_CACHE_USERS", "10000")),
+    "ttl": float(os.getenv("ANALYTICS_CACHE_TTL", "600" if FSM_SHARDED else "0")),
+}
+FOOD_SEARCH_CONFIG = {
+    "keyboard_limit": int(os.getenv("FOOD_KEYBOARD_LIMIT", "50")),
+    "page_size": int(os.getenv("FOOD_SEARCH_PAGE_SIZE", "8")),
+    "inline_limit": int(os.getenv("FOOD_INLINE_LIMIT", "20")),
+}
+LOG_WRITER_CONFIG = {
+    "enabled": os.getenv("LOG_WRITE_BEHIND", "0") == "1",
+    "batch_size": int(os.getenv("LOG_BATCH_SIZE", "500")),
+    "flush_interval": float(os.getenv("LOG_FLUSH_INTERVAL", "0.5")),
+    "max_queue": int(os.getenv("LOG_QUEUE_SIZE", "10000")),
+}
+METRICS_CONFIG = {
+    "host": os.getenv("METRICS_HOST", "127.0.0.1"),
+    "port": int(os.getenv("METRICS_PORT", "0")),
+    "slow_handler_ms": float(os.getenv("SLOW_HANDLER_MS", "0")),
+    "slow_query_ms": float(os.getenv("SLOW_QUERY_MS", "0")),
+}
+PARTITION_CONFIG = {
+    "months_ahead": int(os.getenv("LOG_PARTITION_MONTHS_AHEAD", "2")),
+    "retention_months": int(os.getenv("LOG_RETENTION_MONTHS", "0")),
+    "archive_dir": os.getenv("LOG_ARCHIVE_DIR", "archive"),
+    "interval": float(os.getenv("LOG_MAINTENANCE_INTERVAL", "86400")),
+}
+DAILY_REPORT_CONFIG = {
+    "time": os.getenv("DAILY_REPORT_TIME", "21:00"),
+    "batch_size": int(os.getenv("DAILY_REPORT_BATCH_SIZE", "1000")),
+}
+OUTBOUND_CONFIG = {
+    "rate": float(os.getenv("OUTBOUND_RATE", "25")),
+    "concurrency": int(os.getenv("OUTBOUND_CONCURRENCY", "8")),
+    "max_queue": int(os.getenv("OUTBOUND_QUEUE_SIZE", "1000")),
+}
+# Telegram allows about 30 messages per second per bot and one per second
+# per chat. With WORKERS the bot-wide rate is split between the processes:
+# the supervisor, which sends the daily reports, gets `report_share` of it
+# and the workers share the rest.
+SEND_LIMIT_CONFIG = {
+    "rate": float(os.getenv("SEND_RATE", "30")),
+    "report_share": float(os.getenv("SEND_REPORT_SHARE", "0.5")),
+    "chat_rate": float(os.getenv("SEND_CHAT_RATE", "1")),
+    "chat_burst": float(os.getenv("SEND_CHAT_BURST", "3")),
+    "max_chats": int(os.getenv("SEND_LIMIT_CHATS", "10000")),
+    "max_retries": int(os.getenv("SEND_MAX_RETRIES", "3")),
+}
+AUTO_MIGRATE = os.getenv("DB_AUTO_MIGRATE", "1") == "1"
+FSM_CONFIG = {
+    "storage": os.getenv("FSM_STORAGE", "postgres"),
+    "cache_size": int(os.getenv("FSM_CACHE_SIZE", "10000")),
+    "cache_ttl": float(os.getenv("FSM_CACHE_TTL", "30" if FSM_SHARDED else "0")),
+    "flush_delay": float(os.getenv("FSM_FLUSH_DELAY", "0.05" if FSM_SHARDED else "0")),
+}
 
-bot = Bot(token=BOT_TOKEN)
-dp = Dispatcher()
+MAIN_MENU = ReplyKeyboardMarkup(
+    keyboard=[
+        [KeyboardButton(text="🍽️ Log Food"), KeyboardButton(text="🍱 Log Meal"), KeyboardButton(text="➕ Add Food")],
+        [KeyboardButton(text="📖 My Foods"), KeyboardButton(text="📅 Daily Summary")],
+        [KeyboardButton(text="📊 Weekly Summary"), KeyboardButton(text="🎯 Set Calorie Goal")],
+        [KeyboardButton(text="📈 Monthly Report"), KeyboardButton(text="🗓️ Yearly Report")]
+    ],
+    resize_keyboard=True
+)
 
 class LogFoodForm(StatesGroup):
     food_name = State()
     weight = State()
 
+class LogMealForm(StatesGroup):
+    items = State()
+
 class AddFoodForm(StatesGroup):
     food_name = State()
     calories_per_gram = State()
@@ -43,226 +170,443 @@ class UpdateFoodForm(StatesGroup):
 class SetGoalForm(StatesGroup):
     calorie_goal = State()
 
+db_pool = None
+pool_wait_stats = {"acquired": 0, "wait_total": 0.0, "wait_max": 0.0}
+
+sql_query_logger = metrics.query_logger(METRICS_CONFIG["slow_query_ms"])
+
+async def init_connection(conn: asyncpg.Connection):
+    conn.add_query_logger(sql_query_logger)
+
+async def create_db_pool():
+    global db_pool
+    db_pool = await asyncpg.create_pool(
+        **DB_CONFIG,
+        min_size=POOL_CONFIG["min_size"],
+        max_size=POOL_CONFIG["max_size"],
+        statement_cache_size=POOL_CONFIG["statement_cache_size"],
+        init=init_connection,
+    )
+    logger.info(f"Database pool created (min={POOL_CONFIG['min_size']}, max={POOL_CONFIG['max_size']})")
+
+async def close_db_pool():
+    global db_pool
+    if db_pool is None:
+        return
+    logger.info(f"Closing database pool: {get_pool_stats()}")
+    try:
+        await asyncio.wait_for(db_pool.close(), timeout=POOL_CONFIG["acquire_timeout"])
+    except asyncio.TimeoutError:
+        logger.warning("Database pool did not close in time, terminating connections")
+        db_pool.terminate()
+    db_pool = None
+
+@asynccontextmanager
+async def db_connection():
+    started = time.perf_counter()
+    async with db_pool.acquire(timeout=POOL_CONFIG["acquire_timeout"]) as conn:
+        waited = time.perf_counter() - started
+        pool_wait_stats["acquired"] += 1
+        pool_wait_stats["wait_total"] += waited
+        pool_wait_stats["wait_max"] = max(pool_wait_stats["wait_max"], waited)
+        yield conn
+
+def get_pool_stats():
+    if db_pool is None:
+        return {}
+    size = db_pool.get_size()
+    idle = db_pool.get_idle_size()
+    acquired = pool_wait_stats["acquired"]
+    return {
+        "size": size,
+        "max_size": db_pool.get_max_size(),
+        "in_use": size - idle,
+        "idle": idle,
+        "acquired": acquired,
+        "avg_wait_ms": pool_wait_stats["wait_total"] / acquired * 1000 if acquired else 0.0,
+        "max_wait_ms": pool_wait_stats["wait_max"] * 1000,
+    }
+
+def create_storage():
+    if STORAGE_CONFIG["backend"] == "postgres":
+        return PostgresStorage(db_connection)
+    if STORAGE_CONFIG["backend"] == "sqlite":
+        return SqliteStorage(STORAGE_CONFIG["sqlite_path"])
+    if STORAGE_CONFIG["backend"] == "memory":
+        return SqliteStorage(":memory:")
+    raise ValueError(f"Unknown STORAGE_BACKEND {STORAGE_CONFIG['backend']!r}")
+
+storage = create_storage()
+food_catalog = FoodCatalogCache(storage, **CATALOG_CACHE_CONFIG)
+analytics_cache = AnalyticsCache(storage, **ANALYTICS_CONFIG)
+
+def create_fsm_storage():
+    # The Postgres FSM store needs the pool; embedded backends keep FSM
+    # state in memory.
+    if FSM_CONFIG["storage"] == "memory" or EMBEDDED:
+        return MemoryStorage()
+    if not FSM_SHARDED and (FSM_CONFIG["cache_ttl"] > 0 or FSM_CONFIG["flush_delay"] > 0):
+        logger.warning("FSM_CACHE_TTL/FSM_FLUSH_DELAY are set with FSM_SHARDED=0; another instance "
+                       "handling the same user can read stale FSM state")
+    return PostgresFSMStorage(
+        db_connection,
+        cache_size=FSM_CONFIG["cache_size"],
+        cache_ttl=FSM_CONFIG["cache_ttl"],
+        flush_delay=FSM_CONFIG["flush_delay"],
+    )
+
+dp = Dispatcher(storage=create_fsm_storage())
+metrics.instrument_dispatcher(dp, METRICS_CONFIG["slow_handler_ms"])
+
+reply_coalescer = ReplyCoalescer(max_chats=SEND_LIMIT_CONFIG["max_chats"], drop_keyboards=FSM_SHARDED)
+dp.update.outer_middleware(reply_coalescer.buffer)
+# Inside the coalescer, so FSM writes are stored before the replies go out,
+# and around aiogram's FSM middleware, so its state read counts for the update.
+if isinstance(dp.storage, PostgresFSMStorage):
+    dp.update.outer_middleware.unregister(dp.fsm)
+    dp.update.outer_middleware(dp.storage.update_scope)
+    dp.update.outer_middleware(dp.fsm)
+def process_send_rate(supervisor: bool):
+    rate = SEND_LIMIT_CONFIG["rate"]
+    if WORKER_CONFIG["workers"] <= 0 or EMBEDDED:
+        return rate
+    if supervisor:
+        return rate * SEND_LIMIT_CONFIG["report_share"]
+    return rate * (1 - SEND_LIMIT_CONFIG["report_share"]) / WORKER_CONFIG["workers"]
+
+send_limiter = RateLimiter(
+    process_send_rate(supervisor=True),
+    chat_rate=SEND_LIMIT_CONFIG["chat_rate"],
+    chat_burst=SEND_LIMIT_CONFIG["chat_burst"],
+    max_chats=SEND_LIMIT_CONFIG["max_chats"],
+)
+
+def prepare_bot(bot: Bot, rate_limit: bool = True):
+    # Order matters: merged replies count once against the limiter, and
+    # the API latency metrics leave out time spent waiting for it.
+    bot.session.middleware(reply_coalescer)
+    if rate_limit:
+        bot.session.middleware(RateLimitMiddleware(send_limiter, SEND_LIMIT_CONFIG["max_retries"]))
+    metrics.instrument_bot(bot)
+    return bot
+
+def stat_samples(stats: dict):
+    return [((name,), value) for name, value in stats.items() if isinstance(value, (int, float))]
+
+metrics.REGISTRY.gauge("foodlog_db_pool", "Connection pool statistics.", ["stat"],
+                       collect=lambda: stat_samples(get_pool_stats()))
+metrics.REGISTRY.gauge("foodlog_food_catalog", "Food catalog cache statistics.", ["stat"],
+                       collect=lambda: stat_samples(food_catalog.stats()))
+metrics.REGISTRY.gauge("foodlog_analytics_cache", "Nutrition report cache statistics.", ["stat"],
+                       collect=lambda: stat_samples(analytics_cache.stats()))
+metrics.REGISTRY.gauge("foodlog_outbound", "Outbound message queue statistics (latest daily report run).", ["stat"],
+                       collect=lambda: stat_samples(report_outbound.stats() if report_outbound else {}))
+metrics.REGISTRY.gauge("foodlog_send_limiter", "Telegram send rate limiter statistics.", ["stat"],
+                       collect=lambda: stat_samples(send_limiter.stats()))
+metrics.REGISTRY.gauge("foodlog_reply_coalescer", "Merged replies and dropped keyboards.", ["stat"],
+                       collect=lambda: stat_samples(reply_coalescer.stats()))
+metrics.REGISTRY.gauge("foodlog_log_writer", "Write-behind log queue statistics.", ["stat"],
+                       collect=lambda: stat_samples(get_log_writer_stats()))
+
+async def start_metrics_server(offset: int = 0):
+    if not METRICS_CONFIG["port"]:
+        return None
+    return await metrics.start_server(METRICS_CONFIG["host"], METRICS_CONFIG["port"] + offset)
+
+async def log_pool_stats(interval: float):
+    while True:
+        await asyncio.sleep(interval)
+        logger.info(f"Database pool stats: {get_pool_stats()}")
+
+async def open_storage():
+    if EMBEDDED:
+        await storage.open()
+        logger.info(f"Using embedded {STORAGE_CONFIG['backend']} storage")
+    else:
+        await create_db_pool()
+        await init_db()
+    await food_catalog.warm()
+
+async def close_storage():
+    if EMBEDDED:
+        await storage.close()
+    else:
+        await close_db_pool()
+
 async def init_db():
-    conn = await asyncpg.connect(**DB_CONFIG)
+    async with db_connection() as conn:
+        try:
+            if not AUTO_MIGRATE:
+                version = await schema_migrations.current_version(conn)
+                latest = schema_migrations.load_migrations()[-1].version
+                if version < latest:
+                    raise RuntimeError(f"Schema is at version {version}, expected {latest}; run 'migrate' first")
+                return
+            applied = await schema_migrations.migrate(conn)
+            if any(migration.name == "daily_calories" for migration in applied):
+                if await conn.fetchval("SELECT EXISTS(SELECT 1 FROM DailyLog)"):
+                    logger.warning("DailyCalories is empty but DailyLog has history; run 'backfill-rollup' to build it")
+            if applied:
+                logger.info(f"Database migrated to version {applied[-1].version}")
+        except Exception as e:
+            logger.error(f"Database initialization failed: {e}")
+            raise
+
+async def maintain_log_partitions(archive: bool = True):
+    today = datetime.now().date()
+    async with db_connection() as conn:
+        created = await log_partitions.ensure_partitions(
+            conn, today, log_partitions.add_months(today, PARTITION_CONFIG["months_ahead"])
+        )
+        if created:
+            logger.info(f"Created {created} DailyLog partitions")
+        if archive and PARTITION_CONFIG["retention_months"] > 0:
+            cutoff = log_partitions.add_months(today, -PARTITION_CONFIG["retention_months"])
+            await log_partitions.archive_partitions(conn, cutoff, Path(PARTITION_CONFIG["archive_dir"]))
+
+async def run_log_maintenance(interval: float):
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await maintain_log_partitions()
+        except Exception as e:
+            logger.error(f"DailyLog partition maintenance failed: {e}")
+
+report_outbound = None
+
+async def send_daily_reports(bot: Bot, day, force: bool = False):
+    global report_outbound
+    if not force and not await storage.claim_run("daily_progress", day):
+        logger.info(f"Daily progress for {day} was already sent by another process")
+        return 0
+    # Never faster than this process may send, or the queue just waits in
+    # the limiter.
+    report_outbound = OutboundQueue(bot, **{**OUTBOUND_CONFIG, "rate": min(OUTBOUND_CONFIG["rate"], send_limiter.rate)})
+    report_outbound.start()
+    started = time.perf_counter()
     try:
-        await conn.execute("""
-            CREATE TABLE IF NOT EXISTS Users (
-                user_id BIGINT PRIMARY KEY,
-                username TEXT,
-                first_name TEXT,
-                last_name TEXT,
-                calorie_goal FLOAT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            );
-
-            CREATE TABLE IF NOT EXISTS Foods (
-                food_id SERIAL PRIMARY KEY,
-                food_name TEXT NOT NULL,
-                calories_per_gram FLOAT NOT NULL,
-                user_id BIGINT REFERENCES Users(user_id),
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            );
-
-            CREATE TABLE IF NOT EXISTS DailyLog (
-                log_id SERIAL PRIMARY KEY,
-                user_id BIGINT REFERENCES Users(user_id),
-                food_id INTEGER REFERENCES Foods(food_id),
-                weight_grams FLOAT NOT NULL,
-                calories FLOAT NOT NULL,
-                log_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            );
-        """)
-
-        await conn.execute("""
-            DO $$ 
-            BEGIN
-                -- Add user_id column if not exists
-                IF NOT EXISTS (
-                    SELECT 1 
-                    FROM information_schema.columns 
-                    WHERE table_name = 'foods' AND column_name = 'user_id'
-                ) THEN
-                    ALTER TABLE Foods ADD COLUMN user_id BIGINT REFERENCES Users(user_id);
-                END IF;
-                -- Drop old unique constraint on food_name if exists
-                IF EXISTS (
-                    SELECT 1 
-                    FROM information_schema.constraint_table_usage 
-                    WHERE table_name = 'foods' AND constraint_name = 'foods_food_name_key'
-                ) THEN
-                    ALTER TABLE Foods DROP CONSTRAINT foods_food_name_key;
-                END IF;
-                -- Add new unique constraint on (food_name, user_id) if not exists
-                IF NOT EXISTS (
-                    SELECT 1 
-                    FROM information_schema.constraint_table_usage 
-                    WHERE table_name = 'foods' AND constraint_name = 'unique_food_user'
-                ) THEN
-                    ALTER TABLE Foods ADD CONSTRAINT unique_food_user UNIQUE (food_name, user_id);
-                END IF;
-            END $$;
-        """)
-
-        await conn.execute("""
-            INSERT INTO Foods (food_name, calories_per_gram, user_id)
-            VALUES
-                ('Apple', 0.52, NULL),
-                ('Chicken Breast', 1.65, NULL),
-                ('Rice', 1.30, NULL),
-                ('Banana', 0.89, NULL),
-                ('Salmon', 2.08, NULL),
-                ('Broccoli', 0.35, NULL),
-                ('Bread', 2.65, NULL)
-            ON CONFLICT ON CONSTRAINT unique_food_user DO NOTHING;
-        """)
-        logger.info("Database initialized successfully")
-    except Exception as e:
-        logger.error(f"Database initialization failed: {e}")
-        raise
+        users = await scheduler.send_daily_progress(
+            storage, report_outbound, day, batch_size=DAILY_REPORT_CONFIG["batch_size"]
+        )
     finally:
-        await conn.close()
-
-async def get_main_menu():
-    keyboard = ReplyKeyboardMarkup(
-        keyboard=[
-            [KeyboardButton(text="🍽️ Log Food"), KeyboardButton(text="➕ Add Food")],
-            [KeyboardButton(text="📖 My Foods"), KeyboardButton(text="📅 Daily Summary")],
-            [KeyboardButton(text="📊 Weekly Summary"), KeyboardButton(text="🎯 Set Calorie Goal")]
-        ],
-        resize_keyboard=True
+        await report_outbound.close()
+    logger.info(
+        f"Daily progress for {day}: {users} users in {time.perf_counter() - started:.1f}s, "
+        f"{report_outbound.stats()}"
     )
-    return keyboard
+    return users
+
+def start_daily_reports(bot: Bot):
+    if not DAILY_REPORT_CONFIG["time"]:
+        return None
+    at = datetime.strptime(DAILY_REPORT_CONFIG["time"], "%H:%M").time()
+    return asyncio.create_task(scheduler.run_daily(at, lambda day: send_daily_reports(bot, day)))
 
 async def get_food_keyboard(user_id: int):
-    conn = await asyncpg.connect(**DB_CONFIG)
-    try:
-        foods = await conn.fetch("""
-            SELECT food_name
-            FROM Foods
-            WHERE user_id = $1 OR user_id IS NULL
-            ORDER BY food_name
-        """, user_id)
-        keyboard_buttons = [[KeyboardButton(text=food['food_name'])] for food in foods]
-        keyboard = ReplyKeyboardMarkup(keyboard=keyboard_buttons, resize_keyboard=True)
-        return keyboard
-    finally:
-        await conn.close()
+    return await food_catalog.keyboard(user_id)
+
+async def use_food_keyboard(user_id: int):
+    return await food_catalog.size(user_id) <= FOOD_SEARCH_CONFIG["keyboard_limit"]
+
+def get_food_results_keyboard(foods: list, query: str, offset: int, has_more: bool):
+    page_size = FOOD_SEARCH_CONFIG["page_size"]
+    keyboard = InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text=f"{food.food_name} ({food.calories_per_gram:.2f} kcal/g)", callback_data=f"pick_{food.food_id}")]
+        for food in foods
+    ])
+    navigation = []
+    if offset > 0:
+        navigation.append(InlineKeyboardButton(text="◀️ Prev", callback_data=f"foodpage_{max(offset - page_size, 0)}"))
+    if has_more:
+        navigation.append(InlineKeyboardButton(text="Next ▶️", callback_data=f"foodpage_{offset + page_size}"))
+    if navigation:
+        keyboard.inline_keyboard.append(navigation)
+    keyboard.inline_keyboard.append([InlineKeyboardButton(text="🔎 Search", switch_inline_query_current_chat=query)])
+    return keyboard
 
 async def register_user(user: types.User):
-    conn = await asyncpg.connect(**DB_CONFIG)
-    try:
-        await conn.execute("""
-            INSERT INTO Users (user_id, username, first_name, last_name, created_at)
-            VALUES ($1, $2, $3, $4, $5)
-            ON CONFLICT (user_id) DO NOTHING
-        """, user.id, user.username, user.first_name, user.last_name, datetime.now())
-    finally:
-        await conn.close()
+    await storage.register_user(user.id, user.username, user.first_name, user.last_name, datetime.now())
 
 async def log_food(user_id: int, food_name: str, weight: float):
-    conn = await asyncpg.connect(**DB_CONFIG)
-    try:
-        food = await conn.fetchrow("""
-            SELECT food_id, calories_per_gram
-            FROM Foods
-            WHERE food_name = $1 AND (user_id = $2 OR user_id IS NULL)
-        """, food_name, user_id)
-        if not food:
-            return None
-        calories = food['calories_per_gram'] * weight
-        await conn.execute("""
-            INSERT INTO DailyLog (user_id, food_id, weight_grams, calories, log_date)
-            VALUES ($1, $2, $3, $4, $5)
-        """, user_id, food['food_id'], weight, calories, datetime.now())
-        return calories
-    finally:
-        await conn.close()
+    logged, missing = await log_foods(user_id, [(food_name, weight)])
+    if missing:
+        return None
+    return logged[0][2]
+
+async def log_foods(user_id: int, items: list):
+    # Logs (food_name, weight) pairs as one meal: names are resolved against
+    # the cached catalog and, unless some are unknown (then nothing is
+    # written), all rows go to storage.add_logs in one transaction.
+    # Returns ([(food, weight, calories)], [unknown names]).
+    logged, missing = [], []
+    for food_name, weight in items:
+        food = await food_catalog.resolve(user_id, food_name)
+        if food is None:
+            missing.append(food_name)
+        else:
+            logged.append((food, weight, food.calories_per_gram * weight))
+    if missing or not logged:
+        return [], missing
+    logged_at = datetime.now()
+    rows = [(user_id, food.food_id, weight, calories, logged_at) for food, weight, calories in logged]
+    if log_writer is not None:
+        await log_writer.put(user_id, rows)
+    else:
+        await storage.add_logs(rows)
+    analytics_cache.invalidate(user_id)
+    return logged, []
+
+MEAL_ITEM_SEPARATOR = re.compile(r"[,;\n]+")
+MEAL_ITEM = re.compile(
+    r"^(?:(?P<name>.+?)\s+(?P<weight>\d+(?:\.\d+)?)\s*(?:g|gr|grams?)?"
+    r"|(?P<weight_first>\d+(?:\.\d+)?)\s*(?:g|gr|grams?)?\s+(?P<name_last>.+))$",
+    re.I
+)
+MAX_MEAL_ITEMS = 20
+
+def parse_meal(text: str):
+    # "rice 200, chicken breast 150g; 80 g broccoli" -> [(name, grams), ...].
+    # Raises ValueError naming the first item that can't be read.
+    items = []
+    for part in MEAL_ITEM_SEPARATOR.split(text or ""):
+        part = part.strip()
+        if not part:
+            continue
+        match = MEAL_ITEM.match(part)
+        if match is None:
+            raise ValueError(part)
+        name = match.group("name") or match.group("name_last")
+        weight = float(match.group("weight") or match.group("weight_first"))
+        if weight <= 0:
+            raise ValueError(part)
+        items.append((name.strip(), weight))
+    if not items:
+        raise ValueError(text or "")
+    return items
+
+log_writer = None
+
+async def start_log_writer():
+    global log_writer
+    if LOG_WRITER_CONFIG["enabled"]:
+        log_writer = WriteBehindQueue(
+            storage.add_logs,
+            batch_size=LOG_WRITER_CONFIG["batch_size"],
+            flush_interval=LOG_WRITER_CONFIG["flush_interval"],
+            max_queue=LOG_WRITER_CONFIG["max_queue"],
+            retry_errors=RETRYABLE_ERRORS,
+        )
+        log_writer.start()
+
+async def stop_log_writer():
+    global log_writer
+    if log_writer is not None:
+        await log_writer.close()
+        logger.info(f"Log writer stopped after {log_writer.rows} rows in {log_writer.batches} batches")
+        log_writer = None
+
+def get_log_writer_stats():
+    if log_writer is None:
+        return {}
+    return {"queued": log_writer.qsize(), "rows": log_writer.rows, "batches": log_writer.batches,
+            "dropped": log_writer.dropped}
+
+async def flush_pending_logs(user_id: int):
+    # Summaries must see the user's own queued entries.
+    if log_writer is not None:
+        await log_writer.wait_for(user_id)
+
+async def backfill_daily_rollup():
+    return await storage.rebuild_daily_rollup()
+
+def day_bounds(date: datetime, days: int = 1):
+    # Half-open [start, end) range covering `days` calendar days ending on `date`,
+    # so the log_date filter can use idx_dailylog_user_date.
+    end = datetime.combine(date.date(), datetime.min.time()) + timedelta(days=1)
+    return end - timedelta(days=days), end
 
 async def get_daily_summary(user_id: int, date: datetime):
-    conn = await asyncpg.connect(**DB_CONFIG)
-    try:
-        logs = await conn.fetch("""
-            SELECT f.food_name, dl.weight_grams, dl.calories, dl.log_date
-            FROM DailyLog dl
-            JOIN Foods f ON dl.food_id = f.food_id
-            WHERE dl.user_id = $1
-            AND DATE(dl.log_date) = DATE($2)
-            ORDER BY dl.log_date
-        """, user_id, date)
-        total_calories = sum(log['calories'] for log in logs)
-        calorie_goal = await conn.fetchval("SELECT calorie_goal FROM Users WHERE user_id = $1", user_id)
-        return logs, total_calories, calorie_goal
-    finally:
-        await conn.close()
+    start, end = day_bounds(date)
+    await flush_pending_logs(user_id)
+    logs, calorie_goal = await storage.daily_summary(user_id, start, end)
+    return logs, sum(log.calories for log in logs), calorie_goal
 
 async def get_weekly_summary(user_id: int, end_date: datetime):
-    start_date = end_date - timedelta(days=6)
-    conn = await asyncpg.connect(**DB_CONFIG)
-    try:
-        logs = await conn.fetch("""
-            SELECT DATE(dl.log_date) as log_day, SUM(dl.calories) as daily_calories
-            FROM DailyLog dl
-            WHERE dl.user_id = $1
-            AND dl.log_date >= $2
-            AND dl.log_date <= $3
-            GROUP BY DATE(dl.log_date)
-            ORDER BY DATE(dl.log_date)
-        """, user_id, start_date, end_date)
-        total_calories = sum(log['daily_calories'] for log in logs)
-        calorie_goal = await conn.fetchval("SELECT calorie_goal FROM Users WHERE user_id = $1", user_id)
-        return logs, total_calories, calorie_goal
-    finally:
-        await conn.close()
+    start, end = day_bounds(end_date, days=7)
+    await flush_pending_logs(user_id)
+    logs, calorie_goal = await storage.weekly_summary(user_id, start.date(), end.date())
+    return logs, sum(log.daily_calories for log in logs), calorie_goal
 
 async def get_user_foods(user_id: int):
-    conn = await asyncpg.connect(**DB_CONFIG)
-    try:
-        foods = await conn.fetch("""
-            SELECT food_id, food_name, calories_per_gram
-            FROM Foods
-            WHERE user_id = $1
-            ORDER BY food_name
-        """, user_id)
-        return foods
-    finally:
-        await conn.close()
+    return [CachedFood._make(row) for row in await storage.user_foods(user_id)]
+
+async def get_nutrition_report(user_id: int, day: datetime):
+    await flush_pending_logs(user_id)
+    return await analytics_cache.report(user_id, day.date())
+
+async def format_nutrition_report(user_id: int, report, days: int):
+    window = report.windows[days]
+    response = f"Last {days} days ({report.day.strftime('%Y-%m-%d')}):\n\n"
+    response += f"Days logged: {window.logged_days}/{days}\n"
+    response += f"Average: {window.avg_calories:.1f} kcal/day\n"
+    response += f"Total: {window.total_calories:.1f} kcal\n"
+    response += f"Trend: {window.trend_per_week:+.1f} kcal/day per week\n"
+    response += (
+        f"7-day average: {report.rolling_avg:.1f} kcal/day "
+        f"(range {window.rolling_low:.1f}–{window.rolling_high:.1f})\n"
+    )
+    response += f"Logging streak: {report.logging_streak} days\n"
+    if report.calorie_goal:
+        response += f"\nGoal days: {window.goal_days}/{window.logged_days} at or under {report.calorie_goal:.1f} kcal\n"
+        response += f"Goal streak: {report.goal_streak} days (longest this year: {report.longest_goal_streak})\n"
+    if window.top_foods:
+        response += "\nTop foods:\n"
+        for total in window.top_foods:
+            food = await food_catalog.food_by_id(user_id, total.food_id)
+            name = food.food_name if food else "Unknown food"
+            response += f"🍽️ {name}: {total.grams:.0f}g ({total.calories:.1f} kcal, {total.entries} entries)\n"
+    return response
 
 async def get_user_stats(user_id: int):
-    conn = await asyncpg.connect(**DB_CONFIG)
-    try:
-        stats = await conn.fetchrow("""
-            SELECT
-                (SELECT COUNT(*) FROM Foods WHERE user_id = $1) as foods_added,
-                (SELECT COUNT(*) FROM DailyLog WHERE user_id = $1) as logs_created,
-                (SELECT AVG(SUM(dl.calories)) FROM DailyLog dl 
-                 WHERE dl.user_id = $1 
-                 GROUP BY DATE(dl.log_date)) as avg_daily_calories
-        """, user_id)
-        return stats
-    finally:
-        await conn.close()
+    await flush_pending_logs(user_id)
+    return await storage.user_stats(user_id)
 
 @dp.message(Command("start"))
 async def start_command(message: types.Message, state: FSMContext):
     await state.clear()
     await register_user(message.from_user)
-    keyboard = await get_main_menu()
+    reply_coalescer.forget(message.chat.id)
     await message.answer(
         "Welcome to the Enhanced Food Log Bot! 🍎\n"
         "Track your meals, add custom foods, and monitor your calorie goals. What would you like to do?",
-        reply_markup=keyboard
+        reply_markup=MAIN_MENU
     )
 
 @dp.message(lambda message: message.text == "🍽️ Log Food")
 async def log_food_start(message: types.Message, state: FSMContext):
     await state.clear()
-    keyboard = await get_food_keyboard(message.from_user.id)
+    if await use_food_keyboard(message.from_user.id):
+        keyboard = await get_food_keyboard(message.from_user.id)
+        await message.answer(
+            "Select a food item to log:",
+            reply_markup=keyboard
+        )
+    else:
+        keyboard = InlineKeyboardMarkup(inline_keyboard=[
+            [InlineKeyboardButton(text="🔎 Search", switch_inline_query_current_chat="")]
+        ])
+        await message.answer("Type part of a food name to search for it:", reply_markup=keyboard)
+    await state.set_state(LogFoodForm.food_name)
+
+@dp.message(lambda message: message.text == "🍱 Log Meal")
+async def log_meal_start(message: types.Message, state: FSMContext):
+    await state.clear()
     await message.answer(
-        "Select a food item to log:",
-        reply_markup=keyboard
+        "List what you ate with the weight in grams, separated by commas, e.g.:\n"
+        "rice 200, chicken breast 150, broccoli 80",
+        reply_markup=types.ReplyKeyboardRemove()
     )
-    await state.set_state(LogFoodForm.food_name)
+    await state.set_state(LogMealForm.items)
 
 @dp.message(lambda message: message.text == "➕ Add Food")
 async def add_food_start(message: types.Message, state: FSMContext):
@@ -275,52 +619,69 @@ async def my_foods(message: types.Message, state: FSMContext):
     await state.clear()
     foods = await get_user_foods(message.from_user.id)
     if not foods:
-        await message.answer("You haven't added any custom foods yet. Use 'Add Food' to start!", reply_markup=await get_main_menu())
+        await message.answer("You haven't added any custom foods yet. Use 'Add Food' to start!", reply_markup=MAIN_MENU)
         return
 
     response = "Your custom foods:\n\n"
     keyboard = InlineKeyboardMarkup(inline_keyboard=[])
     for food in foods:
-        response += f"🍽️ {food['food_name']}: {food['calories_per_gram']:.2f} kcal/g\n"
+        response += f"🍽️ {food.food_name}: {food.calories_per_gram:.2f} kcal/g\n"
         keyboard.inline_keyboard.append([
-            InlineKeyboardButton(text=f"Update {food['food_name']}", callback_data=f"update_{food['food_id']}"),
-            InlineKeyboardButton(text=f"Delete {food['food_name']}", callback_data=f"delete_{food['food_id']}")
+            InlineKeyboardButton(text=f"Update {food.food_name}", callback_data=f"update_{food.food_id}"),
+            InlineKeyboardButton(text=f"Delete {food.food_name}", callback_data=f"delete_{food.food_id}")
         ])
     
-    await message.answer(response, parse_mode="Markdown", reply_markup=keyboard)
-    await message.answer("Back to main menu:", reply_markup=await get_main_menu())
+    await message.answer(response, reply_markup=keyboard)
+    await message.answer("Update or delete a food with its buttons.", reply_markup=MAIN_MENU)
 
 @dp.message(lambda message: message.text == "📅 Daily Summary")
 async def daily_summary(message: types.Message, state: FSMContext):
     await state.clear()
     logs, total_calories, calorie_goal = await get_daily_summary(message.from_user.id, datetime.now())
     if not logs:
-        await message.answer("No food logged for today. Start logging with 'Log Food'!", reply_markup=await get_main_menu())
+        await message.answer("No food logged for today. Start logging with 'Log Food'!", reply_markup=MAIN_MENU)
         return
 
     response = f"Daily Summary ({datetime.now().strftime('%Y-%m-%d')}):\n\n"
     for log in logs:
-        response += f"🍽️ {log['food_name']}: {log['weight_grams']}g ({log['calories']:.1f} kcal)\n"
+        response += f"🍽️ {log.food_name}: {log.weight_grams}g ({log.calories:.1f} kcal)\n"
     response += f"\nTotal Calories: {total_calories:.1f} kcal"
     if calorie_goal:
         response += f"\nCalorie Goal: {calorie_goal:.1f} kcal ({(total_calories/calorie_goal*100):.1f}% of goal)"
-    await message.answer(response, reply_markup=await get_main_menu())
+    await message.answer(response, reply_markup=MAIN_MENU)
 
 @dp.message(lambda message: message.text == "📊 Weekly Summary")
 async def weekly_summary(message: types.Message, state: FSMContext):
     await state.clear()
     logs, total_calories, calorie_goal = await get_weekly_summary(message.from_user.id, datetime.now())
     if not logs:
-        await message.answer("No food logged for this week. Start logging with 'Log Food'!", reply_markup=await get_main_menu())
+        await message.answer("No food logged for this week. Start logging with 'Log Food'!", reply_markup=MAIN_MENU)
         return
 
     response = f"Weekly Summary (Last 7 Days):\n\n"
     for log in logs:
-        response += f"📅 {log['log_day'].strftime('%Y-%m-%d')}: {log['daily_calories']:.1f} kcal\n"
+        response += f"📅 {log.log_day.strftime('%Y-%m-%d')}: {log.daily_calories:.1f} kcal\n"
     response += f"\nTotal Weekly Calories: {total_calories:.1f} kcal"
     if calorie_goal:
         response += f"\nDaily Calorie Goal: {calorie_goal:.1f} kcal (Average: {(total_calories/7):.1f} kcal/day)"
-    await message.answer(response, reply_markup=await get_main_menu())
+    await message.answer(response, reply_markup=MAIN_MENU)
+
+@dp.message(lambda message: message.text == "📈 Monthly Report")
+async def monthly_report(message: types.Message, state: FSMContext):
+    await send_nutrition_report(message, state, 30, "Monthly Report")
+
+@dp.message(lambda message: message.text == "🗓️ Yearly Report")
+async def yearly_report(message: types.Message, state: FSMContext):
+    await send_nutrition_report(message, state, 365, "Yearly Report")
+
+async def send_nutrition_report(message: types.Message, state: FSMContext, days: int, title: str):
+    await state.clear()
+    report = await get_nutrition_report(message.from_user.id, datetime.now())
+    if not report.windows[days].logged_days:
+        await message.answer(f"No food logged in the last {days} days. Start logging with 'Log Food'!", reply_markup=MAIN_MENU)
+        return
+    response = await format_nutrition_report(message.from_user.id, report, days)
+    await message.answer(f"{title}\n{response}", reply_markup=MAIN_MENU)
 
 @dp.message(lambda message: message.text == "🎯 Set Calorie Goal")
 async def set_calorie_goal_start(message: types.Message, state: FSMContext):
@@ -331,23 +692,72 @@ async def set_calorie_goal_start(message: types.Message, state: FSMContext):
 @dp.message(LogFoodForm.food_name)
 async def process_food_name(message: types.Message, state: FSMContext):
     food_name = message.text
-    conn = await asyncpg.connect(**DB_CONFIG)
-    try:
-        food_exists = await conn.fetchval(
-            "SELECT EXISTS(SELECT 1 FROM Foods WHERE food_name = $1 AND (user_id = $2 OR user_id IS NULL))",
-            food_name, message.from_user.id
-        )
-        if not food_exists:
+    user_id = message.from_user.id
+    if await food_catalog.lookup(user_id, food_name) is None:
+        if await use_food_keyboard(user_id):
             await message.answer(
                 "Please select a valid food from the keyboard below:",
-                reply_markup=await get_food_keyboard(message.from_user.id)
+                reply_markup=await get_food_keyboard(user_id)
             )
             return
-        await state.update_data(food_name=food_name)
-        await message.answer("Enter the weight in grams (e.g., 100):", reply_markup=types.ReplyKeyboardRemove())
-        await state.set_state(LogFoodForm.weight)
-    finally:
-        await conn.close()
+        foods, has_more = await food_catalog.search(user_id, food_name or "", 0, FOOD_SEARCH_CONFIG["page_size"])
+        if not foods:
+            await message.answer("No foods match that name. Try another search:")
+            return
+        await state.update_data(food_query=food_name)
+        await message.answer(
+            f"Foods matching \"{food_name}\":",
+            reply_markup=get_food_results_keyboard(foods, food_name, 0, has_more)
+        )
+        return
+    await choose_food(message, state, food_name)
+
+async def choose_food(message: types.Message, state: FSMContext, food_name: str):
+    await state.update_data(food_name=food_name)
+    await message.answer("Enter the weight in grams (e.g., 100):", reply_markup=types.ReplyKeyboardRemove())
+    await state.set_state(LogFoodForm.weight)
+
+@dp.callback_query(LogFoodForm.food_name, lambda c: c.data.startswith("foodpage_"))
+async def food_results_page(callback: types.CallbackQuery, state: FSMContext):
+    offset = int(callback.data.split("_")[1])
+    query = (await state.get_data()).get("food_query", "")
+    foods, has_more = await food_catalog.search(callback.from_user.id, query, offset, FOOD_SEARCH_CONFIG["page_size"])
+    await callback.message.edit_reply_markup(reply_markup=get_food_results_keyboard(foods, query, offset, has_more))
+    await callback.answer()
+
+@dp.callback_query(LogFoodForm.food_name, lambda c: c.data.startswith("pick_"))
+async def pick_food(callback: types.CallbackQuery, state: FSMContext):
+    food = await food_catalog.food_by_id(callback.from_user.id, int(callback.data.split("_")[1]))
+    if food is None:
+        await callback.answer("This food is no longer available.", show_alert=True)
+        return
+    await callback.answer()
+    await choose_food(callback.message, state, food.food_name)
+
+@dp.callback_query(lambda c: c.data.startswith(("foodpage_", "pick_")))
+async def expired_food_results(callback: types.CallbackQuery):
+    await callback.answer("This search has expired. Tap 🍽️ Log Food to start again.", show_alert=True)
+
+@dp.inline_query()
+async def food_inline_search(inline_query: types.InlineQuery):
+    offset = int(inline_query.offset or 0)
+    limit = FOOD_SEARCH_CONFIG["inline_limit"]
+    foods, has_more = await food_catalog.search(inline_query.from_user.id, inline_query.query, offset, limit)
+    results = [
+        InlineQueryResultArticle(
+            id=str(food.food_id),
+            title=food.food_name,
+            description=f"{food.calories_per_gram:.2f} kcal/g",
+            input_message_content=InputTextMessageContent(message_text=food.food_name)
+        )
+        for food in foods
+    ]
+    await inline_query.answer(
+        results,
+        cache_time=5,
+        is_personal=True,
+        next_offset=str(offset + limit) if has_more else ""
+    )
 
 @dp.message(LogFoodForm.weight)
 async def process_weight(message: types.Message, state: FSMContext):
@@ -359,17 +769,44 @@ async def process_weight(message: types.Message, state: FSMContext):
         data = await state.get_data()
         calories = await log_food(message.from_user.id, data['food_name'], weight)
         if calories is None:
-            await message.answer("Food not found. Please try again.", reply_markup=await get_main_menu())
+            await message.answer("Food not found. Please try again.", reply_markup=MAIN_MENU)
             await state.clear()
             return
         await message.answer(
             f"Logged {data['food_name']}: {weight}g ({calories:.1f} kcal)",
-            reply_markup=await get_main_menu()
+            reply_markup=MAIN_MENU
         )
         await state.clear()
     except ValueError:
         await message.answer("Please enter a valid number for the weight:")
 
+@dp.message(LogMealForm.items)
+async def process_meal(message: types.Message, state: FSMContext):
+    try:
+        items = parse_meal(message.text)
+    except ValueError as e:
+        await message.answer(
+            f"Couldn't read \"{e}\". Use food name and grams, separated by commas "
+            f"(e.g., rice 200, chicken breast 150):"
+        )
+        return
+    if len(items) > MAX_MEAL_ITEMS:
+        await message.answer(f"Please log at most {MAX_MEAL_ITEMS} items at a time:")
+        return
+    logged, missing = await log_foods(message.from_user.id, items)
+    if missing:
+        await message.answer(
+            "Nothing was logged. These foods were not found: " + ", ".join(missing) +
+            "\nFix the names (or add them with 'Add Food') and send the meal again:"
+        )
+        return
+    response = "Logged meal:\n\n"
+    for food, weight, calories in logged:
+        response += f"🍽️ {food.food_name}: {weight}g ({calories:.1f} kcal)\n"
+    response += f"\nTotal: {sum(calories for _, _, calories in logged):.1f} kcal"
+    await message.answer(response, reply_markup=MAIN_MENU)
+    await state.clear()
+
 @dp.message(AddFoodForm.food_name)
 async def process_food_name_add(message: types.Message, state: FSMContext):
     await state.update_data(food_name=message.text)
@@ -384,19 +821,14 @@ async def process_calories_per_gram(message: types.Message, state: FSMContext):
             await message.answer("Please enter a positive value for calories per gram:")
             return
         data = await state.get_data()
-        conn = await asyncpg.connect(**DB_CONFIG)
         try:
-            await conn.execute("""
-                INSERT INTO Foods (food_name, calories_per_gram, user_id)
-                VALUES ($1, $2, $3)
-            """, data['food_name'], calories_per_gram, message.from_user.id)
-            await message.answer("Food added successfully!", reply_markup=await get_main_menu())
+            food_id = await storage.add_food(message.from_user.id, data['food_name'], calories_per_gram)
+            food_catalog.food_added(message.from_user.id, CachedFood(food_id, data['food_name'], calories_per_gram))
+            await message.answer("Food added successfully!", reply_markup=MAIN_MENU)
             await state.clear()
-        except asyncpg.UniqueViolationError:
-            await message.answer("This food name already exists for you. Try a different name.", reply_markup=await get_main_menu())
+        except DuplicateFoodError:
+            await message.answer("This food name already exists for you. Try a different name.", reply_markup=MAIN_MENU)
             await state.clear()
-        finally:
-            await conn.close()
     except ValueError:
         await message.answer("Please enter a valid number for calories per gram:")
 
@@ -407,15 +839,10 @@ async def process_calorie_goal(message: types.Message, state: FSMContext):
         if calorie_goal <= 0:
             await message.answer("Please enter a positive calorie goal:")
             return
-        conn = await asyncpg.connect(**DB_CONFIG)
-        try:
-            await conn.execute("""
-                UPDATE Users SET calorie_goal = $1 WHERE user_id = $2
-            """, calorie_goal, message.from_user.id)
-            await message.answer(f"Daily calorie goal set to {calorie_goal:.1f} kcal!", reply_markup=await get_main_menu())
-            await state.clear()
-        finally:
-            await conn.close()
+        await storage.set_calorie_goal(message.from_user.id, calorie_goal)
+        analytics_cache.invalidate(message.from_user.id)
+        await message.answer(f"Daily calorie goal set to {calorie_goal:.1f} kcal!", reply_markup=MAIN_MENU)
+        await state.clear()
     except ValueError:
         await message.answer("Please enter a valid number for the calorie goal:")
 
@@ -433,7 +860,7 @@ async def update_food_start(callback: types.CallbackQuery, state: FSMContext):
 
 @dp.callback_query(lambda c: c.data.startswith("field_"))
 async def process_update_field(callback: types.CallbackQuery, state: FSMContext):
-    field = callback.data.split("_")[1]
+    field = callback.data.split("_", 1)[1]
     await state.update_data(field=field)
     await callback.message.answer(f"Enter the new value for {field.replace('_', ' ')}:", reply_markup=types.ReplyKeyboardRemove())
     await state.set_state(UpdateFoodForm.value)
@@ -445,55 +872,305 @@ async def process_update_value(message: types.Message, state: FSMContext):
     field = data['field']
     food_id = data['food_id']
     value = message.text
-    conn = await asyncpg.connect(**DB_CONFIG)
     try:
         if field == "calories_per_gram":
             value = float(value)
             if value <= 0:
                 await message.answer("Please enter a positive value for calories per gram:")
                 return
-        elif field == "food_name":
-            existing_food = await conn.fetchval(
-                "SELECT EXISTS(SELECT 1 FROM Foods WHERE food_name = $1 AND user_id = $2)",
-                value, message.from_user.id
-            )
-            if existing_food:
-                await message.answer("This food name already exists. Try a different name:")
-                return
-
-        await conn.execute(f"""
-            UPDATE Foods
-            SET {field} = $1
-            WHERE food_id = $2 AND user_id = $3
-        """, value, food_id, message.from_user.id)
-        await message.answer("Food updated successfully!", reply_markup=await get_main_menu())
+        try:
+            await storage.update_food(message.from_user.id, food_id, field, value)
+        except DuplicateFoodError:
+            await message.answer("This food name already exists. Try a different name:")
+            return
+        food_catalog.food_updated(message.from_user.id, food_id, **{field: value})
+        await message.answer("Food updated successfully!", reply_markup=MAIN_MENU)
         await state.clear()
     except ValueError:
         await message.answer(f"Please enter a valid value for {field.replace('_', ' ')}:")
     except Exception as e:
         logger.error(f"Error in update: {e}")
         await message.answer("An error occurred. Please try again.")
-    finally:
-        await conn.close()
 
 @dp.callback_query(lambda c: c.data.startswith("delete_"))
 async def delete_food_callback(callback: types.CallbackQuery):
     food_id = int(callback.data.split("_")[1])
-    conn = await asyncpg.connect(**DB_CONFIG)
+    # Queued log rows may still reference the food.
+    await flush_pending_logs(callback.from_user.id)
     try:
-        await conn.execute("DELETE FROM Foods WHERE food_id = $1 AND user_id = $2", food_id, callback.from_user.id)
-        await callback.message.answer("Food deleted successfully!", reply_markup=await get_main_menu())
-    finally:
-        await conn.close()
+        await storage.delete_food(callback.from_user.id, food_id)
+    except FoodInUseError:
+        await callback.message.answer("This food has log entries and can't be deleted.", reply_markup=MAIN_MENU)
+        await callback.answer()
+        return
+    food_catalog.food_deleted(callback.from_user.id, food_id)
+    await callback.message.answer("Food deleted successfully!", reply_markup=MAIN_MENU)
     await callback.answer()
 
+async def healthcheck(request: web.Request):
+    return web.Response(text="ok")
+
+async def run_webhook(bot: Bot, dispatcher: Dispatcher = dp):
+    # Updates are handled inside the request (not in background tasks) so that
+    # runner.cleanup() can drain in-flight updates before the pool and the bot
+    # session are closed. The route is added by hand because
+    # SimpleRequestHandler.register() would close the bot session before the drain.
+    handler = SimpleRequestHandler(
+        dispatcher=dispatcher,
+        bot=bot,
+        handle_in_background=False,
+        secret_token=WEBHOOK_CONFIG["secret"] or None,
+    )
+    app = web.Application()
+    app.router.add_post(WEBHOOK_CONFIG["path"], handler.handle)
+    app.router.add_get("/healthz", healthcheck)
+    runner = web.AppRunner(app, shutdown_timeout=WEBHOOK_CONFIG["drain_timeout"], handle_signals=False)
+    await runner.setup()
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    await dispatcher.emit_startup(bot=bot)
+    try:
+        site = web.TCPSite(runner, WEBHOOK_CONFIG["host"], WEBHOOK_CONFIG["port"])
+        await site.start()
+        if WEBHOOK_CONFIG["url"]:
+            await bot.set_webhook(
+                url=WEBHOOK_CONFIG["url"].rstrip("/") + WEBHOOK_CONFIG["path"],
+                secret_token=WEBHOOK_CONFIG["secret"] or None,
+                allowed_updates=dp.resolve_used_update_types(),
+            )
+        logger.info(f"Serving webhook on {WEBHOOK_CONFIG['host']}:{WEBHOOK_CONFIG['port']}{WEBHOOK_CONFIG['path']}")
+        await stop.wait()
+        logger.info("Shutting down webhook server, draining in-flight updates")
+    finally:
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.remove_signal_handler(sig)
+        await runner.cleanup()
+        await dispatcher.emit_shutdown(bot=bot)
+
+def run_worker(index: int, worker_queue, supervisor_pid: int):
+    # The supervisor owns shutdown: it sends a stop sentinel, so workers
+    # ignore the signals a terminal or service manager sends the whole group.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    asyncio.run(worker_main(index, worker_queue, supervisor_pid))
+
+async def worker_main(index: int, worker_queue, supervisor_pid: int):
+    send_limiter.set_rate(process_send_rate(supervisor=False))
+    bot = prepare_bot(Bot(token=BOT_TOKEN))
+    await create_db_pool()
+    await food_catalog.warm()
+    await start_log_writer()
+    metrics_runner = await start_metrics_server(index + 1)
+    try:
+        await dp.emit_startup(bot=bot)
+
+        async def handle(payload: str):
+            await dp.feed_raw_update(bot, json.loads(payload))
+
+        logger.info(f"Worker {index} ready")
+        await consume(worker_queue, supervisor_pid, handle, WORKER_CONFIG["concurrency"])
+    finally:
+        if metrics_runner:
+            await metrics_runner.cleanup()
+        await dp.emit_shutdown(bot=bot)
+        await bot.session.close()
+        await stop_log_writer()
+        await close_db_pool()
+
+async def run_supervisor(bot: Bot):
+    supervisor = WorkerSupervisor(run_worker, WORKER_CONFIG["workers"], WORKER_CONFIG["queue_size"])
+    front = Dispatcher(disable_fsm=True)
+
+    @front.update.outer_middleware()
+    async def route_update(handler, update: types.Update, data: dict):
+        user = data.get("event_from_user")
+        shard_key = user.id if user else update.update_id
+        await supervisor.dispatch(shard_key, update.model_dump_json(by_alias=True, exclude_none=True))
+
+    metrics.REGISTRY.gauge(
+        "foodlog_worker", "Per-worker process statistics.", ["worker", "stat"],
+        collect=lambda: [
+            ((str(worker["worker"]), name), value)
+            for worker in supervisor.stats()
+            for name, value in worker.items()
+            if name in ("alive", "queue_depth", "routed", "restarts")
+        ],
+    )
+    supervisor.start()
+    monitor = asyncio.create_task(supervisor.monitor(stats_interval=WORKER_CONFIG["stats_interval"]))
+    try:
+        if BOT_MODE == "webhook":
+            await run_webhook(bot, front)
+        else:
+            # One update at a time, so a full worker queue stalls getUpdates
+            # instead of piling up tasks.
+            await front.start_polling(bot, handle_as_tasks=False, allowed_updates=dp.resolve_used_update_types())
+    finally:
+        monitor.cancel()
+        await supervisor.stop()
+
 async def main():
-    await init_db()
-    
+    bot = prepare_bot(Bot(token=BOT_TOKEN))
+    stats_task = None
+    maintenance_task = None
+    reports_task = None
+    metrics_runner = None
     try:
-        await dp.start_polling(bot)
+        await open_storage()
+        if not EMBEDDED:
+            await maintain_log_partitions(archive=False)
+            maintenance_task = asyncio.create_task(run_log_maintenance(PARTITION_CONFIG["interval"]))
+            if POOL_CONFIG["stats_interval"] > 0:
+                stats_task = asyncio.create_task(log_pool_stats(POOL_CONFIG["stats_interval"]))
+        reports_task = start_daily_reports(bot)
+        await start_log_writer()
+        metrics_runner = await start_metrics_server()
+        if WORKER_CONFIG["workers"] > 0 and EMBEDDED:
+            logger.warning("WORKERS is ignored with embedded storage; handling updates in this process")
+        if WORKER_CONFIG["workers"] > 0 and not EMBEDDED:
+            await run_supervisor(bot)
+        elif BOT_MODE == "webhook":
+            await run_webhook(bot)
+        else:
+            await dp.start_polling(bot)
     finally:
+        if stats_task:
+            stats_task.cancel()
+        if maintenance_task:
+            maintenance_task.cancel()
+        if reports_task:
+            reports_task.cancel()
+        if metrics_runner:
+            await metrics_runner.cleanup()
         await bot.session.close()
+        await stop_log_writer()
+        await close_storage()
+
+async def migrate_command(args):
+    async with db_connection() as conn:
+        if args.status:
+            for migration, applied_at in await schema_migrations.status(conn):
+                print(f"{migration.version:04d}_{migration.name}: {applied_at or 'pending'}")
+            return
+        applied = await schema_migrations.migrate(conn, target=args.target)
+    if applied:
+        logger.info(f"Applied migrations: {', '.join(f'{m.version:04d}_{m.name}' for m in applied)}")
+    else:
+        logger.info("Schema is up to date")
+
+async def backfill_command(args):
+    days = await backfill_daily_rollup()
+    logger.info(f"Rebuilt DailyCalories: {days} user-days")
+
+async def archive_command(args):
+    retention = args.retention_months or PARTITION_CONFIG["retention_months"]
+    if retention <= 0:
+        logger.error("Set --retention-months or LOG_RETENTION_MONTHS to a positive number of months")
+        return
+    cutoff = log_partitions.add_months(datetime.now().date(), -retention)
+    async with db_connection() as conn:
+        archived = await log_partitions.archive_partitions(
+            conn, cutoff, Path(args.archive_dir or PARTITION_CONFIG["archive_dir"]), dry_run=args.dry_run
+        )
+    names = ", ".join(name for name, _, _ in archived) or "none"
+    logger.info(f"{'Would archive' if args.dry_run else 'Archived'} partitions ending before {cutoff}: {names}")
+
+async def reports_command(args):
+    day = datetime.fromisoformat(args.day).date() if args.day else datetime.now().date()
+    bot = prepare_bot(Bot(token=BOT_TOKEN))
+    try:
+        await send_daily_reports(bot, day, force=args.force)
+    finally:
+        await bot.session.close()
+
+async def import_command(args):
+    fmt = bulk_io.detect_format(args.path, args.format)
+    importer = bulk_io.import_foods if args.command == "import-foods" else bulk_io.import_logs
+    with bulk_io.open_text(args.path, "r") as f:
+        async with db_connection() as conn:
+            stats = await importer(conn, bulk_io.read_records(f, fmt))
+    logger.info(f"Imported {args.path}: {stats}")
+
+async def export_command(args):
+    fmt = bulk_io.detect_format(args.output, args.format)
+    with bulk_io.open_text(args.output, "w") as f:
+        async with db_connection() as conn:
+            if args.command == "export-foods":
+                count = await bulk_io.export_foods(conn, f, fmt, args.user_id)
+            else:
+                since = datetime.fromisoformat(args.since) if args.since else None
+                count = await bulk_io.export_logs(conn, f, fmt, args.user_id, since)
+    logger.info(f"Exported {count} rows to {args.output}")
+
+async def run_command(command, args):
+    if EMBEDDED:
+        if command not in EMBEDDED_COMMANDS:
+            logger.error(f"'{args.command}' needs STORAGE_BACKEND=postgres")
+            return
+        await storage.open()
+        try:
+            await command(args)
+        finally:
+            await storage.close()
+        return
+    await create_db_pool()
+    try:
+        if command is not migrate_command:
+            await init_db()
+        await command(args)
+    finally:
+        await close_db_pool()
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Food Log Bot")
+    commands = parser.add_subparsers(dest="command")
+    commands.add_parser("run", help="run the bot (default)")
+    migrate = commands.add_parser("migrate", help="apply pending schema migrations")
+    migrate.add_argument("--target", type=int, help="stop after this version")
+    migrate.add_argument("--status", action="store_true", help="list migrations and when they were applied")
+    commands.add_parser("backfill-rollup", help="rebuild DailyCalories from DailyLog history")
+    archive = commands.add_parser("archive-logs", help="archive and drop DailyLog partitions past retention")
+    archive.add_argument("--retention-months", type=int, help="keep this many months besides the current one")
+    archive.add_argument("--archive-dir", help="where the .csv.gz files go (default LOG_ARCHIVE_DIR)")
+    archive.add_argument("--dry-run", action="store_true", help="only list the partitions that would go")
+    reports = commands.add_parser("send-reports", help="send today's goal progress to every user with a goal")
+    reports.add_argument("--day", help="ISO date whose totals are reported (default today)")
+    reports.add_argument("--force", action="store_true", help="send even if this day was already sent")
+    for name, help_text in (("import-foods", "load foods from CSV/JSONL ('-' for stdin)"),
+                            ("import-logs", "load DailyLog history from CSV/JSONL ('-' for stdin)")):
+        command = commands.add_parser(name, help=help_text)
+        command.add_argument("path")
+        command.add_argument("--format", choices=["csv", "jsonl"])
+    for name, help_text in (("export-foods", "write global foods, or one user's foods with --user-id"),
+                            ("export-logs", "write DailyLog history")):
+        command = commands.add_parser(name, help=help_text)
+        command.add_argument("--output", "-o", default="-")
+        command.add_argument("--format", choices=["csv", "jsonl"])
+        command.add_argument("--user-id", type=int)
+        if name == "export-logs":
+            command.add_argument("--since", help="ISO date or timestamp")
+    return parser.parse_args()
+
+COMMANDS = {
+    "migrate": migrate_command,
+    "backfill-rollup": backfill_command,
+    "archive-logs": archive_command,
+    "send-reports": reports_command,
+    "import-foods": import_command,
+    "import-logs": import_command,
+    "export-foods": export_command,
+    "export-logs": export_command,
+}
+
+EMBEDDED_COMMANDS = (backfill_command, reports_command)
 
 if __name__ == "__main__":
-    asyncio.run(main())
\ No newline at end of file
+    args = parse_args()
+    if args.command in COMMANDS:
+        asyncio.run(run_command(COMMANDS[args.command], args))
+    else:
+        asyncio.run(main())
\ No newline at end of file
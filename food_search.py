@@ -0,0 +1,134 @@
+from array import array
+from bisect import bisect_left
+from collections import Counter
+
+
+def normalize(name: str):
+    return " ".join(name.casefold().split())
+
+
+def trigrams(text: str):
+    padded = f"  {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def _add_postings(postings: dict, food_id: int, key: str):
+    grams = trigrams(key)
+    for gram in grams:
+        posting = postings.get(gram)
+        if posting is None:
+            posting = postings[gram] = array("L")
+        posting.append(food_id)
+    return len(grams)
+
+
+class FoodIndex:
+    # In-memory prefix + trigram index over food names, keyed by food_id.
+    # Prefix lookups bisect a sorted list of normalized names; other queries
+    # rank candidates from the rarest trigram posting lists by the share of
+    # query trigrams found in the name (like pg_trgm's word_similarity).
+    # Posting lists are append-only arrays; entries left behind by removals
+    # and renames are skipped at query time and compacted away once they
+    # make up a quarter of the index. Callers that can't afford a compaction
+    # inline pass compact=False and run compact() elsewhere when
+    # needs_compaction says so; it swaps the new postings in at the end, so
+    # searches can run meanwhile.
+
+    max_candidates = 20000
+    min_score = 0.5
+
+    def __init__(self, foods=()):
+        self._names = {}
+        self._keys = []
+        self._key_ids = array("L")
+        self._postings = {}
+        self._posting_count = 0
+        self._stale = 0
+        self.build(foods)
+
+    def __len__(self):
+        return len(self._names)
+
+    def __contains__(self, food_id: int):
+        return food_id in self._names
+
+    def build(self, foods):
+        self._names = {food_id: normalize(name) for food_id, name in foods}
+        pairs = sorted((key, food_id) for food_id, key in self._names.items())
+        self._keys = [key for key, _ in pairs]
+        self._key_ids = array("L", (food_id for _, food_id in pairs))
+        self._reindex_trigrams()
+
+    def _reindex_trigrams(self):
+        postings = {}
+        count = 0
+        for food_id, key in list(self._names.items()):
+            count += _add_postings(postings, food_id, key)
+        self._postings, self._posting_count, self._stale = postings, count, 0
+
+    @property
+    def needs_compaction(self):
+        return self._stale * 4 > self._posting_count
+
+    def compact(self):
+        self._reindex_trigrams()
+
+    def _index_trigrams(self, food_id: int, key: str):
+        self._posting_count += _add_postings(self._postings, food_id, key)
+
+    def add(self, food_id: int, name: str, compact: bool = True):
+        self.remove(food_id, compact)
+        key = normalize(name)
+        self._names[food_id] = key
+        position = bisect_left(self._keys, key)
+        self._keys.insert(position, key)
+        self._key_ids.insert(position, food_id)
+        self._index_trigrams(food_id, key)
+
+    def remove(self, food_id: int, compact: bool = True):
+        key = self._names.pop(food_id, None)
+        if key is None:
+            return
+        position = bisect_left(self._keys, key)
+        while self._key_ids[position] != food_id:
+            position += 1
+        del self._keys[position]
+        del self._key_ids[position]
+        self._stale += len(trigrams(key))
+        if compact and self.needs_compaction:
+            self._reindex_trigrams()
+
+    def search(self, query: str, limit: int = 20):
+        key = normalize(query)
+        if not key or limit <= 0:
+            return []
+        results = []
+        position = bisect_left(self._keys, key)
+        while position < len(self._keys) and len(results) < limit and self._keys[position].startswith(key):
+            results.append(self._key_ids[position])
+            position += 1
+        if len(results) >= limit or len(key) < 3:
+            return results
+
+        query_grams = trigrams(key)
+        posting_lists = sorted((self._postings.get(gram, ()) for gram in query_grams), key=len)
+        counts = Counter()
+        budget = self.max_candidates
+        for postings in posting_lists:
+            if budget <= 0:
+                break
+            counts.update(postings[:budget] if len(postings) > budget else postings)
+            budget -= len(postings)
+
+        found = set(results)
+        scored = []
+        for food_id, _ in counts.most_common(limit * 10):
+            name = self._names.get(food_id)
+            if name is None or food_id in found:
+                continue
+            score = len(query_grams & trigrams(name)) / len(query_grams)
+            if score >= self.min_score:
+                scored.append((-score, len(name), name, food_id))
+        scored.sort()
+        results.extend(food_id for *_, food_id in scored[:limit - len(results)])
+        return results
@@ -0,0 +1,227 @@
+import asyncio
+import contextvars
+import json
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Mapping
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, DefaultKeyBuilder, StateType, StorageKey
+
+logger = logging.getLogger(__name__)
+
+_UNKNOWN = object()
+# Storage keys read during the update being handled (see update_scope).
+_update_keys = contextvars.ContextVar("fsm_update_keys", default=None)
+
+UPSERT_SQL = """
+    INSERT INTO FsmStorage (storage_key, state, data, updated_at)
+    VALUES ($1, $2, $3::jsonb, CURRENT_TIMESTAMP)
+    ON CONFLICT (storage_key) DO UPDATE SET
+        state = CASE WHEN $4 THEN EXCLUDED.state ELSE FsmStorage.state END,
+        data = CASE WHEN $5 THEN EXCLUDED.data ELSE FsmStorage.data END,
+        updated_at = EXCLUDED.updated_at
+"""
+
+
+class FSMRecord:
+    __slots__ = ("state", "data", "loaded_at")
+
+    def __init__(self, state=_UNKNOWN, data=_UNKNOWN, loaded_at: float = 0.0):
+        self.state = state
+        self.data = data
+        self.loaded_at = loaded_at
+
+
+class PostgresFSMStorage(BaseStorage):
+    # FSM state and data live in the FsmStorage table. Reads are served from a
+    # local LRU cache (entries are re-read after `cache_ttl` seconds) and
+    # writes are coalesced: every set_state/set_data marks the key dirty and
+    # one batched flush runs `flush_delay` seconds later, so a handler's
+    # clear/update/set sequence costs a single round trip. close() flushes
+    # whatever is still pending.
+    # Caching is only correct while all updates of a user reach this
+    # process (a single polling process, or WORKERS sharding by user). When
+    # several processes share users, e.g. webhook instances behind a load
+    # balancer, use cache_ttl=0 and flush_delay=0: records are then read
+    # from the table once per update and written back when it is done.
+    # That needs update_scope registered as an outer update middleware;
+    # without it every read and every write is a round trip of its own.
+
+    def __init__(
+        self,
+        connection_factory,
+        key_builder=None,
+        cache_size: int = 10000,
+        cache_ttl: float = 30,
+        flush_delay: float = 0.05,
+    ):
+        self._connection = connection_factory
+        self.key_builder = key_builder or DefaultKeyBuilder(with_bot_id=True, with_destiny=True)
+        self.cache_size = cache_size
+        self.cache_ttl = cache_ttl
+        self.flush_delay = flush_delay
+        self._cache = OrderedDict()
+        self._dirty = {}
+        self._flush_task = None
+        self._flush_lock = asyncio.Lock()
+
+    def _entry(self, key: StorageKey):
+        storage_key = self.key_builder.build(key)
+        record = self._cache.get(storage_key)
+        if record is None:
+            record = self._cache[storage_key] = FSMRecord()
+            self._evict()
+        else:
+            self._cache.move_to_end(storage_key)
+        return storage_key, record
+
+    def _evict(self):
+        while len(self._cache) > self.cache_size:
+            for storage_key in self._cache:
+                if storage_key not in self._dirty:
+                    del self._cache[storage_key]
+                    break
+            else:
+                return
+
+    async def update_scope(self, handler, event, data):
+        # Outer update middleware: each key is loaded at most once per update
+        # and, with flush_delay=0, the update's writes go out in one flush
+        # after the handler, also when it failed.
+        token = _update_keys.set(set())
+        try:
+            result = await handler(event, data)
+        except BaseException:
+            if self.flush_delay <= 0:
+                try:
+                    await self.flush()
+                except Exception:
+                    pass
+            raise
+        finally:
+            _update_keys.reset(token)
+        if self.flush_delay <= 0:
+            await self.flush()
+        return result
+
+    def _current(self, storage_key: str, record: FSMRecord):
+        # Whether the cached record can be used without reading the table.
+        if record.state is _UNKNOWN or record.data is _UNKNOWN:
+            return False
+        loaded = _update_keys.get()
+        return (storage_key in self._dirty or (loaded is not None and storage_key in loaded)
+                or time.monotonic() - record.loaded_at < self.cache_ttl)
+
+    async def _load(self, storage_key: str, record: FSMRecord):
+        if self._current(storage_key, record):
+            return
+        loaded = _update_keys.get()
+        async with self._connection() as conn:
+            row = await conn.fetchrow("SELECT state, data FROM FsmStorage WHERE storage_key = $1", storage_key)
+        # Fields written locally since the last flush win over the stored row.
+        state_dirty, data_dirty = self._dirty.get(storage_key, (False, False))
+        if not state_dirty:
+            record.state = row['state'] if row else None
+        if not data_dirty:
+            record.data = json.loads(row['data']) if row else {}
+        record.loaded_at = time.monotonic()
+        if loaded is not None:
+            loaded.add(storage_key)
+
+    def _mark_dirty(self, storage_key: str, record: FSMRecord, state: bool = False, data: bool = False):
+        if record.state is not _UNKNOWN and record.data is not _UNKNOWN:
+            record.loaded_at = time.monotonic()
+        state_dirty, data_dirty = self._dirty.get(storage_key, (False, False))
+        self._dirty[storage_key] = (state_dirty or state, data_dirty or data)
+        if self.flush_delay > 0 and (self._flush_task is None or self._flush_task.done()):
+            # The flush writes every user's records, so it runs outside the
+            # context of the update that happened to schedule it.
+            self._flush_task = asyncio.create_task(self._flush_later(), context=contextvars.Context())
+
+    async def _write(self, storage_key: str, record: FSMRecord, state: bool = False, data: bool = False):
+        self._mark_dirty(storage_key, record, state=state, data=data)
+        if self.flush_delay <= 0 and _update_keys.get() is None:
+            await self.flush()
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        storage_key, record = self._entry(key)
+        state = state.state if isinstance(state, State) else state
+        if self._current(storage_key, record) and record.state == state:
+            return
+        record.state = state
+        await self._write(storage_key, record, state=True)
+
+    async def get_state(self, key: StorageKey):
+        storage_key, record = self._entry(key)
+        await self._load(storage_key, record)
+        return record.state
+
+    async def set_data(self, key: StorageKey, data: Mapping[str, Any]) -> None:
+        storage_key, record = self._entry(key)
+        if self._current(storage_key, record) and record.data == data:
+            return
+        record.data = dict(data)
+        await self._write(storage_key, record, data=True)
+
+    async def get_data(self, key: StorageKey) -> dict:
+        storage_key, record = self._entry(key)
+        await self._load(storage_key, record)
+        return dict(record.data)
+
+    async def _flush_later(self):
+        delay = self.flush_delay
+        while self._dirty:
+            await asyncio.sleep(delay)
+            try:
+                await self.flush()
+                delay = self.flush_delay
+            except Exception:
+                delay = min(max(delay, 0.5) * 2, 30)
+
+    async def flush(self):
+        # One flush at a time, so a caller whose keys were taken by a flush
+        # still in flight only returns once they are stored.
+        async with self._flush_lock:
+            await self._flush()
+
+    async def _flush(self):
+        if not self._dirty:
+            return
+        pending, self._dirty = self._dirty, {}
+        upserts, deletes = [], []
+        for storage_key, (state_dirty, data_dirty) in pending.items():
+            record = self._cache.get(storage_key)
+            if record is None:
+                continue
+            if record.state is None and record.data == {}:
+                deletes.append(storage_key)
+                continue
+            state = record.state if state_dirty else None
+            data = json.dumps(record.data) if data_dirty else "{}"
+            upserts.append((storage_key, state, data, state_dirty, data_dirty))
+        try:
+            async with self._connection() as conn:
+                async with conn.transaction():
+                    if upserts:
+                        await conn.executemany(UPSERT_SQL, upserts)
+                    if deletes:
+                        await conn.execute("DELETE FROM FsmStorage WHERE storage_key = ANY($1::text[])", deletes)
+        except BaseException as e:
+            # close() cancels a delayed flush and then flushes again itself.
+            if not isinstance(e, asyncio.CancelledError):
+                logger.error(f"Failed to flush {len(pending)} FSM records: {e!r}")
+            for storage_key, (state_dirty, data_dirty) in pending.items():
+                current = self._dirty.get(storage_key, (False, False))
+                self._dirty[storage_key] = (current[0] or state_dirty, current[1] or data_dirty)
+            raise
+
+    async def close(self) -> None:
+        if self._flush_task is not None and not self._flush_task.done():
+            self._flush_task.cancel()
+            try:
+                await self._flush_task
+            except asyncio.CancelledError:
+                pass
+        await self.flush()
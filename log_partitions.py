@@ -0,0 +1,93 @@
+import gzip
+import logging
+import os
+import re
+from datetime import date
+from pathlib import Path
+
+import asyncpg
+
+logger = logging.getLogger(__name__)
+
+# pg_advisory_xact_lock key serialising partition DDL across processes.
+PARTITION_LOCK_ID = 7_246_713_002
+_PARTITION_NAME = re.compile(r"^dailylog_p(\d{4})_(\d{2})$")
+
+
+def add_months(day: date, months: int):
+    index = day.year * 12 + day.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+async def ensure_partitions(conn: asyncpg.Connection, first: date, last: date):
+    # Creates the monthly DailyLog partitions covering [first, last]; rows
+    # already sitting in DailyLog_default for those months are moved in.
+    async with conn.transaction():
+        await conn.execute("SELECT pg_advisory_xact_lock($1)", PARTITION_LOCK_ID)
+        return await conn.fetchval("SELECT ensure_dailylog_partitions($1, $2)", first, last)
+
+
+async def list_partitions(conn: asyncpg.Connection, detached: bool = False):
+    # Attached monthly partitions of DailyLog or, with `detached`, the
+    # dailylog_pYYYY_MM tables a previous archive run detached but did not
+    # get to drop.
+    if detached:
+        rows = await conn.fetch("""
+            SELECT relname
+            FROM pg_class
+            WHERE relkind = 'r' AND NOT relispartition AND relname LIKE 'dailylog\\_p%'
+              AND pg_table_is_visible(oid)
+        """)
+    else:
+        rows = await conn.fetch("""
+            SELECT c.relname
+            FROM pg_inherits i
+            JOIN pg_class c ON c.oid = i.inhrelid
+            WHERE i.inhparent = 'dailylog'::regclass
+        """)
+    partitions = []
+    for row in rows:
+        match = _PARTITION_NAME.match(row['relname'])
+        if match:
+            partitions.append((date(int(match.group(1)), int(match.group(2)), 1), row['relname']))
+    return sorted(partitions)
+
+
+async def detach_partition(conn: asyncpg.Connection, name: str):
+    # DETACH takes an ACCESS EXCLUSIVE lock on DailyLog, so it runs in a
+    # transaction of its own and the lock is gone before the export starts.
+    # Once detached the table no longer receives rows.
+    async with conn.transaction():
+        await conn.execute("SELECT pg_advisory_xact_lock($1)", PARTITION_LOCK_ID)
+        await conn.execute(f'ALTER TABLE DailyLog DETACH PARTITION "{name}"')
+
+
+async def archive_partition(conn: asyncpg.Connection, name: str, archive_dir: Path):
+    # Copies a detached partition to <archive_dir>/<name>.csv.gz and drops
+    # it. The file only gets its final name once it is complete, and the
+    # table is only dropped after that, so a failed run can be repeated.
+    archive_dir.mkdir(parents=True, exist_ok=True)
+    path = archive_dir / f"{name}.csv.gz"
+    partial = archive_dir / f"{name}.csv.gz.partial"
+    with gzip.open(partial, "wb") as f:
+        status = await conn.copy_from_table(name, output=f, format="csv", header=True)
+    os.replace(partial, path)
+    await conn.execute(f'DROP TABLE "{name}"')
+    return int(status.split()[-1]), path
+
+
+async def archive_partitions(conn: asyncpg.Connection, before: date, archive_dir: Path, dry_run: bool = False):
+    # Archives every monthly partition that ends on or before `before`,
+    # including ones an earlier run left detached.
+    due = lambda partitions: [(month, name) for month, name in partitions if add_months(month, 1) <= before]
+    attached = due(await list_partitions(conn))
+    if dry_run:
+        return [(name, None, None) for _, name in attached + due(await list_partitions(conn, detached=True))]
+    for _, name in attached:
+        await detach_partition(conn, name)
+    archived = []
+    for _, name in due(await list_partitions(conn, detached=True)):
+        rows, path = await archive_partition(conn, name, archive_dir)
+        logger.info(f"Archived {name}: {rows} rows to {path}")
+        archived.append((name, rows, path))
+    return archived
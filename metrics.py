@@ -0,0 +1,257 @@
+import contextvars
+import logging
+import re
+import time
+from bisect import bisect_left
+from functools import lru_cache
+
+from aiogram import BaseMiddleware
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.fsm.state import State
+from aiohttp import web
+
+logger = logging.getLogger(__name__)
+
+# States set while a handler runs, recorded by instrument_fsm_storage().
+_states_set = contextvars.ContextVar("fsm_states_set", default=None)
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names, values, extra: str = ""):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name: str, help_text: str, labels=()):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self._values = {}
+
+    def inc(self, *label_values, amount: float = 1):
+        self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def samples(self):
+        for label_values, value in sorted(self._values.items()):
+            yield f"{self.name}{_format_labels(self.labels, label_values)} {value}"
+
+
+class Gauge:
+    # Either set() directly or computed at scrape time by `collect`, which
+    # returns (label_values, value) pairs.
+    kind = "gauge"
+
+    def __init__(self, name: str, help_text: str, labels=(), collect=None):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self._collect = collect
+        self._values = {}
+
+    def set(self, value: float, *label_values):
+        self._values[label_values] = value
+
+    def samples(self):
+        values = dict(self._collect()) if self._collect else self._values
+        for label_values, value in sorted(values.items()):
+            yield f"{self.name}{_format_labels(self.labels, label_values)} {float(value)}"
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self._series = {}
+
+    def observe(self, value: float, *label_values):
+        series = self._series.get(label_values)
+        if series is None:
+            series = self._series[label_values] = [[0] * (len(self.buckets) + 1), 0.0]
+        series[0][bisect_left(self.buckets, value)] += 1
+        series[1] += value
+
+    def samples(self):
+        for label_values, (counts, total) in sorted(self._series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += count
+                bucket = f'le="{bound}"'
+                yield f"{self.name}_bucket{_format_labels(self.labels, label_values, bucket)} {cumulative}"
+            labels = _format_labels(self.labels, label_values)
+            yield f"{self.name}_sum{labels} {total}"
+            yield f"{self.name}_count{labels} {cumulative}"
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+
+    def _register(self, metric):
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help_text: str, labels=()):
+        return self._register(Counter(name, help_text, labels))
+
+    def gauge(self, name: str, help_text: str, labels=(), collect=None):
+        return self._register(Gauge(name, help_text, labels, collect))
+
+    def histogram(self, name: str, help_text: str, labels=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(name, help_text, labels, buckets))
+
+    def render(self):
+        lines = []
+        for metric in self._metrics.values():
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            try:
+                lines.extend(metric.samples())
+            except Exception as e:
+                logger.error(f"Failed to collect {metric.name}: {e}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+handler_seconds = REGISTRY.histogram(
+    "foodlog_handler_seconds", "Time spent in update handlers.", ["handler"])
+handler_errors = REGISTRY.counter(
+    "foodlog_handler_errors_total", "Update handlers that raised.", ["handler"])
+fsm_transitions = REGISTRY.counter(
+    "foodlog_fsm_transitions_total", "FSM state changes made by handlers.", ["from_state", "to_state"])
+sql_seconds = REGISTRY.histogram(
+    "foodlog_sql_seconds", "Time spent in SQL statements.", ["operation", "table"])
+sql_errors = REGISTRY.counter(
+    "foodlog_sql_errors_total", "SQL statements that failed.", ["operation", "table"])
+telegram_seconds = REGISTRY.histogram(
+    "foodlog_telegram_api_seconds", "Latency of Telegram Bot API calls.", ["method"])
+telegram_errors = REGISTRY.counter(
+    "foodlog_telegram_api_errors_total", "Telegram Bot API calls that failed.", ["method"])
+
+_SQL_TABLE = re.compile(r"\b(?:FROM|INTO|UPDATE|TABLE|JOIN)\s+(?:IF\s+(?:NOT\s+)?EXISTS\s+)?([A-Za-z_][\w.]*)", re.I)
+_SQL_OPERATION = re.compile(r"\s*(\w+)")
+_SQL_CTE = re.compile(r"\)\s*(SELECT|INSERT|UPDATE|DELETE)\b", re.I)
+
+
+@lru_cache(maxsize=1024)
+def query_labels(query: str):
+    first = _SQL_OPERATION.match(query)
+    operation = first.group(1).upper() if first else "UNKNOWN"
+    if operation == "WITH":
+        main = _SQL_CTE.findall(query)
+        operation = main[-1].upper() if main else operation
+    table = _SQL_TABLE.search(query)
+    return operation, table.group(1).lower() if table else "-"
+
+
+def query_logger(slow_query_ms: float = 0):
+    # Returns an asyncpg query logger; attach it to each pooled connection
+    # with conn.add_query_logger() from the pool's `init` callback.
+    def record(logged):
+        labels = query_labels(logged.query)
+        sql_seconds.observe(logged.elapsed, *labels)
+        if logged.exception is not None:
+            sql_errors.inc(*labels)
+        if slow_query_ms and logged.elapsed * 1000 >= slow_query_ms:
+            logger.warning(f"Slow query ({logged.elapsed * 1000:.1f} ms): {' '.join(logged.query.split())[:500]}")
+    return record
+
+
+class HandlerMetricsMiddleware(BaseMiddleware):
+    # Inner middleware: runs only once a handler matched, so the handler's
+    # function name is known. Also counts the FSM state changes it made,
+    # from the states instrument_fsm_storage() saw being set, so the state
+    # is never read back. Metrics failures are logged, never raised.
+
+    def __init__(self, slow_handler_ms: float = 0):
+        self.slow_handler_ms = slow_handler_ms
+
+    async def __call__(self, handler, event, data):
+        handler_object = data.get("handler")
+        name = getattr(handler_object.callback, "__name__", "unknown") if handler_object else "unknown"
+        before = data.get("raw_state")
+        states = []
+        token = _states_set.set(states)
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception:
+            handler_errors.inc(name)
+            raise
+        finally:
+            _states_set.reset(token)
+            try:
+                self._record(name, time.perf_counter() - started, before, states)
+            except Exception as e:
+                logger.error(f"Failed to record metrics for {name}: {e!r}")
+
+    def _record(self, name: str, elapsed: float, before, states: list):
+        handler_seconds.observe(elapsed, name)
+        if self.slow_handler_ms and elapsed * 1000 >= self.slow_handler_ms:
+            logger.warning(f"Slow handler {name}: {elapsed * 1000:.1f} ms")
+        if states and states[-1] != before:
+            fsm_transitions.inc(before or "none", states[-1] or "none")
+
+
+class TelegramMetricsMiddleware(BaseRequestMiddleware):
+    async def __call__(self, make_request, bot, method):
+        name = getattr(method, "__api_method__", type(method).__name__)
+        started = time.perf_counter()
+        try:
+            return await make_request(bot, method)
+        except Exception:
+            telegram_errors.inc(name)
+            raise
+        finally:
+            telegram_seconds.observe(time.perf_counter() - started, name)
+
+
+def instrument_fsm_storage(storage):
+    set_state = storage.set_state
+
+    async def recording_set_state(key, state=None):
+        await set_state(key, state)
+        states = _states_set.get()
+        if states is not None:
+            states.append(state.state if isinstance(state, State) else state)
+
+    storage.set_state = recording_set_state
+
+
+def instrument_dispatcher(dispatcher, slow_handler_ms: float = 0):
+    middleware = HandlerMetricsMiddleware(slow_handler_ms)
+    for name, observer in dispatcher.observers.items():
+        if name != "update":
+            observer.middleware(middleware)
+    instrument_fsm_storage(dispatcher.storage)
+
+
+def instrument_bot(bot):
+    bot.session.middleware(TelegramMetricsMiddleware())
+
+
+async def metrics_handler(request: web.Request):
+    return web.Response(text=REGISTRY.render(), content_type="text/plain", charset="utf-8")
+
+
+async def start_server(host: str, port: int):
+    app = web.Application()
+    app.router.add_get("/metrics", metrics_handler)
+    runner = web.AppRunner(app, handle_signals=False)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logger.info(f"Serving metrics on http://{host}:{port}/metrics")
+    return runner
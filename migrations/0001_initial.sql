@@ -0,0 +1,72 @@
+-- Schema as created by the original init_db, including the in-place
+-- upgrade of databases that predate custom foods.
+CREATE TABLE IF NOT EXISTS Users (
+    user_id BIGINT PRIMARY KEY,
+    username TEXT,
+    first_name TEXT,
+    last_name TEXT,
+    calorie_goal FLOAT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS Foods (
+    food_id SERIAL PRIMARY KEY,
+    food_name TEXT NOT NULL,
+    calories_per_gram FLOAT NOT NULL,
+    user_id BIGINT REFERENCES Users(user_id),
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS DailyLog (
+    log_id SERIAL PRIMARY KEY,
+    user_id BIGINT REFERENCES Users(user_id),
+    food_id INTEGER REFERENCES Foods(food_id),
+    weight_grams FLOAT NOT NULL,
+    calories FLOAT NOT NULL,
+    log_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+DO $$
+BEGIN
+    -- Add user_id column if not exists
+    IF NOT EXISTS (
+        SELECT 1
+        FROM information_schema.columns
+        WHERE table_name = 'foods' AND column_name = 'user_id'
+    ) THEN
+        ALTER TABLE Foods ADD COLUMN user_id BIGINT REFERENCES Users(user_id);
+    END IF;
+    -- Drop old unique constraint on food_name if exists
+    IF EXISTS (
+        SELECT 1
+        FROM information_schema.constraint_table_usage
+        WHERE table_name = 'foods' AND constraint_name = 'foods_food_name_key'
+    ) THEN
+        ALTER TABLE Foods DROP CONSTRAINT foods_food_name_key;
+    END IF;
+    -- Add new unique constraint on (food_name, user_id) if not exists
+    IF NOT EXISTS (
+        SELECT 1
+        FROM information_schema.constraint_table_usage
+        WHERE table_name = 'foods' AND constraint_name = 'unique_food_user'
+    ) THEN
+        ALTER TABLE Foods ADD CONSTRAINT unique_food_user UNIQUE (food_name, user_id);
+    END IF;
+END $$;
+
+-- unique_food_user treats NULL user_ids as distinct, so the seed checks
+-- for existing global foods itself.
+INSERT INTO Foods (food_name, calories_per_gram, user_id)
+SELECT seed.food_name, seed.calories_per_gram, NULL
+FROM (VALUES
+    ('Apple', 0.52),
+    ('Chicken Breast', 1.65),
+    ('Rice', 1.30),
+    ('Banana', 0.89),
+    ('Salmon', 2.08),
+    ('Broccoli', 0.35),
+    ('Bread', 2.65)
+) AS seed (food_name, calories_per_gram)
+WHERE NOT EXISTS (
+    SELECT 1 FROM Foods f WHERE f.food_name = seed.food_name AND f.user_id IS NULL
+);
@@ -0,0 +1,7 @@
+CREATE INDEX IF NOT EXISTS idx_dailylog_user_date
+    ON DailyLog (user_id, log_date) INCLUDE (calories, food_id, weight_grams);
+CREATE INDEX IF NOT EXISTS idx_foods_user_name
+    ON Foods (user_id, food_name);
+-- Backs the DailyLog.food_id foreign key check when a food is deleted.
+CREATE INDEX IF NOT EXISTS idx_dailylog_food
+    ON DailyLog (food_id);
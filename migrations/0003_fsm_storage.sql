@@ -0,0 +1,6 @@
+CREATE TABLE IF NOT EXISTS FsmStorage (
+    storage_key TEXT PRIMARY KEY,
+    state TEXT,
+    data JSONB NOT NULL DEFAULT '{}',
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
@@ -0,0 +1,11 @@
+-- Per-user daily totals kept in step with DailyLog by log_food and the
+-- bulk importer. An existing DailyLog history is loaded with
+-- `python food_log_bot.py backfill-rollup`.
+CREATE TABLE IF NOT EXISTS DailyCalories (
+    user_id BIGINT REFERENCES Users(user_id),
+    log_day DATE NOT NULL,
+    total_calories FLOAT NOT NULL DEFAULT 0,
+    total_grams FLOAT NOT NULL DEFAULT 0,
+    entry_count INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (user_id, log_day)
+);
@@ -0,0 +1,21 @@
+-- Before migrations, every start re-inserted the seed foods because
+-- unique_food_user treats NULL user_ids as distinct. Point logs at the
+-- oldest copy of each global food, drop the others and keep global names
+-- unique from now on.
+WITH canonical AS (
+    SELECT food_id, MIN(food_id) OVER (PARTITION BY food_name) AS keep_id
+    FROM Foods
+    WHERE user_id IS NULL
+)
+UPDATE DailyLog dl
+SET food_id = c.keep_id
+FROM canonical c
+WHERE dl.food_id = c.food_id AND c.food_id <> c.keep_id;
+
+DELETE FROM Foods f
+USING Foods keep
+WHERE f.user_id IS NULL AND keep.user_id IS NULL
+AND keep.food_name = f.food_name AND keep.food_id < f.food_id;
+
+CREATE UNIQUE INDEX IF NOT EXISTS unique_global_food_name
+    ON Foods (food_name) WHERE user_id IS NULL;
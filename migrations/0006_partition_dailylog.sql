@@ -0,0 +1,79 @@
+-- Range-partition DailyLog by month on log_date. Rows outside every
+-- monthly partition land in DailyLog_default; ensure_dailylog_partitions()
+-- creates monthly partitions (moving any such rows into them) and is
+-- called at startup, daily, and by the bulk importer. The existing table is
+-- copied over and dropped, so run this in a quiet period on big databases.
+CREATE OR REPLACE FUNCTION ensure_dailylog_partitions(first_month DATE, last_month DATE)
+RETURNS INTEGER
+LANGUAGE plpgsql AS $$
+DECLARE
+    month_start DATE := date_trunc('month', first_month);
+    month_end DATE;
+    partition_name TEXT;
+    created INTEGER := 0;
+BEGIN
+    WHILE month_start <= last_month LOOP
+        month_end := month_start + INTERVAL '1 month';
+        partition_name := format('dailylog_p%s', to_char(month_start, 'YYYY_MM'));
+        IF to_regclass(partition_name) IS NULL THEN
+            IF EXISTS (
+                SELECT 1 FROM DailyLog_default WHERE log_date >= month_start AND log_date < month_end
+            ) THEN
+                EXECUTE format('CREATE TABLE %I (LIKE DailyLog INCLUDING DEFAULTS)', partition_name);
+                EXECUTE format(
+                    'WITH moved AS (DELETE FROM DailyLog_default WHERE log_date >= %L AND log_date < %L RETURNING *)'
+                    ' INSERT INTO %I SELECT * FROM moved',
+                    month_start, month_end, partition_name
+                );
+                EXECUTE format(
+                    'ALTER TABLE DailyLog ATTACH PARTITION %I FOR VALUES FROM (%L) TO (%L)',
+                    partition_name, month_start, month_end
+                );
+            ELSE
+                EXECUTE format(
+                    'CREATE TABLE %I PARTITION OF DailyLog FOR VALUES FROM (%L) TO (%L)',
+                    partition_name, month_start, month_end
+                );
+            END IF;
+            created := created + 1;
+        END IF;
+        month_start := month_end;
+    END LOOP;
+    RETURN created;
+END $$;
+
+ALTER TABLE DailyLog RENAME TO DailyLog_legacy;
+ALTER SEQUENCE dailylog_log_id_seq OWNED BY NONE;
+ALTER SEQUENCE dailylog_log_id_seq AS BIGINT;
+
+-- Constraints and indexes are added after the copy, which is much faster
+-- than maintaining them row by row.
+CREATE TABLE DailyLog (
+    log_id BIGINT NOT NULL DEFAULT nextval('dailylog_log_id_seq'),
+    user_id BIGINT,
+    food_id INTEGER,
+    weight_grams FLOAT NOT NULL,
+    calories FLOAT NOT NULL,
+    log_date TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+) PARTITION BY RANGE (log_date);
+CREATE TABLE DailyLog_default PARTITION OF DailyLog DEFAULT;
+ALTER SEQUENCE dailylog_log_id_seq OWNED BY DailyLog.log_id;
+
+SELECT ensure_dailylog_partitions(
+    LEAST(COALESCE((SELECT MIN(log_date) FROM DailyLog_legacy), CURRENT_DATE), CURRENT_DATE)::date,
+    (CURRENT_DATE + INTERVAL '2 months')::date
+);
+
+INSERT INTO DailyLog (log_id, user_id, food_id, weight_grams, calories, log_date)
+SELECT log_id, user_id, food_id, weight_grams, calories, COALESCE(log_date, CURRENT_TIMESTAMP)
+FROM DailyLog_legacy;
+
+DROP TABLE DailyLog_legacy;
+
+ALTER TABLE DailyLog ADD PRIMARY KEY (log_id, log_date);
+ALTER TABLE DailyLog ADD FOREIGN KEY (user_id) REFERENCES Users(user_id);
+ALTER TABLE DailyLog ADD FOREIGN KEY (food_id) REFERENCES Foods(food_id);
+CREATE INDEX idx_dailylog_user_date
+    ON DailyLog (user_id, log_date) INCLUDE (calories, food_id, weight_grams);
+CREATE INDEX idx_dailylog_food
+    ON DailyLog (food_id);
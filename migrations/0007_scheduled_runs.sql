@@ -0,0 +1,12 @@
+-- One row per scheduled job and day, claimed by whichever process runs it
+-- first (see scheduler.claim_run).
+CREATE TABLE IF NOT EXISTS scheduled_runs (
+    job TEXT NOT NULL,
+    run_day DATE NOT NULL,
+    claimed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (job, run_day)
+);
+
+-- Keyset pages over users with a goal for the daily progress push.
+CREATE INDEX IF NOT EXISTS idx_users_goal
+    ON Users (user_id) WHERE calorie_goal IS NOT NULL;
@@ -0,0 +1,310 @@
+import asyncio
+import contextvars
+import logging
+import time
+from collections import OrderedDict
+from datetime import datetime
+
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.exceptions import TelegramAPIError, TelegramForbiddenError, TelegramRetryAfter
+from aiogram.methods import SendMessage
+from aiogram.types import Chat, Message, ReplyKeyboardMarkup
+
+# Telegram rejects longer messages, so longer merges are not attempted.
+MAX_MESSAGE_LENGTH = 4096
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    # Allows `rate` acquisitions per second on average with bursts of up to
+    # `capacity`. pause() empties the bucket and blocks everyone until the
+    # given delay is over, as Telegram asks for after a 429.
+
+    def __init__(self, rate: float, capacity: float = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(rate, 1)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._blocked_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def _refill(self, now: float):
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self, tokens: float = 1):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._blocked_until:
+                    await asyncio.sleep(self._blocked_until - now)
+                    continue
+                self._refill(now)
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return
+                await asyncio.sleep((tokens - self._tokens) / self.rate)
+
+    def pause(self, seconds: float):
+        now = time.monotonic()
+        self._blocked_until = max(self._blocked_until, now + seconds)
+        self._tokens = 0
+        self._updated = self._blocked_until
+
+
+class RateLimiter:
+    # Telegram's send limits as token buckets: one shared by every chat
+    # (`rate` messages per second) and one per chat (`chat_rate`, bursts of
+    # up to `chat_burst`). Buckets of the least recently used chats beyond
+    # `max_chats` are dropped; such a chat starts again with a full bucket.
+
+    def __init__(self, rate: float = 30, chat_rate: float = 1, chat_burst: float = 3, max_chats: int = 10000):
+        self.bucket = TokenBucket(rate)
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_chats = max_chats
+        self._chats = OrderedDict()
+        self.wait_seconds = 0.0
+        self.retried = 0
+        self.gave_up = 0
+
+    @property
+    def rate(self):
+        return self.bucket.rate
+
+    def set_rate(self, rate: float):
+        self.bucket = TokenBucket(rate)
+
+    def _chat(self, chat_id):
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            bucket = self._chats[chat_id] = TokenBucket(self.chat_rate, self.chat_burst)
+            while len(self._chats) > self.max_chats:
+                self._chats.popitem(last=False)
+        else:
+            self._chats.move_to_end(chat_id)
+        return bucket
+
+    async def acquire(self, chat_id):
+        started = time.monotonic()
+        await self._chat(chat_id).acquire()
+        await self.bucket.acquire()
+        self.wait_seconds += time.monotonic() - started
+
+    def pause(self, chat_id, seconds: float):
+        # A 429 does not say which limit was hit, so everyone waits.
+        self._chat(chat_id).pause(seconds)
+        self.bucket.pause(seconds)
+
+    def stats(self):
+        return {
+            "chats": len(self._chats),
+            "wait_seconds": self.wait_seconds,
+            "retried": self.retried,
+            "gave_up": self.gave_up,
+        }
+
+
+class RateLimitMiddleware(BaseRequestMiddleware):
+    # Bot session middleware: every request addressed to a chat waits for
+    # `limiter` first. A 429 pauses the limiter for retry_after and the
+    # request is retried up to `max_retries` times before TelegramRetryAfter
+    # reaches the caller. Requests without a chat (callback and inline
+    # query answers, getUpdates) pass straight through.
+
+    def __init__(self, limiter: RateLimiter, max_retries: int = 3):
+        self.limiter = limiter
+        self.max_retries = max_retries
+
+    async def __call__(self, make_request, bot, method):
+        chat_id = getattr(method, "chat_id", None)
+        if chat_id is None:
+            return await make_request(bot, method)
+        for attempt in range(self.max_retries + 1):
+            await self.limiter.acquire(chat_id)
+            try:
+                return await make_request(bot, method)
+            except TelegramRetryAfter as e:
+                self.limiter.pause(chat_id, e.retry_after)
+                if attempt == self.max_retries:
+                    self.limiter.gave_up += 1
+                    raise
+                self.limiter.retried += 1
+
+
+class ReplyCoalescer(BaseRequestMiddleware):
+    # Bot session middleware that merges the replies of one update. While
+    # buffer() (an outer update middleware) runs, each sendMessage is held
+    # until the next request or the end of the update; a following message
+    # to the same chat is appended to it when at most one of the two has a
+    # keyboard. A reply keyboard equal to the one the chat already shows is
+    # dropped first, since Telegram keeps showing it anyway. Held sends
+    # return a stand-in Message with message_id 0.
+    # What a chat shows is only known while every reply to it goes through
+    # this process; otherwise pass drop_keyboards=False.
+
+    def __init__(self, max_chats: int = 10000, drop_keyboards: bool = True):
+        self.max_chats = max_chats
+        self.drop_keyboards = drop_keyboards
+        self._keyboards = OrderedDict()
+        self._held = contextvars.ContextVar("held_reply", default=None)
+        self.merged = 0
+        self.keyboards_dropped = 0
+
+    def forget(self, chat_id):
+        # For replies that must carry their keyboard, e.g. after /start in
+        # a chat the user may have cleared.
+        self._keyboards.pop(chat_id, None)
+
+    async def buffer(self, handler, event, data):
+        held = []
+        token = self._held.set(held)
+        try:
+            return await handler(event, data)
+        finally:
+            self._held.reset(token)
+            await self._flush(held)
+
+    async def __call__(self, make_request, bot, method):
+        held = self._held.get()
+        if held is None:
+            return await make_request(bot, method)
+        if not isinstance(method, SendMessage) or not isinstance(method.chat_id, int):
+            await self._flush(held)
+            return await make_request(bot, method)
+        method = self._track_keyboard(method)
+        if held and self._mergeable(held[0][2], method):
+            previous = held[0][2]
+            held[0] = (make_request, bot, previous.model_copy(update={
+                "text": f"{previous.text.rstrip()}\n\n{method.text}",
+                "reply_markup": previous.reply_markup or method.reply_markup,
+            }))
+            self.merged += 1
+        else:
+            await self._flush(held)
+            held.append((make_request, bot, method))
+        return Message(
+            message_id=0, date=datetime.now(), chat=Chat(id=method.chat_id, type="private"), text=method.text
+        ).as_(bot)
+
+    def _track_keyboard(self, method: SendMessage):
+        if not self.drop_keyboards:
+            return method
+        chat_id = method.chat_id
+        markup = method.reply_markup
+        if isinstance(markup, ReplyKeyboardMarkup):
+            if self._keyboards.get(chat_id) == markup:
+                self._keyboards.move_to_end(chat_id)
+                self.keyboards_dropped += 1
+                return method.model_copy(update={"reply_markup": None})
+            self._keyboards[chat_id] = markup
+            self._keyboards.move_to_end(chat_id)
+            while len(self._keyboards) > self.max_chats:
+                self._keyboards.popitem(last=False)
+        elif markup is not None and not hasattr(markup, "inline_keyboard"):
+            # ReplyKeyboardRemove or ForceReply: the chat's keyboard is gone.
+            self.forget(chat_id)
+        return method
+
+    @staticmethod
+    def _mergeable(first: SendMessage, second: SendMessage):
+        if first.reply_markup is not None and second.reply_markup is not None:
+            return False
+        if first.entities or second.entities:
+            return False
+        if len(first.text) + len(second.text) + 2 > MAX_MESSAGE_LENGTH:
+            return False
+        exclude = {"text", "reply_markup"}
+        return first.model_dump(exclude=exclude) == second.model_dump(exclude=exclude)
+
+    async def _flush(self, held: list):
+        if not held:
+            return
+        make_request, bot, method = held.pop()
+        try:
+            await make_request(bot, method)
+        except Exception:
+            self.forget(method.chat_id)
+            raise
+
+    def stats(self):
+        return {
+            "chats": len(self._keyboards),
+            "merged": self.merged,
+            "keyboards_dropped": self.keyboards_dropped,
+        }
+
+
+class OutboundQueue:
+    # Bounded queue of messages sent by `concurrency` tasks through a shared
+    # TokenBucket, which keeps bulk sends below the bot-wide RateLimiter so
+    # replies to users still get through. send() waits while the queue is
+    # full, which throttles producers such as the scheduler. Flood waits are
+    # retried by the bot's RateLimitMiddleware; messages it gives up on are
+    # counted as failed, and users who blocked the bot are counted and
+    # skipped.
+
+    def __init__(self, bot, rate: float = 25, burst: float = None, concurrency: int = 8, max_queue: int = 1000):
+        self.bot = bot
+        self.bucket = TokenBucket(rate, burst)
+        self.concurrency = concurrency
+        self._queue = asyncio.Queue(maxsize=max_queue)
+        self._tasks = []
+        self.sent = 0
+        self.blocked = 0
+        self.failed = 0
+
+    def start(self):
+        self._tasks = [asyncio.create_task(self._run()) for _ in range(self.concurrency)]
+
+    async def send(self, chat_id: int, text: str, **kwargs):
+        await self._queue.put((chat_id, text, kwargs))
+
+    def qsize(self):
+        return self._queue.qsize()
+
+    async def join(self):
+        await self._queue.join()
+
+    async def close(self):
+        await self._queue.join()
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def _run(self):
+        while True:
+            chat_id, text, kwargs = await self._queue.get()
+            try:
+                await self._deliver(chat_id, text, kwargs)
+            except TelegramForbiddenError:
+                self.blocked += 1
+            except TelegramAPIError as e:
+                self.failed += 1
+                logger.warning(f"Failed to send message to {chat_id}: {e}")
+            except Exception as e:
+                self.failed += 1
+                logger.exception(f"Failed to send message to {chat_id}: {e}")
+            finally:
+                self._queue.task_done()
+
+    async def _deliver(self, chat_id: int, text: str, kwargs: dict):
+        await self.bucket.acquire()
+        try:
+            await self.bot.send_message(chat_id, text, **kwargs)
+        except TelegramRetryAfter as e:
+            # The session already waited out its retries; slow down the
+            # rest of the run too.
+            self.bucket.pause(e.retry_after)
+            raise
+        self.sent += 1
+
+    def stats(self):
+        return {
+            "queued": self._queue.qsize(),
+            "sent": self.sent,
+            "blocked": self.blocked,
+            "failed": self.failed,
+        }
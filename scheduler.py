@@ -0,0 +1,56 @@
+import asyncio
+import logging
+from datetime import date, datetime, time, timedelta
+
+logger = logging.getLogger(__name__)
+
+# Smaller than any Telegram user id, so the first page starts at the top.
+FIRST_USER_ID = -(2 ** 63)
+
+
+def progress_message(progress):
+    goal = progress.calorie_goal
+    total = progress.total_calories
+    if not progress.entry_count:
+        return f"🎯 Nothing logged today yet. Your daily goal is {goal:.0f} kcal."
+    percent = total / goal * 100
+    if total <= goal:
+        return f"🎯 Today: {total:.0f} of {goal:.0f} kcal ({percent:.0f}% of your goal, {goal - total:.0f} kcal left)."
+    return f"🎯 Today: {total:.0f} of {goal:.0f} kcal ({percent:.0f}% of your goal, {total - goal:.0f} kcal over)."
+
+
+async def send_daily_progress(storage, outbound, day: date, batch_size: int = 1000,
+                              format_message=progress_message):
+    # Streams users with a goal in keyset pages (storage.goal_progress_page)
+    # and hands each message to `outbound`. A page is fetched in full
+    # before it is queued, so a slow Telegram side only holds up this loop,
+    # not the database.
+    after = FIRST_USER_ID
+    users = 0
+    while True:
+        page = await storage.goal_progress_page(after, day, batch_size)
+        for progress in page:
+            await outbound.send(progress.user_id, format_message(progress))
+        users += len(page)
+        if len(page) < batch_size:
+            break
+        after = page[-1].user_id
+    await outbound.join()
+    return users
+
+
+def next_run(at: time, now: datetime):
+    run = datetime.combine(now.date(), at)
+    return run if run > now else run + timedelta(days=1)
+
+
+async def run_daily(at: time, job):
+    # Calls `job(day)` every day at local time `at`; failures are logged and
+    # the next day's run goes ahead as usual.
+    while True:
+        run = next_run(at, datetime.now())
+        await asyncio.sleep((run - datetime.now()).total_seconds())
+        try:
+            await job(run.date())
+        except Exception as e:
+            logger.exception(f"Scheduled job failed for {run.date()}: {e}")
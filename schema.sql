@@ -1,3 +1,7 @@
+-- Snapshot of the schema produced by migrations/. The bot applies those
+-- itself on start (or with `python food_log_bot.py migrate`); keep this
+-- file in step when adding a migration.
+
 CREATE TABLE IF NOT EXISTS Users (
     user_id BIGINT PRIMARY KEY,
     username TEXT,
@@ -17,13 +21,18 @@ CREATE TABLE IF NOT EXISTS Foods (
 );
 
 CREATE TABLE IF NOT EXISTS DailyLog (
-    log_id SERIAL PRIMARY KEY,
+    log_id BIGSERIAL,
     user_id BIGINT REFERENCES Users(user_id),
     food_id INTEGER REFERENCES Foods(food_id),
     weight_grams FLOAT NOT NULL,
     calories FLOAT NOT NULL,
-    log_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-);
+    log_date TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (log_id, log_date)
+) PARTITION BY RANGE (log_date);
+CREATE TABLE IF NOT EXISTS DailyLog_default PARTITION OF DailyLog DEFAULT;
+
+CREATE UNIQUE INDEX IF NOT EXISTS unique_global_food_name
+    ON Foods (food_name) WHERE user_id IS NULL;
 
 INSERT INTO Foods (food_name, calories_per_gram, user_id)
 VALUES
@@ -34,4 +43,87 @@ VALUES
     ('Salmon', 2.08, NULL),
     ('Broccoli', 0.35, NULL),
     ('Bread', 2.65, NULL)
-ON CONFLICT ON CONSTRAINT unique_food_user DO NOTHING;
\ No newline at end of file
+ON CONFLICT (food_name) WHERE user_id IS NULL DO NOTHING;
+
+CREATE INDEX IF NOT EXISTS idx_dailylog_user_date
+    ON DailyLog (user_id, log_date) INCLUDE (calories, food_id, weight_grams);
+CREATE INDEX IF NOT EXISTS idx_foods_user_name
+    ON Foods (user_id, food_name);
+CREATE INDEX IF NOT EXISTS idx_dailylog_food
+    ON DailyLog (food_id);
+
+-- Monthly partitions (dailylog_pYYYY_MM) are created by this function.
+CREATE OR REPLACE FUNCTION ensure_dailylog_partitions(first_month DATE, last_month DATE)
+RETURNS INTEGER
+LANGUAGE plpgsql AS $$
+DECLARE
+    month_start DATE := date_trunc('month', first_month);
+    month_end DATE;
+    partition_name TEXT;
+    created INTEGER := 0;
+BEGIN
+    WHILE month_start <= last_month LOOP
+        month_end := month_start + INTERVAL '1 month';
+        partition_name := format('dailylog_p%s', to_char(month_start, 'YYYY_MM'));
+        IF to_regclass(partition_name) IS NULL THEN
+            IF EXISTS (
+                SELECT 1 FROM DailyLog_default WHERE log_date >= month_start AND log_date < month_end
+            ) THEN
+                EXECUTE format('CREATE TABLE %I (LIKE DailyLog INCLUDING DEFAULTS)', partition_name);
+                EXECUTE format(
+                    'WITH moved AS (DELETE FROM DailyLog_default WHERE log_date >= %L AND log_date < %L RETURNING *)'
+                    ' INSERT INTO %I SELECT * FROM moved',
+                    month_start, month_end, partition_name
+                );
+                EXECUTE format(
+                    'ALTER TABLE DailyLog ATTACH PARTITION %I FOR VALUES FROM (%L) TO (%L)',
+                    partition_name, month_start, month_end
+                );
+            ELSE
+                EXECUTE format(
+                    'CREATE TABLE %I PARTITION OF DailyLog FOR VALUES FROM (%L) TO (%L)',
+                    partition_name, month_start, month_end
+                );
+            END IF;
+            created := created + 1;
+        END IF;
+        month_start := month_end;
+    END LOOP;
+    RETURN created;
+END $$;
+SELECT ensure_dailylog_partitions(CURRENT_DATE, (CURRENT_DATE + INTERVAL '2 months')::date);
+
+CREATE TABLE IF NOT EXISTS DailyCalories (
+    user_id BIGINT REFERENCES Users(user_id),
+    log_day DATE NOT NULL,
+    total_calories FLOAT NOT NULL DEFAULT 0,
+    total_grams FLOAT NOT NULL DEFAULT 0,
+    entry_count INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (user_id, log_day)
+);
+
+CREATE TABLE IF NOT EXISTS FsmStorage (
+    storage_key TEXT PRIMARY KEY,
+    state TEXT,
+    data JSONB NOT NULL DEFAULT '{}',
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS scheduled_runs (
+    job TEXT NOT NULL,
+    run_day DATE NOT NULL,
+    claimed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (job, run_day)
+);
+CREATE INDEX IF NOT EXISTS idx_users_goal
+    ON Users (user_id) WHERE calorie_goal IS NOT NULL;
+
+CREATE TABLE IF NOT EXISTS schema_version (
+    version INTEGER PRIMARY KEY,
+    name TEXT NOT NULL,
+    applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+INSERT INTO schema_version (version, name)
+VALUES (1, 'initial'), (2, 'lookup_indexes'), (3, 'fsm_storage'), (4, 'daily_calories'), (5, 'unique_global_foods'),
+    (6, 'partition_dailylog'), (7, 'scheduled_runs')
+ON CONFLICT (version) DO NOTHING;
@@ -0,0 +1,87 @@
+import logging
+import re
+from pathlib import Path
+from typing import NamedTuple
+
+import asyncpg
+
+logger = logging.getLogger(__name__)
+
+MIGRATIONS_DIR = Path(__file__).with_name("migrations")
+# pg_advisory_lock key shared by every process that migrates this database.
+MIGRATION_LOCK_ID = 7_246_713_001
+_FILE_NAME = re.compile(r"^(\d+)_(\w+)\.sql$")
+
+
+class Migration(NamedTuple):
+    version: int
+    name: str
+    sql: str
+
+
+def load_migrations(directory: Path = MIGRATIONS_DIR):
+    migrations = []
+    for path in directory.glob("*.sql"):
+        match = _FILE_NAME.match(path.name)
+        if match is None:
+            raise ValueError(f"Migration file {path.name} does not match NNNN_name.sql")
+        migrations.append(Migration(int(match.group(1)), match.group(2), path.read_text(encoding="utf-8")))
+    migrations.sort()
+    versions = [migration.version for migration in migrations]
+    if len(set(versions)) != len(versions):
+        raise ValueError(f"Duplicate migration versions in {directory}: {versions}")
+    return migrations
+
+
+async def current_version(conn: asyncpg.Connection):
+    try:
+        return await conn.fetchval("SELECT COALESCE(MAX(version), 0) FROM schema_version")
+    except asyncpg.UndefinedTableError:
+        return 0
+
+
+async def migrate(conn: asyncpg.Connection, migrations: list = None, target: int = None):
+    # Applies pending migrations in version order, each in its own
+    # transaction together with its schema_version row. When the schema is
+    # already current this is a single query; otherwise an advisory lock
+    # makes concurrent starters wait and then find nothing left to do.
+    migrations = load_migrations() if migrations is None else migrations
+    if target is not None:
+        migrations = [migration for migration in migrations if migration.version <= target]
+    if not migrations or await current_version(conn) >= migrations[-1].version:
+        return []
+    applied = []
+    await conn.execute("SELECT pg_advisory_lock($1)", MIGRATION_LOCK_ID)
+    try:
+        await conn.execute("""
+            CREATE TABLE IF NOT EXISTS schema_version (
+                version INTEGER PRIMARY KEY,
+                name TEXT NOT NULL,
+                applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+        done = {row['version'] for row in await conn.fetch("SELECT version FROM schema_version")}
+        for migration in migrations:
+            if migration.version in done:
+                continue
+            logger.info(f"Applying migration {migration.version:04d}_{migration.name}")
+            async with conn.transaction():
+                await conn.execute(migration.sql)
+                await conn.execute(
+                    "INSERT INTO schema_version (version, name) VALUES ($1, $2)",
+                    migration.version, migration.name
+                )
+            applied.append(migration)
+    finally:
+        await conn.execute("SELECT pg_advisory_unlock($1)", MIGRATION_LOCK_ID)
+    return applied
+
+
+async def status(conn: asyncpg.Connection, migrations: list = None):
+    migrations = load_migrations() if migrations is None else migrations
+    try:
+        rows = await conn.fetch("SELECT version, applied_at FROM schema_version")
+    except asyncpg.UndefinedTableError:
+        rows = []
+    applied = {row['version']: row['applied_at'] for row in rows}
+    return [(migration, applied.get(migration.version)) for migration in migrations]
@@ -0,0 +1,681 @@
+import asyncio
+import sqlite3
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+from functools import partial
+from typing import NamedTuple
+
+import asyncpg
+
+
+class DuplicateFoodError(Exception):
+    pass
+
+
+class FoodInUseError(Exception):
+    # The food has log entries, which keep it from being deleted.
+    pass
+
+
+# Errors that say the database was unreachable or busy, so the same write
+# may succeed later. Anything else, constraint violations in particular,
+# fails the same way on every attempt.
+RETRYABLE_ERRORS = (
+    OSError,
+    asyncio.TimeoutError,
+    asyncpg.PostgresConnectionError,
+    asyncpg.InterfaceError,
+    asyncpg.CannotConnectNowError,
+    asyncpg.TooManyConnectionsError,
+    sqlite3.OperationalError,
+)
+
+
+class LogEntry(NamedTuple):
+    food_name: str
+    weight_grams: float
+    calories: float
+    log_date: datetime
+
+
+class DayTotal(NamedTuple):
+    log_day: date
+    daily_calories: float
+
+
+class UserStats(NamedTuple):
+    foods_added: int
+    logs_created: int
+    avg_daily_calories: float
+
+
+class GoalProgress(NamedTuple):
+    user_id: int
+    calorie_goal: float
+    total_calories: float
+    entry_count: int
+
+
+class NutritionHistory(NamedTuple):
+    # Columns for analytics.build_report; days are offsets from the first
+    # day asked for.
+    calorie_goal: float
+    days: list
+    totals: list
+    food_ids: list
+    food_days: list
+    calories: list
+    grams: list
+
+
+class Storage(ABC):
+    # Everything the bot reads or writes, behind one interface. Foods come
+    # back as (food_id, food_name, calories_per_gram) rows; log rows are
+    # (user_id, food_id, weight_grams, calories, log_date) tuples. Day
+    # ranges are half-open: [start, end).
+
+    async def open(self):
+        pass
+
+    async def close(self):
+        pass
+
+    @abstractmethod
+    async def register_user(self, user_id: int, username: str, first_name: str, last_name: str, created_at: datetime):
+        ...
+
+    @abstractmethod
+    async def set_calorie_goal(self, user_id: int, calorie_goal: float):
+        ...
+
+    @abstractmethod
+    async def user_foods(self, user_id: int):
+        ...
+
+    @abstractmethod
+    async def global_foods(self):
+        ...
+
+    @abstractmethod
+    async def global_foods_version(self):
+        ...
+
+    @abstractmethod
+    async def add_food(self, user_id: int, food_name: str, calories_per_gram: float):
+        ...
+
+    @abstractmethod
+    async def update_food(self, user_id: int, food_id: int, field: str, value):
+        ...
+
+    @abstractmethod
+    async def delete_food(self, user_id: int, food_id: int):
+        ...
+
+    @abstractmethod
+    async def add_logs(self, rows: list):
+        ...
+
+    @abstractmethod
+    async def daily_summary(self, user_id: int, start: datetime, end: datetime):
+        ...
+
+    @abstractmethod
+    async def weekly_summary(self, user_id: int, start: date, end: date):
+        ...
+
+    @abstractmethod
+    async def user_stats(self, user_id: int):
+        ...
+
+    @abstractmethod
+    async def nutrition_history(self, user_id: int, first: date, days: int):
+        ...
+
+    @abstractmethod
+    async def nutrition_version(self, user_id: int):
+        # Cheap stand-in for nutrition_history: changes whenever a log entry
+        # or the calorie goal does.
+        ...
+
+    @abstractmethod
+    async def goal_progress_page(self, after: int, day: date, limit: int):
+        ...
+
+    @abstractmethod
+    async def claim_run(self, job: str, day: date):
+        ...
+
+    @abstractmethod
+    async def rebuild_daily_rollup(self):
+        ...
+
+
+FOOD_FIELDS = ("food_name", "calories_per_gram")
+
+
+def daily_rollup(rows):
+    rollup = {}
+    for user_id, _, weight, calories, logged_at in rows:
+        day = rollup.setdefault((user_id, logged_at.date()), [0.0, 0.0, 0])
+        day[0] += calories
+        day[1] += weight
+        day[2] += 1
+    return [key + tuple(totals) for key, totals in rollup.items()]
+
+
+ROLLUP_UPSERT_SQL = """
+    INSERT INTO DailyCalories (user_id, log_day, total_calories, total_grams, entry_count)
+    VALUES ($1, $2, $3, $4, $5)
+    ON CONFLICT (user_id, log_day) DO UPDATE SET
+        total_calories = DailyCalories.total_calories + EXCLUDED.total_calories,
+        total_grams = DailyCalories.total_grams + EXCLUDED.total_grams,
+        entry_count = DailyCalories.entry_count + EXCLUDED.entry_count
+"""
+
+DAILY_SUMMARY_SQL = """
+    SELECT f.food_name, dl.weight_grams, dl.calories, dl.log_date
+    FROM DailyLog dl
+    JOIN Foods f ON dl.food_id = f.food_id
+    WHERE dl.user_id = $1
+    AND dl.log_date >= $2
+    AND dl.log_date < $3
+    ORDER BY dl.log_date
+"""
+
+WEEKLY_SUMMARY_SQL = """
+    SELECT log_day, total_calories as daily_calories
+    FROM DailyCalories
+    WHERE user_id = $1
+    AND log_day >= $2
+    AND log_day < $3
+    ORDER BY log_day
+"""
+
+# One round trip returns the goal plus the user's last `$3` days as arrays
+# (decoded from asyncpg's binary format) with day offsets relative to `$2`.
+# Daily totals come from DailyCalories, per-food rows from DailyLog, whose
+# log_date range lets the planner prune to the partitions of that year.
+HISTORY_SQL = """
+    SELECT
+        (SELECT calorie_goal FROM Users WHERE user_id = $1) AS calorie_goal,
+        daily.days, daily.totals, log.food_ids, log.food_days, log.calories, log.grams
+    FROM (
+        SELECT array_agg(log_day - $2::date) AS days, array_agg(total_calories) AS totals
+        FROM DailyCalories
+        WHERE user_id = $1 AND log_day >= $2::date AND log_day < $2::date + $3::int
+    ) daily, (
+        SELECT array_agg(food_id) AS food_ids, array_agg(log_date::date - $2::date) AS food_days,
+               array_agg(calories) AS calories, array_agg(weight_grams) AS grams
+        FROM DailyLog
+        WHERE user_id = $1 AND log_date >= $2::date::timestamp AND log_date < ($2::date + $3::int)::timestamp
+    ) log
+"""
+
+# One keyset page of users with a goal, joined to that day's totals. The
+# partial index idx_users_goal keeps each page an index range scan no
+# matter how many users never set a goal.
+GOAL_PROGRESS_SQL = """
+    SELECT u.user_id, u.calorie_goal,
+           COALESCE(dc.total_calories, 0) AS total_calories,
+           COALESCE(dc.entry_count, 0) AS entry_count
+    FROM Users u
+    LEFT JOIN DailyCalories dc ON dc.user_id = u.user_id AND dc.log_day = $2
+    WHERE u.calorie_goal IS NOT NULL AND u.user_id > $1
+    ORDER BY u.user_id
+    LIMIT $3
+"""
+
+
+class PostgresStorage(Storage):
+    # Runs on connections from `connection_factory`; the bot owns the pool
+    # and the schema (see schema_migrations).
+
+    def __init__(self, connection_factory):
+        self._connection = connection_factory
+
+    async def register_user(self, user_id: int, username: str, first_name: str, last_name: str, created_at: datetime):
+        async with self._connection() as conn:
+            await conn.execute("""
+                INSERT INTO Users (user_id, username, first_name, last_name, created_at)
+                VALUES ($1, $2, $3, $4, $5)
+                ON CONFLICT (user_id) DO NOTHING
+            """, user_id, username, first_name, last_name, created_at)
+
+    async def set_calorie_goal(self, user_id: int, calorie_goal: float):
+        async with self._connection() as conn:
+            await conn.execute("""
+                UPDATE Users SET calorie_goal = $1 WHERE user_id = $2
+            """, calorie_goal, user_id)
+
+    async def user_foods(self, user_id: int):
+        async with self._connection() as conn:
+            return await conn.fetch("""
+                SELECT food_id, food_name, calories_per_gram
+                FROM Foods
+                WHERE user_id = $1
+                ORDER BY food_name
+            """, user_id)
+
+    async def global_foods(self):
+        async with self._connection() as conn:
+            return await conn.fetch("""
+                SELECT food_id, food_name, calories_per_gram
+                FROM Foods
+                WHERE user_id IS NULL
+                ORDER BY food_id
+            """)
+
+    async def global_foods_version(self):
+        async with self._connection() as conn:
+            return tuple(await conn.fetchrow("SELECT COUNT(*), MAX(food_id) FROM Foods WHERE user_id IS NULL"))
+
+    async def add_food(self, user_id: int, food_name: str, calories_per_gram: float):
+        try:
+            async with self._connection() as conn:
+                return await conn.fetchval("""
+                    INSERT INTO Foods (food_name, calories_per_gram, user_id)
+                    VALUES ($1, $2, $3)
+                    RETURNING food_id
+                """, food_name, calories_per_gram, user_id)
+        except asyncpg.UniqueViolationError as e:
+            raise DuplicateFoodError(food_name) from e
+
+    async def update_food(self, user_id: int, food_id: int, field: str, value):
+        if field not in FOOD_FIELDS:
+            raise ValueError(f"Unknown food field {field}")
+        try:
+            async with self._connection() as conn:
+                await conn.execute(f"""
+                    UPDATE Foods
+                    SET {field} = $1
+                    WHERE food_id = $2 AND user_id = $3
+                """, value, food_id, user_id)
+        except asyncpg.UniqueViolationError as e:
+            raise DuplicateFoodError(value) from e
+
+    async def delete_food(self, user_id: int, food_id: int):
+        try:
+            async with self._connection() as conn:
+                await conn.execute("DELETE FROM Foods WHERE food_id = $1 AND user_id = $2", food_id, user_id)
+        except asyncpg.ForeignKeyViolationError as e:
+            raise FoodInUseError(food_id) from e
+
+    async def add_logs(self, rows: list):
+        async with self._connection() as conn:
+            async with conn.transaction():
+                await conn.copy_records_to_table(
+                    "dailylog",
+                    records=rows,
+                    columns=["user_id", "food_id", "weight_grams", "calories", "log_date"],
+                )
+                await conn.executemany(ROLLUP_UPSERT_SQL, daily_rollup(rows))
+
+    async def daily_summary(self, user_id: int, start: datetime, end: datetime):
+        async with self._connection() as conn:
+            logs = await conn.fetch(DAILY_SUMMARY_SQL, user_id, start, end)
+            calorie_goal = await conn.fetchval("SELECT calorie_goal FROM Users WHERE user_id = $1", user_id)
+        return [LogEntry(*row) for row in logs], calorie_goal
+
+    async def weekly_summary(self, user_id: int, start: date, end: date):
+        async with self._connection() as conn:
+            days = await conn.fetch(WEEKLY_SUMMARY_SQL, user_id, start, end)
+            calorie_goal = await conn.fetchval("SELECT calorie_goal FROM Users WHERE user_id = $1", user_id)
+        return [DayTotal(*row) for row in days], calorie_goal
+
+    async def user_stats(self, user_id: int):
+        async with self._connection() as conn:
+            row = await conn.fetchrow("""
+                SELECT
+                    (SELECT COUNT(*) FROM Foods WHERE user_id = $1) as foods_added,
+                    (SELECT COALESCE(SUM(entry_count), 0) FROM DailyCalories WHERE user_id = $1) as logs_created,
+                    (SELECT AVG(total_calories) FROM DailyCalories WHERE user_id = $1) as avg_daily_calories
+            """, user_id)
+        return UserStats(*row)
+
+    async def nutrition_history(self, user_id: int, first: date, days: int):
+        async with self._connection() as conn:
+            return NutritionHistory(*await conn.fetchrow(HISTORY_SQL, user_id, first, days))
+
+    async def nutrition_version(self, user_id: int):
+        async with self._connection() as conn:
+            return tuple(await conn.fetchrow("""
+                SELECT (SELECT calorie_goal FROM Users WHERE user_id = $1), COALESCE(SUM(entry_count), 0), MAX(log_day)
+                FROM DailyCalories
+                WHERE user_id = $1
+            """, user_id))
+
+    async def goal_progress_page(self, after: int, day: date, limit: int):
+        async with self._connection() as conn:
+            rows = await conn.fetch(GOAL_PROGRESS_SQL, after, day, limit)
+        return [GoalProgress(*row) for row in rows]
+
+    async def claim_run(self, job: str, day: date):
+        async with self._connection() as conn:
+            claimed = await conn.fetchval("""
+                INSERT INTO scheduled_runs (job, run_day)
+                VALUES ($1, $2)
+                ON CONFLICT (job, run_day) DO NOTHING
+                RETURNING run_day
+            """, job, day)
+        return claimed is not None
+
+    async def rebuild_daily_rollup(self):
+        async with self._connection() as conn:
+            async with conn.transaction():
+                # Block concurrent log_food inserts so no row is counted twice or missed.
+                await conn.execute("LOCK TABLE DailyLog IN SHARE MODE")
+                await conn.execute("DELETE FROM DailyCalories")
+                status = await conn.execute("""
+                    INSERT INTO DailyCalories (user_id, log_day, total_calories, total_grams, entry_count)
+                    SELECT user_id, DATE(log_date), SUM(calories), SUM(weight_grams), COUNT(*)
+                    FROM DailyLog
+                    WHERE user_id IS NOT NULL
+                    GROUP BY user_id, DATE(log_date)
+                """)
+        return int(status.split()[-1])
+
+
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS Users (
+    user_id INTEGER PRIMARY KEY,
+    username TEXT,
+    first_name TEXT,
+    last_name TEXT,
+    calorie_goal REAL,
+    created_at TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_users_goal ON Users (user_id) WHERE calorie_goal IS NOT NULL;
+
+CREATE TABLE IF NOT EXISTS Foods (
+    food_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    food_name TEXT NOT NULL,
+    calories_per_gram REAL NOT NULL,
+    user_id INTEGER REFERENCES Users(user_id),
+    created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+    CONSTRAINT unique_food_user UNIQUE (food_name, user_id)
+);
+CREATE UNIQUE INDEX IF NOT EXISTS unique_global_food_name ON Foods (food_name) WHERE user_id IS NULL;
+
+CREATE TABLE IF NOT EXISTS DailyLog (
+    log_id INTEGER PRIMARY KEY,
+    user_id INTEGER REFERENCES Users(user_id),
+    food_id INTEGER REFERENCES Foods(food_id),
+    weight_grams REAL NOT NULL,
+    calories REAL NOT NULL,
+    log_date TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_dailylog_user_date ON DailyLog (user_id, log_date);
+CREATE INDEX IF NOT EXISTS idx_dailylog_food ON DailyLog (food_id);
+
+CREATE TABLE IF NOT EXISTS DailyCalories (
+    user_id INTEGER REFERENCES Users(user_id),
+    log_day TEXT NOT NULL,
+    total_calories REAL NOT NULL DEFAULT 0,
+    total_grams REAL NOT NULL DEFAULT 0,
+    entry_count INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (user_id, log_day)
+);
+
+CREATE TABLE IF NOT EXISTS scheduled_runs (
+    job TEXT NOT NULL,
+    run_day TEXT NOT NULL,
+    claimed_at TEXT DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (job, run_day)
+);
+
+INSERT INTO Foods (food_name, calories_per_gram, user_id)
+VALUES
+    ('Apple', 0.52, NULL),
+    ('Chicken Breast', 1.65, NULL),
+    ('Rice', 1.30, NULL),
+    ('Banana', 0.89, NULL),
+    ('Salmon', 2.08, NULL),
+    ('Broccoli', 0.35, NULL),
+    ('Bread', 2.65, NULL)
+ON CONFLICT DO NOTHING;
+"""
+
+
+def _timestamp(value: datetime):
+    # Fixed-width ISO text, so string comparison orders like time does.
+    return value.isoformat(sep=" ", timespec="microseconds")
+
+
+class SqliteStorage(Storage):
+    # Embedded engine for single-node deployments and tests: one SQLite
+    # connection (a file, or ":memory:") used from a single worker thread,
+    # so calls are serialised and each method is one transaction. Dates are
+    # stored as ISO text.
+
+    def __init__(self, path: str = ":memory:"):
+        self.path = path
+        self._conn = None
+        self._executor = None
+
+    async def _run(self, function, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, partial(function, *args))
+
+    def _open(self):
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute("PRAGMA foreign_keys = ON")
+        if self.path != ":memory:":
+            self._conn.execute("PRAGMA journal_mode = WAL")
+            self._conn.execute("PRAGMA synchronous = NORMAL")
+        self._conn.executescript(SQLITE_SCHEMA)
+
+    async def open(self):
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sqlite")
+        await self._run(self._open)
+
+    async def close(self):
+        if self._conn is not None:
+            await self._run(self._conn.close)
+            self._conn = None
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+    def _execute(self, query: str, *params):
+        with self._conn:
+            return self._conn.execute(query, params)
+
+    def _fetchall(self, query: str, *params):
+        return self._conn.execute(query, params).fetchall()
+
+    def _fetchone(self, query: str, *params):
+        return self._conn.execute(query, params).fetchone()
+
+    async def register_user(self, user_id: int, username: str, first_name: str, last_name: str, created_at: datetime):
+        await self._run(self._execute, """
+            INSERT INTO Users (user_id, username, first_name, last_name, created_at)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT (user_id) DO NOTHING
+        """, user_id, username, first_name, last_name, _timestamp(created_at))
+
+    async def set_calorie_goal(self, user_id: int, calorie_goal: float):
+        await self._run(self._execute, "UPDATE Users SET calorie_goal = ? WHERE user_id = ?", calorie_goal, user_id)
+
+    async def user_foods(self, user_id: int):
+        return await self._run(self._fetchall, """
+            SELECT food_id, food_name, calories_per_gram
+            FROM Foods
+            WHERE user_id = ?
+            ORDER BY food_name
+        """, user_id)
+
+    async def global_foods(self):
+        return await self._run(self._fetchall, """
+            SELECT food_id, food_name, calories_per_gram
+            FROM Foods
+            WHERE user_id IS NULL
+            ORDER BY food_id
+        """)
+
+    async def global_foods_version(self):
+        return tuple(await self._run(self._fetchone, "SELECT COUNT(*), MAX(food_id) FROM Foods WHERE user_id IS NULL"))
+
+    async def add_food(self, user_id: int, food_name: str, calories_per_gram: float):
+        try:
+            cursor = await self._run(self._execute, """
+                INSERT INTO Foods (food_name, calories_per_gram, user_id)
+                VALUES (?, ?, ?)
+            """, food_name, calories_per_gram, user_id)
+        except sqlite3.IntegrityError as e:
+            if "UNIQUE" not in str(e):
+                raise
+            raise DuplicateFoodError(food_name) from e
+        return cursor.lastrowid
+
+    async def update_food(self, user_id: int, food_id: int, field: str, value):
+        if field not in FOOD_FIELDS:
+            raise ValueError(f"Unknown food field {field}")
+        try:
+            await self._run(self._execute, f"""
+                UPDATE Foods
+                SET {field} = ?
+                WHERE food_id = ? AND user_id = ?
+            """, value, food_id, user_id)
+        except sqlite3.IntegrityError as e:
+            if "UNIQUE" not in str(e):
+                raise
+            raise DuplicateFoodError(value) from e
+
+    async def delete_food(self, user_id: int, food_id: int):
+        try:
+            await self._run(self._execute, "DELETE FROM Foods WHERE food_id = ? AND user_id = ?", food_id, user_id)
+        except sqlite3.IntegrityError as e:
+            if "FOREIGN KEY" not in str(e):
+                raise
+            raise FoodInUseError(food_id) from e
+
+    def _add_logs(self, rows: list):
+        with self._conn:
+            self._conn.executemany("""
+                INSERT INTO DailyLog (user_id, food_id, weight_grams, calories, log_date)
+                VALUES (?, ?, ?, ?, ?)
+            """, [(user_id, food_id, weight, calories, _timestamp(logged_at))
+                  for user_id, food_id, weight, calories, logged_at in rows])
+            self._conn.executemany("""
+                INSERT INTO DailyCalories (user_id, log_day, total_calories, total_grams, entry_count)
+                VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT (user_id, log_day) DO UPDATE SET
+                    total_calories = total_calories + excluded.total_calories,
+                    total_grams = total_grams + excluded.total_grams,
+                    entry_count = entry_count + excluded.entry_count
+            """, [(user_id, day.isoformat(), *totals) for user_id, day, *totals in daily_rollup(rows)])
+
+    async def add_logs(self, rows: list):
+        await self._run(self._add_logs, rows)
+
+    def _goal(self, user_id: int):
+        row = self._fetchone("SELECT calorie_goal FROM Users WHERE user_id = ?", user_id)
+        return row[0] if row else None
+
+    def _daily_summary(self, user_id: int, start: datetime, end: datetime):
+        rows = self._fetchall("""
+            SELECT f.food_name, dl.weight_grams, dl.calories, dl.log_date
+            FROM DailyLog dl
+            JOIN Foods f ON dl.food_id = f.food_id
+            WHERE dl.user_id = ? AND dl.log_date >= ? AND dl.log_date < ?
+            ORDER BY dl.log_date
+        """, user_id, _timestamp(start), _timestamp(end))
+        logs = [LogEntry(name, weight, calories, datetime.fromisoformat(logged_at))
+                for name, weight, calories, logged_at in rows]
+        return logs, self._goal(user_id)
+
+    async def daily_summary(self, user_id: int, start: datetime, end: datetime):
+        return await self._run(self._daily_summary, user_id, start, end)
+
+    def _weekly_summary(self, user_id: int, start: date, end: date):
+        rows = self._fetchall("""
+            SELECT log_day, total_calories
+            FROM DailyCalories
+            WHERE user_id = ? AND log_day >= ? AND log_day < ?
+            ORDER BY log_day
+        """, user_id, start.isoformat(), end.isoformat())
+        return [DayTotal(date.fromisoformat(day), total) for day, total in rows], self._goal(user_id)
+
+    async def weekly_summary(self, user_id: int, start: date, end: date):
+        return await self._run(self._weekly_summary, user_id, start, end)
+
+    async def user_stats(self, user_id: int):
+        return UserStats(*await self._run(self._fetchone, """
+            SELECT
+                (SELECT COUNT(*) FROM Foods WHERE user_id = ?1),
+                (SELECT COALESCE(SUM(entry_count), 0) FROM DailyCalories WHERE user_id = ?1),
+                (SELECT AVG(total_calories) FROM DailyCalories WHERE user_id = ?1)
+        """, user_id))
+
+    def _nutrition_history(self, user_id: int, first: date, days: int):
+        end = first + timedelta(days=days)
+        totals = self._fetchall("""
+            SELECT log_day, total_calories FROM DailyCalories
+            WHERE user_id = ? AND log_day >= ? AND log_day < ?
+        """, user_id, first.isoformat(), end.isoformat())
+        logs = self._fetchall("""
+            SELECT food_id, substr(log_date, 1, 10), calories, weight_grams FROM DailyLog
+            WHERE user_id = ? AND log_date >= ? AND log_date < ?
+        """, user_id, first.isoformat(), end.isoformat())
+        offsets = {}
+
+        def offset(day: str):
+            if day not in offsets:
+                offsets[day] = (date.fromisoformat(day) - first).days
+            return offsets[day]
+
+        return NutritionHistory(
+            calorie_goal=self._goal(user_id),
+            days=[offset(day) for day, _ in totals],
+            totals=[total for _, total in totals],
+            food_ids=[row[0] for row in logs],
+            food_days=[offset(row[1]) for row in logs],
+            calories=[row[2] for row in logs],
+            grams=[row[3] for row in logs],
+        )
+
+    async def nutrition_history(self, user_id: int, first: date, days: int):
+        return await self._run(self._nutrition_history, user_id, first, days)
+
+    async def nutrition_version(self, user_id: int):
+        goal, entries, last_day = await self._run(self._fetchone, """
+            SELECT (SELECT calorie_goal FROM Users WHERE user_id = ?1), COALESCE(SUM(entry_count), 0), MAX(log_day)
+            FROM DailyCalories
+            WHERE user_id = ?1
+        """, user_id)
+        return goal, entries, last_day and date.fromisoformat(last_day)
+
+    async def goal_progress_page(self, after: int, day: date, limit: int):
+        rows = await self._run(self._fetchall, """
+            SELECT u.user_id, u.calorie_goal,
+                   COALESCE(dc.total_calories, 0),
+                   COALESCE(dc.entry_count, 0)
+            FROM Users u
+            LEFT JOIN DailyCalories dc ON dc.user_id = u.user_id AND dc.log_day = ?
+            WHERE u.calorie_goal IS NOT NULL AND u.user_id > ?
+            ORDER BY u.user_id
+            LIMIT ?
+        """, day.isoformat(), after, limit)
+        return [GoalProgress(*row) for row in rows]
+
+    async def claim_run(self, job: str, day: date):
+        cursor = await self._run(self._execute, """
+            INSERT INTO scheduled_runs (job, run_day) VALUES (?, ?)
+            ON CONFLICT (job, run_day) DO NOTHING
+        """, job, day.isoformat())
+        return cursor.rowcount == 1
+
+    def _rebuild_daily_rollup(self):
+        with self._conn:
+            self._conn.execute("DELETE FROM DailyCalories")
+            return self._conn.execute("""
+                INSERT INTO DailyCalories (user_id, log_day, total_calories, total_grams, entry_count)
+                SELECT user_id, substr(log_date, 1, 10), SUM(calories), SUM(weight_grams), COUNT(*)
+                FROM DailyLog
+                WHERE user_id IS NOT NULL
+                GROUP BY user_id, substr(log_date, 1, 10)
+            """).rowcount
+
+    async def rebuild_daily_rollup(self):
+        return await self._run(self._rebuild_daily_rollup)
@@ -0,0 +1,8 @@
+import os
+import sys
+from pathlib import Path
+
+# food_log_bot picks its storage backend at import time.
+os.environ["STORAGE_BACKEND"] = "memory"
+os.environ.pop("LOG_WRITE_BEHIND", None)
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
@@ -0,0 +1,98 @@
+import asyncio
+from datetime import date
+
+import pytest
+
+from analytics import WINDOWS, AnalyticsCache, build_report
+
+SPAN = WINDOWS[-1]
+DAY = date(2026, 3, 31)
+
+
+def test_empty_history():
+    report = build_report(DAY, None, [], [], [], [], [], [])
+    assert report.logging_streak == 0
+    assert report.rolling_avg == 0.0
+    for length, window in report.windows.items():
+        assert (window.days, window.logged_days, window.total_calories, window.top_foods) == (length, 0, 0.0, [])
+
+
+def test_windows_streaks_and_top_foods():
+    # Logged the last three days and once 100 days ago.
+    days = [SPAN - 100, SPAN - 3, SPAN - 2, SPAN - 1]
+    totals = [3000.0, 1500.0, 2500.0, 1800.0]
+    food_ids = [1, 1, 2, 2, 1]
+    food_days = [SPAN - 100, SPAN - 3, SPAN - 2, SPAN - 1, SPAN - 1]
+    calories = [3000.0, 1500.0, 2500.0, 1000.0, 800.0]
+    grams = [600.0, 300.0, 400.0, 200.0, 160.0]
+    report = build_report(DAY, 2000.0, days, totals, food_ids, food_days, calories, grams)
+
+    assert report.logging_streak == 3
+    assert report.goal_streak == 1
+    assert report.longest_goal_streak == 1
+    assert report.rolling_avg == pytest.approx((1500 + 2500 + 1800) / 3)
+
+    month = report.windows[30]
+    assert month.logged_days == 3
+    assert month.total_calories == pytest.approx(5800)
+    assert month.goal_days == 2
+    assert month.rolling_low == pytest.approx(1500)
+    assert [(food.food_id, food.calories, food.entries) for food in month.top_foods] == [(2, 3500.0, 2), (1, 2300.0, 2)]
+
+    year = report.windows[365]
+    assert year.logged_days == 4
+    assert year.top_foods[0].food_id == 1
+    assert year.top_foods[0].grams == pytest.approx(1060)
+
+
+def test_streak_survives_an_unlogged_today():
+    report = build_report(DAY, 2000.0, [SPAN - 3, SPAN - 2], [1000.0, 1000.0], [], [], [], [])
+    assert report.logging_streak == 2
+    assert report.goal_streak == 2
+
+
+def test_no_goal_means_no_goal_days():
+    report = build_report(DAY, None, [SPAN - 1], [500.0], [], [], [], [])
+    assert report.goal_streak == 0
+    assert report.windows[30].goal_days == 0
+
+
+class FakeStorage:
+    def __init__(self):
+        self.version = (2000.0, 0, None)
+        self.history_reads = 0
+
+    async def nutrition_version(self, user_id: int):
+        return self.version
+
+    async def nutrition_history(self, user_id: int, first: date, days: int):
+        self.history_reads += 1
+        return self.version[0], [], [], [], [], [], []
+
+
+def test_cache_notices_writes_made_elsewhere():
+    async def scenario():
+        storage = FakeStorage()
+        cache = AnalyticsCache(storage, ttl=0)
+        await cache.report(7, DAY)
+        await cache.report(7, DAY)
+        assert storage.history_reads == 1
+        # Another instance logged a meal.
+        storage.version = (2000.0, 3, DAY)
+        await cache.report(7, DAY)
+        assert storage.history_reads == 2
+        cache.invalidate(7)
+        await cache.report(7, DAY)
+        assert storage.history_reads == 3
+    asyncio.run(scenario())
+
+
+def test_cache_trusts_fresh_reports_within_ttl():
+    async def scenario():
+        storage = FakeStorage()
+        cache = AnalyticsCache(storage, ttl=600)
+        await cache.report(7, DAY)
+        storage.version = (1800.0, 0, None)
+        await cache.report(7, DAY)
+        assert storage.history_reads == 1
+    asyncio.run(scenario())
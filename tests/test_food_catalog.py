@@ -0,0 +1,67 @@
+import asyncio
+
+from food_catalog import CachedFood, FoodCatalogCache
+
+GLOBAL_FOODS = [(1, "Apple", 0.52), (2, "Rice", 1.3), (3, "Chicken Breast", 1.65)]
+
+
+class FakeStorage:
+    def __init__(self, user_foods: dict):
+        self._user_foods = user_foods
+
+    async def global_foods(self):
+        return GLOBAL_FOODS
+
+    async def global_foods_version(self):
+        return len(GLOBAL_FOODS), max(food_id for food_id, *_ in GLOBAL_FOODS)
+
+    async def user_foods(self, user_id: int):
+        return self._user_foods.get(user_id, [])
+
+
+def run(scenario, user_foods: dict = None):
+    asyncio.run(scenario(FoodCatalogCache(FakeStorage(user_foods or {}))))
+
+
+def test_resolve_ignores_case_and_spacing():
+    async def scenario(catalog):
+        assert (await catalog.resolve(7, "Chicken Breast")).food_id == 3
+        assert (await catalog.resolve(7, "  chicken   BREAST ")).food_id == 3
+        assert await catalog.resolve(7, "chicken") is None
+    run(scenario)
+
+
+def test_resolve_prefers_custom_foods():
+    async def scenario(catalog):
+        assert (await catalog.resolve(7, "rice")).food_id == 10
+        assert (await catalog.resolve(8, "rice")).food_id == 2
+        # A custom food whose name merely starts with the query is no match.
+        assert (await catalog.resolve(7, "Rice cakes")).food_id == 11
+    run(scenario, {7: [(10, "RICE", 1.2), (11, "Rice cakes", 3.9)]})
+
+
+def test_resolve_follows_renames_and_deletes():
+    async def scenario(catalog):
+        await catalog.resolve(7, "kiwi")
+        catalog.food_updated(7, 10, food_name="Kiwi fruit")
+        assert (await catalog.resolve(7, "kiwi")).food_id == 11
+        catalog.food_deleted(7, 11)
+        assert await catalog.resolve(7, "kiwi") is None
+        catalog.food_added(7, CachedFood(12, "Kiwi", 0.6))
+        assert (await catalog.resolve(7, "KIWI")).food_id == 12
+        assert (await catalog.resolve(7, "kiwi fruit")).food_id == 10
+    run(scenario, {7: [(10, "Kiwi", 0.6), (11, "kiwi", 0.61)]})
+
+
+def test_foods_added_elsewhere_are_found(monkeypatch):
+    async def scenario(catalog):
+        assert await catalog.resolve(7, "kiwi") is None
+        # Another instance added it; the cached entry doesn't know yet.
+        user_foods[7].append((10, "Kiwi", 0.6))
+        assert await catalog.resolve(7, "kiwi") is None
+        monkeypatch.setattr(FoodCatalogCache, "recheck_after", 0)
+        assert (await catalog.resolve(7, "kiwi")).food_id == 10
+        assert (await catalog.lookup(7, "Kiwi")).food_id == 10
+
+    user_foods = {7: []}
+    run(scenario, user_foods)
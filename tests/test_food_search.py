@@ -0,0 +1,51 @@
+from food_search import FoodIndex, normalize
+
+FOODS = [(1, "Apple"), (2, "Apple pie"), (3, "Pineapple"), (4, "Rice"), (5, "Brown rice"), (6, "Chicken Breast")]
+
+
+def test_normalize():
+    assert normalize("  Chicken   BREAST ") == "chicken breast"
+
+
+def test_prefix_matches_come_first():
+    index = FoodIndex(FOODS)
+    assert index.search("app") == [1, 2]
+    assert index.search("apple")[:2] == [1, 2]
+    assert 3 in index.search("apple")
+
+
+def test_trigram_match_inside_names():
+    index = FoodIndex(FOODS)
+    assert index.search("rice") == [4, 5]
+    assert index.search("breast") == [6]
+    assert index.search("zzz") == []
+
+
+def test_limit_and_empty_query():
+    index = FoodIndex(FOODS)
+    assert index.search("apple", limit=1) == [1]
+    assert index.search("   ") == []
+    assert index.search("apple", limit=0) == []
+
+
+def test_add_remove_and_rename():
+    index = FoodIndex(FOODS)
+    index.add(7, "Rice cakes")
+    assert index.search("rice c") == [7, 4, 5]
+    index.add(7, "Oat cakes")
+    assert index.search("rice c") == [4, 5]
+    assert index.search("oat") == [7]
+    index.remove(4)
+    assert 4 not in index
+    assert index.search("rice") == [5]
+    assert len(index) == len(FOODS)
+
+
+def test_deferred_compaction():
+    index = FoodIndex(FOODS)
+    for food_id, _ in FOODS[:4]:
+        index.remove(food_id, compact=False)
+    assert index.needs_compaction
+    index.compact()
+    assert not index.needs_compaction
+    assert index.search("rice") == [5]
@@ -0,0 +1,127 @@
+import asyncio
+import json
+from contextlib import asynccontextmanager
+
+from aiogram.fsm.storage.base import StorageKey
+
+from fsm_storage import PostgresFSMStorage
+
+KEY = StorageKey(bot_id=1, chat_id=5, user_id=5)
+
+
+class FakeTable:
+    # Stands in for the FsmStorage table and counts round trips.
+    def __init__(self):
+        self.rows = {}
+        self.selects = 0
+        self.flushes = 0
+
+    @asynccontextmanager
+    async def connection(self):
+        yield self
+
+    @asynccontextmanager
+    async def transaction(self):
+        self.flushes += 1
+        yield
+
+    async def fetchrow(self, query: str, storage_key: str):
+        self.selects += 1
+        return self.rows.get(storage_key)
+
+    async def executemany(self, query: str, upserts: list):
+        for storage_key, state, data, state_dirty, data_dirty in upserts:
+            row = self.rows.setdefault(storage_key, {"state": None, "data": "{}"})
+            if state_dirty:
+                row["state"] = state
+            if data_dirty:
+                row["data"] = data
+
+    async def execute(self, query: str, storage_keys: list):
+        for storage_key in storage_keys:
+            self.rows.pop(storage_key, None)
+
+
+def write_through(table: FakeTable):
+    return PostgresFSMStorage(table.connection, cache_ttl=0, flush_delay=0)
+
+
+async def in_update(storage: PostgresFSMStorage, handler):
+    return await storage.update_scope(lambda event, data: handler(), None, {})
+
+
+def test_one_read_and_one_flush_per_update():
+    async def scenario():
+        table = FakeTable()
+        storage = write_through(table)
+
+        async def choose_food():
+            await storage.get_state(KEY)
+            await storage.get_data(KEY)
+            await storage.set_state(KEY, "LogFood:weight")
+            await storage.set_data(KEY, {"food": "Apple"})
+            await storage.set_data(KEY, {"food": "Apple", "page": 0})
+            return await storage.get_data(KEY)
+
+        assert await in_update(storage, choose_food) == {"food": "Apple", "page": 0}
+        assert (table.selects, table.flushes) == (1, 1)
+        assert table.rows[storage.key_builder.build(KEY)]["state"] == "LogFood:weight"
+        assert json.loads(table.rows[storage.key_builder.build(KEY)]["data"]) == {"food": "Apple", "page": 0}
+    asyncio.run(scenario())
+
+
+def test_clearing_an_empty_record_writes_nothing():
+    async def scenario():
+        table = FakeTable()
+        storage = write_through(table)
+
+        async def summary():
+            await storage.get_state(KEY)
+            await storage.set_state(KEY, None)
+            await storage.set_data(KEY, {})
+
+        await in_update(storage, summary)
+        assert (table.selects, table.flushes) == (1, 0)
+    asyncio.run(scenario())
+
+
+def test_every_update_reads_the_table_again():
+    async def scenario():
+        table = FakeTable()
+        storage = write_through(table)
+
+        async def read():
+            return await storage.get_state(KEY)
+
+        await in_update(storage, lambda: storage.set_state(KEY, "A:b"))
+        # Another instance moved the user on in the meantime.
+        table.rows[storage.key_builder.build(KEY)]["state"] = "A:c"
+        assert await in_update(storage, read) == "A:c"
+        assert table.selects == 1
+    asyncio.run(scenario())
+
+
+def test_writes_are_flushed_when_the_handler_fails():
+    async def scenario():
+        table = FakeTable()
+        storage = write_through(table)
+
+        async def failing():
+            await storage.set_state(KEY, "A:b")
+            raise RuntimeError("handler failed")
+
+        try:
+            await in_update(storage, failing)
+        except RuntimeError:
+            pass
+        assert table.rows[storage.key_builder.build(KEY)]["state"] == "A:b"
+    asyncio.run(scenario())
+
+
+def test_without_update_scope_writes_go_through():
+    async def scenario():
+        table = FakeTable()
+        storage = write_through(table)
+        await storage.set_state(KEY, "A:b")
+        assert table.flushes == 1
+    asyncio.run(scenario())
@@ -0,0 +1,229 @@
+import asyncio
+import itertools
+from datetime import datetime
+
+import pytest
+from aiogram import Bot
+
+import food_log_bot
+import metrics
+from analytics import AnalyticsCache
+from benchmarks.load import StubSession, callback_update, current_calls, find_callback, message_update
+from food_catalog import FoodCatalogCache
+from storage import SqliteStorage
+
+user_ids = itertools.count(1000)
+
+
+class Chat:
+    # One user talking to the bot through dp.feed_update; every call
+    # returns the Bot API methods the handlers sent in reply.
+    def __init__(self, bot: Bot, user_id: int):
+        self.bot = bot
+        self.user_id = user_id
+
+    async def _feed(self, update):
+        calls = []
+        current_calls.set(calls)
+        await food_log_bot.dp.feed_update(self.bot, update)
+        return calls
+
+    async def send(self, text: str):
+        return await self._feed(message_update(self.user_id, text))
+
+    async def tap(self, data: str):
+        return await self._feed(callback_update(self.user_id, data))
+
+    async def reply(self, text: str):
+        return texts(await self.send(text))[-1]
+
+
+def texts(calls: list):
+    return [method.text for method in calls if getattr(method, "text", None)]
+
+
+@pytest.fixture
+def run_bot(monkeypatch):
+    # Every test gets its own in-memory database and caches.
+    storage = SqliteStorage(":memory:")
+    monkeypatch.setattr(food_log_bot, "storage", storage)
+    monkeypatch.setattr(food_log_bot, "food_catalog", FoodCatalogCache(storage))
+    monkeypatch.setattr(food_log_bot, "analytics_cache", AnalyticsCache(storage))
+
+    def run(scenario, write_behind: bool = False):
+        monkeypatch.setitem(food_log_bot.LOG_WRITER_CONFIG, "enabled", write_behind)
+
+        async def main():
+            bot = food_log_bot.prepare_bot(Bot(token="123456:" + "A" * 35, session=StubSession()), rate_limit=False)
+            await food_log_bot.open_storage()
+            await food_log_bot.start_log_writer()
+            try:
+                chat = Chat(bot, next(user_ids))
+                await chat.send("/start")
+                await scenario(chat)
+            finally:
+                await food_log_bot.stop_log_writer()
+                await food_log_bot.close_storage()
+
+        asyncio.run(main())
+    return run
+
+
+def test_log_food(run_bot):
+    async def scenario(chat):
+        assert await chat.reply("🍽️ Log Food") == "Select a food item to log:"
+        await chat.send("Apple")
+        assert await chat.reply("200") == "Logged Apple: 200.0g (104.0 kcal)"
+        logs, total, _ = await food_log_bot.get_daily_summary(chat.user_id, datetime.now())
+        assert [(log.food_name, log.weight_grams) for log in logs] == [("Apple", 200.0)]
+        assert total == pytest.approx(104.0)
+    run_bot(scenario)
+
+
+def test_log_food_rejects_bad_weight(run_bot):
+    async def scenario(chat):
+        await chat.send("🍽️ Log Food")
+        await chat.send("Apple")
+        await chat.send("a lot")
+        logs, _, _ = await food_log_bot.get_daily_summary(chat.user_id, datetime.now())
+        assert logs == []
+    run_bot(scenario)
+
+
+def test_log_meal(run_bot):
+    async def scenario(chat):
+        await chat.send("🍱 Log Meal")
+        reply = await chat.reply("rice 200, Chicken  breast 150g; 80 g apple")
+        assert reply.startswith("Logged meal:")
+        assert "Total:" in reply
+        logs, _, _ = await food_log_bot.get_daily_summary(chat.user_id, datetime.now())
+        assert sorted(log.food_name for log in logs) == ["Apple", "Chicken Breast", "Rice"]
+    run_bot(scenario)
+
+
+def test_log_meal_with_unknown_food_writes_nothing(run_bot):
+    async def scenario(chat):
+        await chat.send("🍱 Log Meal")
+        reply = await chat.reply("rice 200, unicorn 50")
+        assert "unicorn" in reply
+        logs, _, _ = await food_log_bot.get_daily_summary(chat.user_id, datetime.now())
+        assert logs == []
+    run_bot(scenario)
+
+
+def test_add_update_and_delete_food(run_bot):
+    async def scenario(chat):
+        await chat.send("➕ Add Food")
+        await chat.send("Kiwi")
+        assert await chat.reply("0.6") == "Food added successfully!"
+
+        await chat.send("➕ Add Food")
+        await chat.send("Kiwi")
+        assert "already exists" in await chat.reply("0.7")
+
+        calls = await chat.send("📖 My Foods")
+        assert "🍽️ Kiwi: 0.60 kcal/g" in texts(calls)[0]
+        await chat.tap(find_callback(calls, "update_", "Kiwi"))
+        await chat.tap("field_calories_per_gram")
+        assert await chat.reply("0.65") == "Food updated successfully!"
+        food = await food_log_bot.food_catalog.resolve(chat.user_id, "kiwi")
+        assert food.calories_per_gram == pytest.approx(0.65)
+
+        calls = await chat.send("📖 My Foods")
+        await chat.tap(find_callback(calls, "update_", "Kiwi"))
+        await chat.tap("field_food_name")
+        assert await chat.reply("Kiwi fruit") == "Food updated successfully!"
+        assert await food_log_bot.food_catalog.resolve(chat.user_id, "kiwi") is None
+
+        calls = await chat.send("📖 My Foods")
+        assert texts(await chat.tap(find_callback(calls, "delete_", "Kiwi fruit")))[0] == "Food deleted successfully!"
+        assert await food_log_bot.get_user_foods(chat.user_id) == []
+    run_bot(scenario)
+
+
+def test_deleting_a_logged_food_keeps_its_queued_logs(run_bot):
+    # The delete waits for the queued log row, which is written, and then
+    # refuses to delete the food it refers to.
+    async def scenario(chat):
+        await chat.send("➕ Add Food")
+        await chat.send("Kiwi")
+        await chat.send("0.6")
+        await chat.send("🍽️ Log Food")
+        await chat.send("Kiwi")
+        await chat.send("100")
+        assert food_log_bot.log_writer.has_pending(chat.user_id)
+        calls = await chat.send("📖 My Foods")
+        calls = await chat.tap(find_callback(calls, "delete_", "Kiwi"))
+        assert texts(calls) == ["This food has log entries and can't be deleted."]
+        assert type(calls[-1]).__name__ == "AnswerCallbackQuery"
+        assert (food_log_bot.log_writer.rows, food_log_bot.log_writer.dropped) == (1, 0)
+        assert [food.food_name for food in await food_log_bot.get_user_foods(chat.user_id)] == ["Kiwi"]
+    run_bot(scenario, write_behind=True)
+
+
+def test_summaries(run_bot):
+    async def scenario(chat):
+        await chat.send("🎯 Set Calorie Goal")
+        assert await chat.reply("1800") == "Daily calorie goal set to 1800.0 kcal!"
+        await chat.send("🍱 Log Meal")
+        await chat.send("apple 100, rice 100")
+
+        daily = await chat.reply("📅 Daily Summary")
+        assert "🍽️ Apple: 100.0g (52.0 kcal)" in daily
+        assert "Calorie Goal: 1800.0 kcal" in daily
+        weekly = await chat.reply("📊 Weekly Summary")
+        assert weekly.startswith("Weekly Summary (Last 7 Days):")
+        assert f"📅 {datetime.now().date()}:" in weekly
+        monthly = await chat.reply("📈 Monthly Report")
+        assert "Days logged: 1/30" in monthly
+        assert "Top foods:" in monthly
+        assert "Days logged: 1/365" in await chat.reply("🗓️ Yearly Report")
+    run_bot(scenario, write_behind=True)
+
+
+def test_daily_reports_are_sent_once_per_day(run_bot):
+    async def scenario(chat):
+        await chat.send("🎯 Set Calorie Goal")
+        await chat.send("2000")
+        await chat.send("🍽️ Log Food")
+        await chat.send("Apple")
+        await chat.send("100")
+        day = datetime.now().date()
+        calls = []
+        current_calls.set(calls)
+        assert await food_log_bot.send_daily_reports(chat.bot, day) == 1
+        assert [method.chat_id for method in calls] == [chat.user_id]
+        assert await food_log_bot.send_daily_reports(chat.bot, day) == 0
+        assert await food_log_bot.send_daily_reports(chat.bot, day, force=True) == 1
+    run_bot(scenario)
+
+
+@pytest.mark.parametrize("text, items", [
+    ("rice 200", [("rice", 200.0)]),
+    ("rice 200, chicken breast 150g; 80 g broccoli", [("rice", 200.0), ("chicken breast", 150.0), ("broccoli", 80.0)]),
+    ("Apple 12.5 grams\nbread 30gr", [("Apple", 12.5), ("bread", 30.0)]),
+    ("rice 200,, ,", [("rice", 200.0)]),
+])
+def test_parse_meal(text, items):
+    assert food_log_bot.parse_meal(text) == items
+
+
+@pytest.mark.parametrize("text", ["", " , ", "rice", "rice 0", "200"])
+def test_parse_meal_rejects(text):
+    with pytest.raises(ValueError):
+        food_log_bot.parse_meal(text)
+
+
+def test_fsm_transitions_are_counted(run_bot):
+    transitions = metrics.fsm_transitions._values
+
+    async def scenario(chat):
+        before = dict(transitions)
+        await chat.send("🍽️ Log Food")
+        await chat.send("Apple")
+        await chat.send("100")
+        changes = {labels: count - before.get(labels, 0) for labels, count in transitions.items()}
+        assert changes[("none", "LogFoodForm:food_name")] == 1
+        assert changes[("LogFoodForm:food_name", "LogFoodForm:weight")] == 1
+        assert changes[("LogFoodForm:weight", "none")] == 1
+    run_bot(scenario)
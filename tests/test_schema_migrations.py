@@ -0,0 +1,32 @@
+import pytest
+
+from schema_migrations import MIGRATIONS_DIR, load_migrations
+
+
+def test_bundled_migrations_are_ordered():
+    migrations = load_migrations()
+    assert migrations[0].version == 1
+    assert [migration.version for migration in migrations] == list(range(1, len(migrations) + 1))
+    assert len(migrations) == len(list(MIGRATIONS_DIR.glob("*.sql")))
+    assert all(migration.sql.strip() for migration in migrations)
+
+
+def test_migrations_sort_by_version(tmp_path):
+    (tmp_path / "0010_later.sql").write_text("SELECT 10;")
+    (tmp_path / "0002_earlier.sql").write_text("SELECT 2;")
+    assert [(migration.version, migration.name) for migration in load_migrations(tmp_path)] == [
+        (2, "earlier"), (10, "later"),
+    ]
+
+
+def test_bad_file_name(tmp_path):
+    (tmp_path / "add_users.sql").write_text("SELECT 1;")
+    with pytest.raises(ValueError, match="NNNN_name"):
+        load_migrations(tmp_path)
+
+
+def test_duplicate_versions(tmp_path):
+    (tmp_path / "0001_initial.sql").write_text("SELECT 1;")
+    (tmp_path / "1_again.sql").write_text("SELECT 1;")
+    with pytest.raises(ValueError, match="Duplicate"):
+        load_migrations(tmp_path)
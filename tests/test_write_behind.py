@@ -0,0 +1,127 @@
+import asyncio
+import itertools
+import sqlite3
+
+from write_behind import WriteBehindQueue
+
+
+class Sink:
+    # write_batch stand-in: rows with a negative value violate a
+    # constraint, and the first `outages` calls fail as if the database
+    # were down.
+    def __init__(self, outages: int = 0):
+        self.batches = []
+        self.outages = outages
+
+    async def write(self, rows: list):
+        if self.outages:
+            self.outages -= 1
+            raise ConnectionResetError("database is down")
+        if any(value < 0 for _, value in rows):
+            raise sqlite3.IntegrityError("CHECK constraint failed")
+        self.batches.append(list(rows))
+
+
+def run(scenario):
+    asyncio.run(scenario())
+
+
+def test_groups_are_batched_and_flushed():
+    async def scenario():
+        sink = Sink()
+        queue = WriteBehindQueue(sink.write, batch_size=4, flush_interval=60)
+        queue.start()
+        await queue.put(1, [(1, 10), (1, 11), (1, 12)])
+        await queue.put(2, [(2, 20), (2, 21)])
+        await queue.put(1, [(1, 13)])
+        assert queue.has_pending(1)
+        await queue.flush()
+        assert not queue.has_pending(1)
+        # A meal is never split, so the first batch goes a row over size.
+        assert sink.batches == [[(1, 10), (1, 11), (1, 12), (2, 20), (2, 21)], [(1, 13)]]
+        assert (queue.rows, queue.batches, queue.dropped) == (6, 2, 0)
+        await queue.close()
+    run(scenario)
+
+
+def test_flush_interval():
+    async def scenario():
+        sink = Sink()
+        queue = WriteBehindQueue(sink.write, batch_size=100, flush_interval=0.01)
+        queue.start()
+        await queue.put(1, [(1, 10)])
+        await asyncio.sleep(0.1)
+        assert sink.batches == [[(1, 10)]]
+        await queue.close()
+    run(scenario)
+
+
+def test_failing_group_is_dropped():
+    async def scenario():
+        sink = Sink()
+        queue = WriteBehindQueue(sink.write, batch_size=100, flush_interval=60)
+        queue.start()
+        await queue.put(1, [(1, 10)])
+        await queue.put(2, [(2, 20), (2, -1)])
+        await queue.put(3, [(3, 30)])
+        await queue.flush()
+        assert sink.batches == [[(1, 10)], [(3, 30)]]
+        assert (queue.rows, queue.dropped) == (2, 2)
+        assert not queue.has_pending(2)
+        await queue.close()
+    run(scenario)
+
+
+def test_connection_errors_are_retried(monkeypatch):
+    async def scenario():
+        sink = Sink(outages=2)
+        queue = WriteBehindQueue(sink.write, batch_size=100, flush_interval=60, retry_errors=(OSError,))
+        queue.start()
+        await queue.put(1, [(1, 10)])
+        await queue.flush()
+        assert sink.batches == [[(1, 10)]]
+        assert (queue.rows, queue.dropped) == (1, 0)
+        await queue.close()
+
+    sleep = asyncio.sleep
+    monkeypatch.setattr(asyncio, "sleep", lambda delay: sleep(0))
+    run(scenario)
+
+
+def test_close_drains_the_queue():
+    async def scenario():
+        sink = Sink()
+        queue = WriteBehindQueue(sink.write, batch_size=100, flush_interval=60)
+        queue.start()
+        await queue.put(1, [(1, 10)])
+        await queue.close()
+        assert sink.batches == [[(1, 10)]]
+    run(scenario)
+
+
+def test_wait_for_ignores_other_keys():
+    async def scenario():
+        async def slow_write(rows: list):
+            await asyncio.sleep(0.02)
+        queue = WriteBehindQueue(slow_write, batch_size=5, flush_interval=0.05)
+        queue.start()
+        running = True
+
+        async def others():
+            # Keeps the queue busy for as long as the test runs.
+            for i in itertools.count():
+                if not running:
+                    break
+                await queue.put(i % 50 + 100, [(i, 1)])
+                await asyncio.sleep(0.002)
+
+        producer = asyncio.create_task(others())
+        await asyncio.sleep(0.1)
+        await queue.put(1, [(1, 10)])
+        await asyncio.wait_for(queue.wait_for(1), 1)
+        assert not queue.has_pending(1)
+        await queue.wait_for(2)
+        running = False
+        await producer
+        await queue.close()
+    run(scenario)
@@ -0,0 +1,145 @@
+import asyncio
+import logging
+import multiprocessing
+import os
+import queue
+
+logger = logging.getLogger(__name__)
+
+
+class WorkerSupervisor:
+    # Runs `worker_target(index, queue, supervisor_pid)` in N spawned processes and routes
+    # each payload to the worker owning its shard key, so everything for one
+    # user is handled, in order, by the same process. Queues are bounded:
+    # dispatch() waits when a worker falls behind, which pushes back on the
+    # update source as long as it awaits dispatch() before fetching more
+    # (start_polling(handle_as_tasks=False)). Dispatches to one worker are
+    # serialized so concurrent callers can't reorder a user's updates while
+    # waiting on a full queue. Crashed workers are restarted on the same queue.
+
+    def __init__(self, worker_target, workers: int, queue_size: int = 1000):
+        self._context = multiprocessing.get_context("spawn")
+        self._target = worker_target
+        self.queues = [self._context.Queue(maxsize=queue_size) for _ in range(workers)]
+        self.processes = [None] * workers
+        self.restarts = [0] * workers
+        self.routed = [0] * workers
+        self._locks = [asyncio.Lock() for _ in range(workers)]
+        self._stopping = False
+
+    def _spawn(self, index: int):
+        process = self._context.Process(
+            target=self._target,
+            args=(index, self.queues[index], os.getpid()),
+            name=f"food-log-worker-{index}",
+            daemon=True,
+        )
+        process.start()
+        self.processes[index] = process
+        logger.info(f"Started worker {index} (pid {process.pid})")
+
+    def start(self):
+        for index in range(len(self.queues)):
+            self._spawn(index)
+
+    def worker_for(self, shard_key: int):
+        return shard_key % len(self.queues)
+
+    async def dispatch(self, shard_key: int, payload):
+        index = self.worker_for(shard_key)
+        worker_queue = self.queues[index]
+        item = (shard_key, payload)
+        async with self._locks[index]:
+            try:
+                worker_queue.put_nowait(item)
+            except queue.Full:
+                await asyncio.get_running_loop().run_in_executor(None, worker_queue.put, item)
+        self.routed[index] += 1
+
+    def queue_depths(self):
+        return [worker_queue.qsize() for worker_queue in self.queues]
+
+    def stats(self):
+        return [
+            {
+                "worker": index,
+                "pid": process.pid if process else None,
+                "alive": bool(process and process.is_alive()),
+                "queue_depth": depth,
+                "routed": self.routed[index],
+                "restarts": self.restarts[index],
+            }
+            for index, (process, depth) in enumerate(zip(self.processes, self.queue_depths()))
+        ]
+
+    def check_workers(self):
+        for index, process in enumerate(self.processes):
+            if self._stopping or process is None or process.is_alive():
+                continue
+            logger.error(f"Worker {index} (pid {process.pid}) exited with code {process.exitcode}, restarting")
+            self.restarts[index] += 1
+            self._spawn(index)
+
+    async def monitor(self, interval: float = 5, stats_interval: float = 60):
+        elapsed = 0.0
+        while True:
+            await asyncio.sleep(interval)
+            self.check_workers()
+            elapsed += interval
+            if stats_interval and elapsed >= stats_interval:
+                elapsed = 0.0
+                logger.info(f"Worker queue depths: {self.queue_depths()}, restarts: {self.restarts}")
+
+    async def stop(self, timeout: float = 30):
+        self._stopping = True
+        loop = asyncio.get_running_loop()
+        for worker_queue in self.queues:
+            try:
+                await loop.run_in_executor(None, worker_queue.put, None, True, timeout)
+            except queue.Full:
+                pass
+        for index, process in enumerate(self.processes):
+            if process is None:
+                continue
+            await loop.run_in_executor(None, process.join, timeout)
+            if process.is_alive():
+                logger.warning(f"Worker {index} did not stop within {timeout}s, terminating")
+                process.terminate()
+
+
+async def consume(worker_queue, parent_pid: int, handle, concurrency: int = 100):
+    # Worker side of WorkerSupervisor: pulls (shard_key, payload) items until
+    # the stop sentinel arrives or the supervisor process disappears. Items
+    # with the same shard key run one after another; different keys run
+    # concurrently, up to `concurrency` at a time.
+    loop = asyncio.get_running_loop()
+    slots = asyncio.Semaphore(concurrency)
+    tails = {}
+
+    async def run(shard_key, payload, previous):
+        try:
+            if previous is not None:
+                await asyncio.gather(previous, return_exceptions=True)
+            await handle(payload)
+        except Exception as e:
+            logger.exception(f"Failed to handle update for {shard_key}: {e}")
+        finally:
+            slots.release()
+            if tails.get(shard_key) is asyncio.current_task():
+                del tails[shard_key]
+
+    while True:
+        try:
+            item = await loop.run_in_executor(None, worker_queue.get, True, 1.0)
+        except queue.Empty:
+            if os.getppid() != parent_pid:
+                logger.warning("Supervisor went away, stopping worker")
+                break
+            continue
+        if item is None:
+            break
+        shard_key, payload = item
+        await slots.acquire()
+        tails[shard_key] = asyncio.create_task(run(shard_key, payload, tails.get(shard_key)))
+    if tails:
+        await asyncio.gather(*tails.values(), return_exceptions=True)
@@ -0,0 +1,136 @@
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class WriteBehindQueue:
+    # Collects groups of rows in a bounded queue (`max_queue` groups) and
+    # hands them to `write_batch` in batches of about `batch_size` rows, at
+    # the latest `flush_interval` seconds after the first group of a batch
+    # arrived. A group, e.g. one meal, is never split across batches.
+    # put() waits while the queue is full. Writes failing with one of
+    # `retry_errors` (the database is unreachable or busy) are retried until
+    # they succeed. Any other error, such as a constraint violation, would
+    # fail the same way again: the batch is then written one group at a time
+    # and the groups that still fail are logged and dropped, so one bad row
+    # can't stall the queue.
+    # wait_for(key) returns once the last group queued under `key` is done
+    # (written or dropped) without waiting for anyone else's; close() flushes
+    # everything still queued.
+
+    def __init__(self, write_batch, batch_size: int = 500, flush_interval: float = 0.5, max_queue: int = 10000,
+                 retry_errors: tuple = (OSError, asyncio.TimeoutError)):
+        self._write_batch = write_batch
+        self.retry_errors = retry_errors
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue = asyncio.Queue(maxsize=max_queue)
+        self._last = {}
+        self._queued_rows = 0
+        self._flush_requested = asyncio.Event()
+        self._task = None
+        self.batches = 0
+        self.rows = 0
+        self.dropped = 0
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def put(self, key, rows: list):
+        done = asyncio.get_running_loop().create_future()
+        await self._queue.put((key, rows, done))
+        self._last[key] = done
+        self._queued_rows += len(rows)
+        if self._queued_rows >= self.batch_size:
+            self._flush_requested.set()
+
+    def has_pending(self, key):
+        return key in self._last
+
+    def qsize(self):
+        return self._queue.qsize()
+
+    async def flush(self):
+        self._flush_requested.set()
+        await self._queue.join()
+
+    async def wait_for(self, key):
+        done = self._last.get(key)
+        if done is not None:
+            self._flush_requested.set()
+            await asyncio.shield(done)
+
+    def _take(self, batch: list, item):
+        batch.append(item)
+        self._queued_rows -= len(item[1])
+        return len(item[1])
+
+    async def _collect(self):
+        batch = []
+        rows = self._take(batch, await self._queue.get())
+        deadline = asyncio.get_running_loop().time() + self.flush_interval
+        while rows < self.batch_size:
+            try:
+                rows += self._take(batch, self._queue.get_nowait())
+                continue
+            except asyncio.QueueEmpty:
+                pass
+            remaining = deadline - asyncio.get_running_loop().time()
+            if remaining <= 0 or self._flush_requested.is_set():
+                break
+            try:
+                await asyncio.wait_for(self._flush_requested.wait(), remaining)
+            except asyncio.TimeoutError:
+                pass
+        if self._queue.empty():
+            self._flush_requested.clear()
+        return batch
+
+    async def _run(self):
+        while True:
+            batch = await self._collect()
+            rows = [row for _, group, _ in batch for row in group]
+            dropped = 0
+            try:
+                await self._write(rows)
+            except Exception as e:
+                logger.warning(f"Failed to write batch of {len(rows)} rows ({e!r}), writing it one group at a time")
+                for _, group, _ in batch:
+                    try:
+                        await self._write(group)
+                    except Exception as e:
+                        dropped += len(group)
+                        logger.error(f"Dropped {len(group)} log rows {group!r}: {e!r}")
+            self.batches += 1
+            self.rows += len(rows) - dropped
+            self.dropped += dropped
+            for key, _, done in batch:
+                done.set_result(None)
+                if self._last.get(key) is done:
+                    del self._last[key]
+                self._queue.task_done()
+
+    async def _write(self, rows: list):
+        delay = 0.5
+        while True:
+            try:
+                return await self._write_batch(rows)
+            except self.retry_errors as e:
+                logger.error(f"Failed to write batch of {len(rows)} rows, retrying in {delay:.1f}s: {e!r}")
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 30)
+
+    async def close(self, timeout: float = 30):
+        if self._task is None:
+            return
+        try:
+            await asyncio.wait_for(self.flush(), timeout)
+        except asyncio.TimeoutError:
+            logger.error(f"Write-behind queue not drained within {timeout}s, {self._queued_rows} rows lost")
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None